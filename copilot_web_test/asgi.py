@@ -0,0 +1,3 @@
+from webapp.async_api import create_asgi_app
+
+app = create_asgi_app()
@@ -0,0 +1,114 @@
+"""
+Load test comparing the WSGI and async API tiers.
+
+Logs in once through the Flask app, then drives the same mix of search
+(and, with --activity, activity log) requests at each target with a fixed
+number of concurrent clients, and reports throughput and p50/p90/p99
+latency per target. Both tiers read the Flask session cookie, so one login
+serves both. Start the two servers first, e.g.
+
+    uwsgi --http :5000 --module wsgi:app --processes 5 --enable-threads
+    uvicorn asgi:app --port 8000
+
+    python -m benchmarks.bench_async --wsgi http://localhost:5000 --asgi http://localhost:8000 \\
+        --concurrency 50 --requests 2000
+"""
+import time
+import random
+import asyncio
+import argparse
+import httpx
+
+WORDS = ['market', 'policy', 'film', 'data', 'report', 'budget', 'manager', 'growth', 'service', 'energy']
+SORTS = ['date_sent', 'title', 'sender_name', 'comment_count']
+
+
+def request_paths(count, rng, activity=False):
+    """A reproducible mix of API paths; count=exact keeps the count cache from hiding the database."""
+    paths = []
+    for _ in range(count):
+        if activity and rng.random() < 0.2:
+            paths.append(f'/api/activity?format=json&page={rng.randint(1, 20)}&per_page=25')
+            continue
+        terms = ' '.join(rng.sample(WORDS, rng.randint(1, 2)))
+        paths.append(f'/api/search?format=json&search_term={terms}&sort_by={rng.choice(SORTS)}'
+                     f'&page={rng.randint(1, 10)}&per_page=50&count=exact')
+    return paths
+
+
+def login(base_url, username, password):
+    with httpx.Client(base_url=base_url) as client:
+        response = client.post('/auth/login', data={'username': username, 'password': password})
+        if response.status_code != 302 or 'session' not in client.cookies:
+            raise SystemExit(f'Login to {base_url} failed with status {response.status_code}')
+        return client.cookies['session']
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def run_load(base_url, cookie, paths, concurrency, timeout):
+    """Returns (elapsed seconds, latencies in ms, error count)."""
+    latencies = []
+    errors = 0
+    work = iter(paths)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, cookies={'session': cookie}, limits=limits,
+                                 timeout=timeout) as client:
+        async def worker():
+            nonlocal errors
+            for path in work:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+    return elapsed, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--wsgi', help='Base URL of the WSGI (uWSGI) app.')
+    parser.add_argument('--asgi', help='Base URL of the async API tier.')
+    parser.add_argument('--login-url', help='Where to log in; defaults to --wsgi.')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once.')
+    parser.add_argument('--requests', type=int, default=1000, help='Requests per target.')
+    parser.add_argument('--warmup', type=int, default=50, help='Unmeasured requests per target first.')
+    parser.add_argument('--activity', action='store_true', help='Mix in activity log pages (needs an admin login).')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Per-request timeout in seconds.')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    targets = [(name, url) for name, url in (('wsgi', args.wsgi), ('asgi', args.asgi)) if url]
+    if not targets:
+        parser.error('give --wsgi, --asgi or both')
+
+    cookie = login(args.login_url or args.wsgi or args.asgi, args.username, args.password)
+    paths = request_paths(args.requests, random.Random(args.seed), args.activity)
+    warmup = request_paths(args.warmup, random.Random(args.seed + 1), args.activity)
+
+    print(f"{'target':<6} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, url in targets:
+        asyncio.run(run_load(url, cookie, warmup, args.concurrency, args.timeout))
+        elapsed, latencies, errors = asyncio.run(run_load(url, cookie, paths, args.concurrency, args.timeout))
+        latencies.sort()
+        print(f"{name:<6} {len(latencies):>9} {errors:>7} {len(latencies) / elapsed:>8.1f} "
+              f"{percentile(latencies, 0.50):>8.1f} {percentile(latencies, 0.90):>8.1f} "
+              f"{percentile(latencies, 0.99):>8.1f} {latencies[-1] if latencies else 0:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
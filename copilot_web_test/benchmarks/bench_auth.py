@@ -0,0 +1,89 @@
+"""
+Measures the cost of authentication on the request path.
+
+Logs in against the configured database and times authenticated requests
+with the user identity cache off and on, then compares a refused
+(throttled) login with one whose password is actually checked:
+
+    python -m benchmarks.bench_auth --username admin --password password --path /api/search?format=json
+"""
+import time
+import argparse
+import statistics
+from webapp import create_app
+from webapp.auth.identity import identity_cache
+from webapp.auth.throttle import login_throttle
+from webapp.instrumentation import count_queries
+
+
+def percentile(timings, fraction):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def time_requests(app, username, password, path, requests, use_cache):
+    app.config['USER_CACHE_ENABLED'] = use_cache
+    identity_cache.clear()
+    client = app.test_client()
+    response = client.post('/auth/login', data={'username': username, 'password': password})
+    if response.status_code != 302:
+        raise SystemExit(f"Login as {username} failed ({response.status_code}).")
+
+    timings = []
+    queries = 0
+    for _ in range(requests):
+        with count_queries() as counter:
+            started = time.perf_counter()
+            client.get(path)
+            timings.append(time.perf_counter() - started)
+        queries += counter.count
+    return timings, queries / requests
+
+
+def time_logins(app, username, attempts):
+    """Median time of a failed login that is checked and of one that is throttled."""
+    client = app.test_client()
+    results = {}
+    for throttled in (False, True):
+        # Fresh buckets; with the throttle off every attempt is hashed
+        login_throttle.init_app(app)
+        login_throttle.enabled = throttled
+        if throttled:
+            while login_throttle.allow(username, '127.0.0.1'):
+                login_throttle.failed(username, '127.0.0.1')
+        timings = []
+        for _ in range(attempts):
+            started = time.perf_counter()
+            client.post('/auth/login', data={'username': username, 'password': 'wrong password'})
+            timings.append(time.perf_counter() - started)
+        results[throttled] = statistics.median(timings) * 1000
+    login_throttle.init_app(app)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--path', default='/', help='Authenticated page to request.')
+    parser.add_argument('--requests', type=int, default=500, help='Requests per run.')
+    parser.add_argument('--logins', type=int, default=20, help='Failed logins per run.')
+    args = parser.parse_args()
+
+    app = create_app()
+
+    print(f"{'user loader':<14} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8}")
+    for use_cache in (False, True):
+        timings, queries = time_requests(app, args.username, args.password, args.path, args.requests, use_cache)
+        label = 'cached' if use_cache else 'db_session.get'
+        print(f"{label:<14} {statistics.mean(timings) * 1000:>8.2f} {percentile(timings, 0.5) * 1000:>8.2f} "
+              f"{percentile(timings, 0.95) * 1000:>8.2f} {queries:>8.1f}")
+
+    print()
+    logins = time_logins(app, args.username, args.logins)
+    print(f"failed login, password checked: {logins[False]:.2f} ms")
+    print(f"failed login, throttled:        {logins[True]:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Measures the cold start of a worker.
+
+Starts fresh Python processes one after another, and in each one times
+importing the webapp package, create_app() and the first request, which
+compiles its templates and (for a page that reads the database) opens the
+first connection. --migrate also runs the schema upgrade that create_app
+used to run on every start, to show what it cost:
+
+    python -m benchmarks.bench_cold_start --runs 10 --path /auth/login --migrate
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+PROBE = '''
+import sys, json, time
+started = time.perf_counter()
+import webapp
+imported = time.perf_counter()
+app = webapp.create_app()
+created = time.perf_counter()
+migrated = created
+if sys.argv[2] == 'migrate':
+    from webapp.database import get_engine
+    from webapp.migrate import upgrade
+    upgrade(get_engine())
+    migrated = time.perf_counter()
+status = app.test_client().get(sys.argv[1]).status_code
+served = time.perf_counter()
+print(json.dumps({
+    'import': (imported - started) * 1000,
+    'create_app': (created - imported) * 1000,
+    'migrate': (migrated - created) * 1000,
+    'first_request': (served - migrated) * 1000,
+    'total': (served - started) * 1000,
+    'status': status,
+}))
+'''
+
+PHASES = ['import', 'create_app', 'migrate', 'first_request', 'total']
+
+
+def cold_start(path, migrate):
+    """The phase timings (ms) of one fresh process."""
+    result = subprocess.run([sys.executable, '-c', PROBE, path, 'migrate' if migrate else 'serve'],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"Worker failed to start:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the cold start of a fresh worker process.')
+    parser.add_argument('--runs', type=int, default=10, help='Fresh processes to start.')
+    parser.add_argument('--path', default='/auth/login', help='Path of the first request.')
+    parser.add_argument('--migrate', action='store_true', help='Also time the schema upgrade that used to run at startup.')
+    args = parser.parse_args()
+
+    runs = [cold_start(args.path, args.migrate) for _ in range(args.runs)]
+    statuses = sorted({run['status'] for run in runs})
+    phases = [phase for phase in PHASES if args.migrate or phase != 'migrate']
+
+    print(f"{args.runs} cold starts, first request GET {args.path} -> {statuses}")
+    print(f"{'phase':<14} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+    for phase in phases:
+        timings = [run[phase] for run in runs]
+        print(f"{phase:<14} {statistics.median(timings):>10.1f} {min(timings):>8.1f} {max(timings):>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
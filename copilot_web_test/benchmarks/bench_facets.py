@@ -0,0 +1,103 @@
+"""
+Times /api/search/facets' get_search_facets on a local SQLite database.
+
+Reuses the synthetic emails of bench_search_index (seeding them if the
+database does not hold --emails of them yet), rebuilds email_facet_counts
+and times each search's facets uncached, and again from the result cache.
+For searches the facet table can answer, it also times the grouped pass
+over the emails that the table replaces:
+
+    python -m benchmarks.bench_facets --emails 1000000 --db bench_search_index.db
+"""
+import os
+import time
+import argparse
+import statistics
+from sqlalchemy import create_engine, select, func
+from config import Config
+from webapp.database import Base, db_session
+from webapp.models import Email, EmailToken, EmailFacetCount
+from webapp.search_index import build_index
+from webapp.facets import rebuild_facet_counts
+from webapp.result_cache import result_cache
+from webapp.services import get_search_facets, search_plan, build_facet_statement
+from benchmarks.bench_search_index import seed
+
+# (label, query, sender, email_type, start_date, end_date, date_filter, has_comments)
+SEARCHES = [
+    ('everything', '', '', '', '', '', '', False),
+    ('one sender', '', 'Sender07', '', '', '', '', False),
+    ('type + 3 months', '', '', 'Work', '2024-01-01', '2024-03-31', '', False),
+    ('one word', 'market', '', '', '', '', '', False),
+    ('word + type', 'market type:Work', '', '', '', '', '', False),
+    ('has comments', '', '', '', '', '', '', True),
+]
+
+
+def time_call(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+        db_session.rollback()
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--emails', type=int, default=100000, help='Number of emails to seed.')
+    parser.add_argument('--db', default='bench_search_index.db', help='SQLite file to (re)use.')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for the generated data.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per search; the median is reported.')
+    args = parser.parse_args()
+
+    engine = create_engine(f'sqlite:///{os.path.abspath(args.db)}')
+    db_session.configure(bind=engine)
+    Base.metadata.create_all(bind=engine, tables=[Email.__table__, EmailToken.__table__, EmailFacetCount.__table__])
+
+    existing = db_session.execute(select(func.count()).select_from(Email)).scalar()
+    if existing != args.emails:
+        print(f"Seeding {args.emails} emails into {args.db}...")
+        db_session.execute(EmailToken.__table__.delete())
+        db_session.execute(Email.__table__.delete())
+        db_session.commit()
+        seed(args.emails, args.seed)
+    build_index(db_session, chunk_size=5000)
+
+    started = time.perf_counter()
+    rows = rebuild_facet_counts(db_session)
+    print(f"Rebuilt {rows} facet rows in {time.perf_counter() - started:.1f}s")
+
+    config = dict(vars(Config), RESULT_CACHE_BACKEND='memory')
+    print()
+    print(f"{'search':<18} {'total':>9} {'path':>7} {'uncached ms':>12} {'emails ms':>10} {'cached ms':>10}")
+    for label, query, sender, email_type, start_date, end_date, date_filter, has_comments in SEARCHES:
+        def facets():
+            return get_search_facets(query, sender, email_type, start_date, end_date, date_filter,
+                                     has_comments=has_comments)
+
+        result_cache.configure(dict(config, RESULT_CACHE_ENABLED=False))
+        total = facets()['total']
+        uncached_ms = time_call(facets, args.repeat)
+
+        shape, params, _ = search_plan(query, 'date_sent', 'desc', sender, email_type, start_date, end_date,
+                                       date_filter, has_comments=has_comments)
+        filter_shape = shape[:-2]
+        uses_table = 'email_facet_counts' in str(build_facet_statement(filter_shape))
+        emails_ms = None
+        if uses_table:
+            direct = build_facet_statement(filter_shape, from_emails=True)
+            emails_ms = time_call(lambda: db_session.execute(direct, params).all(), args.repeat)
+
+        result_cache.configure(dict(config, RESULT_CACHE_ENABLED=True))
+        facets()
+        cached_ms = time_call(facets, args.repeat)
+
+        emails_column = f"{emails_ms:>10.1f}" if emails_ms is not None else f"{'-':>10}"
+        print(f"{label:<18} {total:>9} {'table' if uses_table else 'emails':>7} {uncached_ms:>12.1f} "
+              f"{emails_column} {cached_ms:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
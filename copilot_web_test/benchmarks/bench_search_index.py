@@ -0,0 +1,131 @@
+"""
+Compares the full-text index with the ILIKE scan in search_emails_service.
+
+Seeds a local SQLite database with synthetic emails (100k by default), builds
+the index and times a set of representative queries through both paths:
+
+    python -m benchmarks.bench_search_index --emails 100000
+"""
+import os
+import random
+import argparse
+import datetime
+import statistics
+import time
+from faker.providers.lorem.en_US import Provider as LoremProvider
+from sqlalchemy import create_engine, insert, select, func
+from webapp.database import Base, db_session
+from webapp.models import Email, EmailToken
+from webapp.search_index import build_index
+from webapp.services import search_emails_service
+
+QUERIES = [
+    'market',
+    'market policy',
+    'manag* film',
+    '"market policy"',
+    'market -policy',
+    'data "market policy" -film',
+    'market AND policy',
+    '(market OR film) AND NOT policy',
+    'market type:Work',
+]
+
+
+def generate_emails(rng, count, num_senders=20):
+    words = LoremProvider.word_list
+    senders = [f"Sender{i:02d}" for i in range(num_senders)]
+    counters = {}
+    ids = []
+    for _ in range(count):
+        sender = rng.choice(senders)
+        date_sent = datetime.datetime(2023, 1, 1) + datetime.timedelta(minutes=rng.randrange(3 * 365 * 24 * 60))
+        key = (sender, date_sent.year)
+        counters[key] = counters.get(key, 999) + 1
+        unique_email_id = f"{sender}-{date_sent:%y}-{counters[key]}"
+
+        sentences = [' '.join(rng.choices(words, k=rng.randint(4, 10))).capitalize() + '.' for _ in range(15)]
+        body = ' '.join(sentences)
+        references = None
+        if ids and rng.random() < 0.3:
+            references = ','.join(rng.sample(ids, min(len(ids), rng.randint(1, 3))))
+            for ref_id in references.split(','):
+                body += f"\n\nReference to: {ref_id}"
+        ids.append(unique_email_id)
+
+        yield {
+            'unique_email_id': unique_email_id,
+            'user_id': 1,
+            'sender_name': sender,
+            'sender_email': f"{sender.lower()}@example.com",
+            'title': ' '.join(rng.choices(words, k=6)).capitalize(),
+            'body': body,
+            'email_type': rng.choice(['Work', 'Personal', 'Spam', 'Promotion']),
+            'date_sent': date_sent,
+            'references': references,
+        }
+
+
+def seed(count, seed_value, chunk_size=5000):
+    rng = random.Random(seed_value)
+    chunk = []
+    for row in generate_emails(rng, count):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            db_session.execute(insert(Email), chunk)
+            chunk = []
+    if chunk:
+        db_session.execute(insert(Email), chunk)
+    db_session.commit()
+
+
+def time_query(query, use_index, repeat):
+    timings = []
+    total = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        pagination = search_emails_service(query, 1, 50, 'date_sent', 'desc', '', '', '', '', '',
+                                           use_index=use_index)
+        timings.append(time.perf_counter() - started)
+        total = pagination.total
+        db_session.rollback()
+    return statistics.median(timings) * 1000, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--emails', type=int, default=100000, help='Number of emails to seed.')
+    parser.add_argument('--db', default='bench_search_index.db', help='SQLite file to (re)use.')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for the generated data.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per query; the median is reported.')
+    args = parser.parse_args()
+
+    engine = create_engine(f'sqlite:///{os.path.abspath(args.db)}')
+    db_session.configure(bind=engine)
+    Base.metadata.create_all(bind=engine, tables=[Email.__table__, EmailToken.__table__])
+
+    existing = db_session.execute(select(func.count()).select_from(Email)).scalar()
+    if existing != args.emails:
+        print(f"Seeding {args.emails} emails into {args.db}...")
+        db_session.execute(EmailToken.__table__.delete())
+        db_session.execute(Email.__table__.delete())
+        db_session.commit()
+        started = time.perf_counter()
+        seed(args.emails, args.seed)
+        print(f"  seeded in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    emails, postings = build_index(db_session, chunk_size=5000)
+    if emails:
+        print(f"Indexed {emails} emails ({postings} postings) in {time.perf_counter() - started:.1f}s")
+
+    print()
+    print(f"{'query':<32} {'ilike ms':>10} {'index ms':>10} {'speedup':>8} {'ilike hits':>11} {'index hits':>11}")
+    for query in QUERIES:
+        scan_ms, scan_total = time_query(query, False, args.repeat)
+        index_ms, index_total = time_query(query, True, args.repeat)
+        print(f"{query:<32} {scan_ms:>10.1f} {index_ms:>10.1f} {scan_ms / index_ms:>7.1f}x {scan_total:>11} {index_total:>11}")
+
+
+if __name__ == '__main__':
+    main()
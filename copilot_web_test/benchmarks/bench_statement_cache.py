@@ -0,0 +1,93 @@
+"""
+Measures the Python-side cost of building search statements.
+
+For each filter combination this reports the time to reduce the request
+to its shape and bind parameters, to build the statements and generate
+their SQLAlchemy cache key (what every request paid before statements were
+cached per shape), to fetch them from the statement cache instead, and to
+compile them for Oracle once. It also renders the SQL for many different
+search values and counts the distinct texts Oracle would see, which should
+stay at one per IN-list bucket. Word frequencies are not looked up, so no
+database is needed:
+
+    python -m benchmarks.bench_statement_cache --repeat 2000
+"""
+import random
+import argparse
+import timeit
+from sqlalchemy.dialects import oracle
+from webapp.services import search_plan, search_statements, build_search_statements, statement_cache
+
+WORDS = ['market', 'policy', 'film', 'data', 'report', 'budget', 'manager', 'growth', 'service', 'energy']
+
+# (label, search arguments); multi-word phrases are left out because they
+# are resolved against the index
+COMBINATIONS = [
+    ('no filters', {}),
+    ('one term', {'query': '{0}'}),
+    ('three terms', {'query': '{0} {1} {2}'}),
+    ('prefix + term', {'query': '{0}* {1}'}),
+    ('term - exclusion', {'query': '{0} -{1}'}),
+    ('sender + type', {'sender': 'Sender', 'email_type': 'Work'}),
+    ('term + dates', {'query': '{0}', 'start_date': '2024-01-01', 'end_date': '2024-06-30'}),
+    ('everything', {'query': '{0} {1}* -{2}', 'sender': 'Sender', 'email_type': 'Work',
+                    'date_filter': 'month', 'has_references': True, 'has_comments': True}),
+    ('and + group', {'query': '{0} AND ({1} OR {2}*)'}),
+    ('fields', {'query': '{0} from:sender type:work after:2024-01-01'}),
+    ('ilike fallback', {'query': '{0} {1} -{2}', 'use_index': False}),
+]
+
+
+def plan(arguments, rng):
+    arguments = dict(arguments)
+    words = rng.sample(WORDS, 3)
+    arguments['query'] = arguments.get('query', '').format(*words)
+    defaults = {'sort_by': 'date_sent', 'sort_order': 'desc', 'sender': '', 'email_type': '',
+                'start_date': '', 'end_date': '', 'date_filter': ''}
+    return search_plan(**dict(defaults, **arguments), estimate=False)
+
+
+def rebuild(shape):
+    statement = build_search_statements(shape)['offset']
+    statement._generate_cache_key()
+
+
+def distinct_sql(arguments, rng, samples):
+    dialect = oracle.dialect()
+    texts = set()
+    for _ in range(samples):
+        shape, params, _ = plan(arguments, rng)
+        statement = search_statements(shape)['offset'].params(params, limit=51, offset=0)
+        texts.add(str(statement.compile(dialect=dialect, compile_kwargs={'render_postcompile': True})))
+    return len(texts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=2000, help='Calls per measurement.')
+    parser.add_argument('--samples', type=int, default=50, help='Value sets rendered per combination.')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    dialect = oracle.dialect()
+    print(f"{'combination':<18} {'plan us':>8} {'rebuild us':>11} {'cached us':>10} {'compile us':>11} {'sql texts':>10}")
+    for label, arguments in COMBINATIONS:
+        shape, _, _ = plan(arguments, rng)
+        statement_cache.clear()
+        per_call = 1e6 / args.repeat
+
+        plan_us = timeit.timeit(lambda: plan(arguments, rng), number=args.repeat) * per_call
+        rebuild_us = timeit.timeit(lambda: rebuild(shape), number=args.repeat) * per_call
+        search_statements(shape)
+        cached_us = timeit.timeit(lambda: search_statements(shape), number=args.repeat) * per_call
+        compile_us = timeit.timeit(
+            lambda: build_search_statements(shape)['offset'].compile(dialect=dialect), number=max(1, args.repeat // 10)
+        ) * 1e6 / max(1, args.repeat // 10)
+        texts = distinct_sql(arguments, rng, args.samples)
+
+        print(f"{label:<18} {plan_us:>8.1f} {rebuild_us:>11.1f} {cached_us:>10.1f} {compile_us:>11.1f} {texts:>10}")
+
+
+if __name__ == '__main__':
+    main()
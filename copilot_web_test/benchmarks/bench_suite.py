@@ -0,0 +1,384 @@
+"""
+Benchmark suite: scripted scenarios against a seeded database.
+
+Seeds a database of a standard size (10k, 100k or 1m emails) with seed.py,
+reusing it when it already holds that many emails, then runs each scenario
+a fixed number of times and reports its throughput and p50/p90/p95/p99
+latency. Requests go through Flask's test client in this process, or with
+--url over HTTP to a running server on the same database. Without
+DATABASE_URL the data lives in a local SQLite file per size.
+
+--output writes the results as JSON, tagged with the commit, so runs on two
+commits can be compared; --compare prints the change against such a file
+and exits with status 1 when a scenario got slower than --threshold:
+
+    python -m benchmarks.bench_suite --size 100k --output baseline.json
+    python -m benchmarks.bench_suite --size 100k --compare baseline.json
+    python -m benchmarks.bench_suite --size 10k --scenarios search_sender,view_email --concurrency 4
+    python -m benchmarks.bench_suite --size 10k --url http://localhost:5000
+
+Set RESULT_CACHE_ENABLED=false to measure the database rather than the
+result cache.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import argparse
+import datetime
+import platform
+import threading
+import statistics
+import subprocess
+from urllib.parse import urlencode
+from benchmarks.bench_async import WORDS, SORTS, percentile
+
+SIZES = {'10k': 10000, '100k': 100000, '1m': 1000000}
+# seed.py makes two users; emails are spread over this many senders and years
+SEED_SENDERS = 20
+SEED_YEARS = 5
+SEED_END_YEAR = 2024
+PER_PAGE = 50
+
+
+def _search(**params):
+    params = dict({'format': 'json', 'per_page': PER_PAGE}, **params)
+    return 'GET', '/api/search?' + urlencode(params), None
+
+
+# Each scenario builds one request from the setup context and a random generator
+SCENARIOS = {
+    'search_text': lambda ctx, rng: _search(search_term=rng.choice(WORDS), sort_by=rng.choice(SORTS)),
+    'search_phrase': lambda ctx, rng: _search(search_term='"%s"' % ' '.join(rng.sample(WORDS, 2))),
+    'search_prefix': lambda ctx, rng: _search(search_term=rng.choice(WORDS)[:3] + '*'),
+    'search_sender': lambda ctx, rng: _search(sender=rng.choice(ctx['sender_fragments'])),
+    'search_type': lambda ctx, rng: _search(email_type=rng.choice(ctx['email_types'])),
+    'search_date_range': lambda ctx, rng: _search(**_date_range(ctx, rng)),
+    'search_references': lambda ctx, rng: _search(has_references='true', sort_by=rng.choice(SORTS)),
+    'search_comments': lambda ctx, rng: _search(has_comments='true', sort_by=rng.choice(SORTS)),
+    'search_facets': lambda ctx, rng: ('GET', '/api/search/facets?' + urlencode(
+        {'search_term': rng.choice(WORDS), 'email_type': rng.choice(ctx['email_types'])}), None),
+    'page_deep_offset': lambda ctx, rng: _search(page=ctx['deep_page'] - rng.randrange(10)),
+    'page_deep_cursor': lambda ctx, rng: _search(cursor=rng.choice(ctx['deep_cursors']), count='none'),
+    'view_email': lambda ctx, rng: ('GET', '/email/' + rng.choice(ctx['thread_ids']), None),
+    'email_comments': lambda ctx, rng: ('GET', '/api/emails/%s/comments' % rng.choice(ctx['thread_ids']), None),
+    'activity_page': lambda ctx, rng: ('GET', '/activity', None),
+    'activity_api': lambda ctx, rng: ('GET', '/api/activity?' + urlencode(
+        {'format': 'json', 'page': rng.randint(1, 20), 'per_page': 25}), None),
+    'comment_post': lambda ctx, rng: ('POST', '/api/comments/add', {
+        'email_id': rng.choice(ctx['thread_ids']), 'body': 'Benchmark comment %d' % rng.randrange(10 ** 6)}),
+}
+
+
+def _date_range(ctx, rng):
+    first, last = ctx['first_day'], ctx['last_day']
+    start = first + datetime.timedelta(days=rng.randrange(max((last - first).days - 90, 1)))
+    return {'start_date': start.isoformat(), 'end_date': (start + datetime.timedelta(days=90)).isoformat()}
+
+
+class TestClientTarget:
+    """Sends requests through Flask's test client, in this process."""
+    name = 'test-client'
+
+    def __init__(self, app):
+        self.app = app
+        self.cookie = None
+
+    def login(self, username, password):
+        client = self.app.test_client()
+        response = client.post('/auth/login', data={'username': username, 'password': password})
+        if response.status_code != 302:
+            raise SystemExit(f'Login failed with status {response.status_code}')
+        self.cookie = client.get_cookie('session').value
+
+    def client(self):
+        client = self.app.test_client()
+        client.set_cookie('session', self.cookie)
+        return client
+
+    @staticmethod
+    def send(client, method, path, data):
+        response = client.open(path, method=method, data=data)
+        return response.status_code, response.get_data()
+
+
+class HttpTarget:
+    """Sends requests to a running server over HTTP."""
+    def __init__(self, url, timeout):
+        self.name = url
+        self.url = url
+        self.timeout = timeout
+        self.cookie = None
+
+    def login(self, username, password):
+        import httpx
+        with httpx.Client(base_url=self.url, timeout=self.timeout) as client:
+            response = client.post('/auth/login', data={'username': username, 'password': password})
+            if response.status_code != 302 or 'session' not in client.cookies:
+                raise SystemExit(f'Login to {self.url} failed with status {response.status_code}')
+            self.cookie = client.cookies['session']
+
+    def client(self):
+        import httpx
+        return httpx.Client(base_url=self.url, cookies={'session': self.cookie}, timeout=self.timeout)
+
+    @staticmethod
+    def send(client, method, path, data):
+        response = client.request(method, path, data=data)
+        return response.status_code, response.content
+
+
+def target_emails(size):
+    """The number of emails seeded for a size: a name from SIZES or a number."""
+    emails = SIZES.get(size.lower()) if not size.isdigit() else int(size)
+    if not emails:
+        raise SystemExit(f"Unknown size {size!r}; use one of {', '.join(SIZES)} or a number of emails")
+    units = 2 * SEED_SENDERS * SEED_YEARS
+    return max(emails // units, 1) * units
+
+
+def prepare_database(emails, seed, reseed):
+    """Creates the schema and seeds the database unless it already holds the emails."""
+    import seed as seeder
+    from sqlalchemy import select, func
+    from config import Config
+    from webapp.database import db_session, get_engine
+    from webapp.migrate import upgrade, reset
+    from webapp.models import Email
+    from webapp.result_cache import result_cache
+
+    engine = get_engine()
+    upgrade(engine)
+    existing = db_session.execute(select(func.count()).select_from(Email)).scalar()
+    db_session.rollback()
+    if existing == emails:
+        return False
+    if existing and not reseed:
+        raise SystemExit(f"The database holds {existing} emails, not {emails}; pass --reseed to replace them")
+
+    print(f"Seeding {emails} emails...", file=sys.stderr)
+    if existing:
+        db_session.remove()
+        reset(engine)
+    seeder.set_seed(seed)
+    result_cache.configure(vars(Config))
+    seeder.seed_users()
+    seeder.seed_emails(num_senders=SEED_SENDERS, emails_per_sender_per_year=emails // (2 * SEED_SENDERS * SEED_YEARS),
+                       num_years=SEED_YEARS, end_year=SEED_END_YEAR, chunk_size=5000)
+    seeder.seed_comments(num_top_level_comments=emails // 20, max_replies=3, chunk_size=5000)
+    db_session.remove()
+    return True
+
+
+def scenario_context(target, client, cursor_pages):
+    """The ids, senders and deep cursors the scenarios pick from."""
+    from sqlalchemy import select, func
+    from seed import EMAIL_TYPES
+    from webapp.database import db_session
+    from webapp.models import Email, Sender
+
+    first_day, last_day = db_session.execute(select(func.min(Email.date_sent), func.max(Email.date_sent))).one()
+    total = db_session.execute(select(func.count()).select_from(Email)).scalar()
+    thread_ids = db_session.execute(
+        select(Email.unique_email_id)
+        .where(Email.reference_count > 0, Email.comment_count > 0)
+        .order_by(Email.unique_email_id).limit(200)
+    ).scalars().all()
+    names = db_session.execute(select(Sender.name).order_by(Sender.id)).scalars().all()
+    db_session.remove()
+    if not thread_ids:
+        raise SystemExit('No email has both references and comments; seed more data')
+
+    # Follow next_cursor to a deep page once, and keep the cursors on the way there
+    cursors = []
+    cursor = ''
+    for _ in range(cursor_pages):
+        status, body = target.send(client, *_search(cursor=cursor, count='none'))
+        cursor = json.loads(body).get('next_cursor') if status == 200 else None
+        if not cursor:
+            break
+        cursors.append(cursor)
+
+    return {
+        'first_day': first_day.date(),
+        'last_day': last_day.date(),
+        'email_types': EMAIL_TYPES,
+        'sender_fragments': [name.split()[-1] for name in names if name] or ['a'],
+        'thread_ids': thread_ids,
+        'deep_page': max((total + PER_PAGE - 1) // PER_PAGE * 9 // 10, 10),
+        'deep_cursors': cursors[-10:] or [''],
+    }
+
+
+def run_scenario(target, clients, requests):
+    """Sends the requests from len(clients) threads; returns (elapsed seconds, latencies in ms, errors)."""
+    work = queue.SimpleQueue()
+    for request in requests:
+        work.put(request)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(client):
+        while True:
+            try:
+                method, path, data = work.get_nowait()
+            except queue.Empty:
+                return
+            started = time.perf_counter()
+            try:
+                status = target.send(client, method, path, data)[0]
+            except Exception as error:
+                status = type(error).__name__
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if status != 200:
+                    errors.append(f'{method} {path}: {status}')
+
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, latencies, errors
+
+
+def summarize(elapsed, latencies, errors):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p90_ms': round(percentile(latencies, 0.90), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'max_ms': round(latencies[-1], 3) if latencies else 0.0,
+    }
+
+
+def git_revision():
+    """(commit, dirty) of the working tree, or (None, None) outside git."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def compare(results, baseline_path, threshold):
+    """Prints the change against a baseline; returns the scenarios whose p50 or p99 grew past threshold."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nAgainst {baseline_path} (commit {(baseline.get('commit') or '?')[:10]}, {baseline.get('emails')} emails)",
+          file=sys.stderr)
+    print(f"{'scenario':<20} {'p50 ms':>17} {'p99 ms':>17} {'req/s':>17}", file=sys.stderr)
+    regressions = []
+    for name, current in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            print(f"{name:<20} {'(new)':>17}", file=sys.stderr)
+            continue
+        columns = []
+        for key in ('p50_ms', 'p99_ms', 'throughput_rps'):
+            change = (current[key] - before[key]) / before[key] if before[key] else 0.0
+            columns.append(f"{current[key]:>8.1f} {change:>+7.0%}")
+            if key != 'throughput_rps' and change > threshold:
+                regressions.append(name)
+        print(f"{name:<20} {columns[0]:>17} {columns[1]:>17} {columns[2]:>17}"
+              f"{'  slower' if name in regressions else ''}", file=sys.stderr)
+    return sorted(set(regressions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', default='10k', help=f"Emails to seed: {', '.join(SIZES)} or a number.")
+    parser.add_argument('--db', help='SQLite file to use when DATABASE_URL is not set (default bench_suite_<size>.db).')
+    parser.add_argument('--reseed', action='store_true', help='Replace the data if the database holds a different size.')
+    parser.add_argument('--url', help='Base URL of a running server on the same database, instead of the test client.')
+    parser.add_argument('--scenarios', help=f"Comma separated subset of: {', '.join(SCENARIOS)}.")
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario.')
+    parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per scenario first.')
+    parser.add_argument('--concurrency', type=int, default=1, help='Requests in flight at once.')
+    parser.add_argument('--cursor-pages', type=int, default=100, help='Pages followed to reach the deep cursor.')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Per-request timeout in seconds (--url).')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for the data and the requests.')
+    parser.add_argument('--output', help='Write the results as JSON to this file ("-" for stdout).')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Slowdown of p50 or p99 counted as a regression.')
+    args = parser.parse_args()
+
+    names = args.scenarios.split(',') if args.scenarios else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    emails = target_emails(args.size)
+    if not os.environ.get('DATABASE_URL'):
+        # Read by config.py, so it has to be set before the app is imported
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(args.db or f'bench_suite_{args.size.lower()}.db')
+
+    from webapp import create_app
+    from webapp.database import get_engine
+    prepare_database(emails, args.seed, args.reseed)
+
+    target = HttpTarget(args.url, args.timeout) if args.url else TestClientTarget(create_app())
+    target.login(args.username, args.password)
+    clients = [target.client() for _ in range(max(args.concurrency, 1))]
+    context = scenario_context(target, clients[0], args.cursor_pages)
+
+    commit, dirty = git_revision()
+    results = {
+        'suite': 'bench_suite',
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': get_engine().dialect.name,
+        'target': target.name,
+        'emails': emails,
+        'concurrency': len(clients),
+        'requests_per_scenario': args.requests,
+        'scenarios': {},
+    }
+
+    print(f"{emails} emails on {results['database']}, {target.name}, concurrency {len(clients)}", file=sys.stderr)
+    print(f"{'scenario':<20} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} "
+          f"{'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}", file=sys.stderr)
+    for offset, name in enumerate(names):
+        rng = random.Random(args.seed + offset)
+        run_scenario(target, clients, [SCENARIOS[name](context, rng) for _ in range(args.warmup)])
+        elapsed, latencies, errors = run_scenario(target, clients,
+                                                  [SCENARIOS[name](context, rng) for _ in range(args.requests)])
+        summary = results['scenarios'][name] = summarize(elapsed, latencies, errors)
+        print(f"{name:<20} {summary['requests']:>9} {summary['errors']:>7} {summary['throughput_rps']:>8.1f} "
+              f"{summary['p50_ms']:>8.1f} {summary['p90_ms']:>8.1f} {summary['p95_ms']:>8.1f} "
+              f"{summary['p99_ms']:>8.1f} {summary['max_ms']:>8.1f}", file=sys.stderr)
+        if errors:
+            print(f"  first error: {errors[0]}", file=sys.stderr)
+
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"\nSlower than {args.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,5 +11,164 @@ class Config:
     DB_HOST = os.environ.get('DB_HOST') or 'localhost'
     DB_PORT = os.environ.get('DB_PORT') or '1521'
     
-    SQLALCHEMY_DATABASE_URI = f'oracle+oracledb://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/?service_name={DB_SERVICE_NAME}'
+    # DATABASE_URL replaces the Oracle URL built from the DB_* settings with
+    # any SQLAlchemy URL, e.g. sqlite:///email_app.db to run locally without
+    # an Oracle instance (create the schema with python -m webapp.migrate)
+    DATABASE_URL = os.environ.get('DATABASE_URL')
+    SQLALCHEMY_DATABASE_URI = (DATABASE_URL or
+                               f'oracle+oracledb://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/?service_name={DB_SERVICE_NAME}')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Used by the async API tier (asgi.py); the asyncio driver for the same
+    # database (python-oracledb's asyncio mode, or aiosqlite) by default
+    SQLALCHEMY_ASYNC_DATABASE_URI = (os.environ.get('SQLALCHEMY_ASYNC_DATABASE_URI') or
+                                     SQLALCHEMY_DATABASE_URI.replace('oracle+oracledb://', 'oracle+oracledb_async://', 1)
+                                     .replace('sqlite://', 'sqlite+aiosqlite://', 1))
+
+    # Connection pooling, per uWSGI worker. 'sqlalchemy' uses SQLAlchemy's
+    # QueuePool; 'oracledb' uses a python-oracledb session pool and 'drcp'
+    # the same pool on Database Resident Connection Pooling (DB_DRCP_CLASS
+    # names the connection class). Either way a worker holds at most
+    # DB_POOL_SIZE + DB_MAX_OVERFLOW connections.
+    DB_POOL_MODE = os.environ.get('DB_POOL_MODE') or 'sqlalchemy'
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 5)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 5)
+    DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN') or 1)
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT') or 30)
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 1800)
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    DB_DRCP_CLASS = os.environ.get('DB_DRCP_CLASS') or 'EMAILAPP'
+    # The async tier keeps many more requests waiting on the database than
+    # one sync worker does, so it gets a pool of its own size
+    ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE') or 20)
+    ASYNC_DB_MAX_OVERFLOW = int(os.environ.get('ASYNC_DB_MAX_OVERFLOW') or 10)
+
+    # python-oracledb statement cache and fetch tuning
+    DB_STMT_CACHE_SIZE = int(os.environ.get('DB_STMT_CACHE_SIZE') or 50)
+    DB_ARRAYSIZE = int(os.environ.get('DB_ARRAYSIZE') or 500)
+    DB_PREFETCHROWS = int(os.environ.get('DB_PREFETCHROWS') or 100)
+
+    # Answer search terms from the full-text index instead of scanning email
+    # bodies. The index matches whole words (prefixes with word*); the scan
+    # matches any substring of the body.
+    SEARCH_USE_INDEX = os.environ.get('SEARCH_USE_INDEX', 'true').lower() == 'true'
+
+    # Highlighted body excerpts around the first match of a search's words:
+    # SEARCH_SNIPPET_LENGTH characters, looked for in the first
+    # SEARCH_SNIPPET_SCAN_CHARS of each body, and at most
+    # SEARCH_SNIPPET_BUDGET_MS spent on them per page
+    SEARCH_SNIPPETS_ENABLED = os.environ.get('SEARCH_SNIPPETS_ENABLED', 'true').lower() == 'true'
+    SEARCH_SNIPPET_LENGTH = int(os.environ.get('SEARCH_SNIPPET_LENGTH') or 200)
+    SEARCH_SNIPPET_SCAN_CHARS = int(os.environ.get('SEARCH_SNIPPET_SCAN_CHARS') or 5000)
+    SEARCH_SNIPPET_BUDGET_MS = int(os.environ.get('SEARCH_SNIPPET_BUDGET_MS') or 25)
+    SEARCH_SNIPPET_CACHE_SIZE = int(os.environ.get('SEARCH_SNIPPET_CACHE_SIZE') or 5000)
+    SEARCH_SNIPPET_CACHE_TTL = int(os.environ.get('SEARCH_SNIPPET_CACHE_TTL') or 300)
+
+    # Senders and email types listed by /api/search/facets (months are all listed)
+    SEARCH_FACET_LIMIT = int(os.environ.get('SEARCH_FACET_LIMIT') or 25)
+
+    # Result totals are reused for this many seconds per filter combination
+    COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL') or 60)
+    COUNT_CACHE_SIZE = int(os.environ.get('COUNT_CACHE_SIZE') or 1024)
+
+    # Search and activity statements cached per filter shape in each worker
+    STATEMENT_CACHE_SIZE = int(os.environ.get('STATEMENT_CACHE_SIZE') or 512)
+    STATEMENT_CACHE_TTL = int(os.environ.get('STATEMENT_CACHE_TTL') or 24 * 60 * 60)
+    # Parsed search queries, and the document frequencies of their words
+    SEARCH_PARSE_CACHE_SIZE = int(os.environ.get('SEARCH_PARSE_CACHE_SIZE') or 2048)
+    SEARCH_FREQUENCY_CACHE_SIZE = int(os.environ.get('SEARCH_FREQUENCY_CACHE_SIZE') or 20000)
+    # Email ids of the phrases searched for, one list per phrase
+    SEARCH_PHRASE_CACHE_SIZE = int(os.environ.get('SEARCH_PHRASE_CACHE_SIZE') or 256)
+    # A phrase whose words occur together in more emails than this is not
+    # resolved to ids from the postings but matched with an ILIKE over the
+    # emails holding every word; at most 1000 keeps its ids in one IN list
+    SEARCH_PHRASE_CANDIDATE_LIMIT = int(os.environ.get('SEARCH_PHRASE_CANDIDATE_LIMIT') or 1000)
+    # Where email bodies are written at ingest: 'inline' in emails.body, or
+    # 'compressed' into email_bodies with EMAIL_BODY_CODEC ('zlib', or
+    # 'zstd' with the zstandard package installed). Either kind is read back
+    # whatever the setting, but the unindexed substring search
+    # (SEARCH_USE_INDEX = false) only sees inline bodies.
+    EMAIL_BODY_STORAGE = os.environ.get('EMAIL_BODY_STORAGE') or 'inline'
+    EMAIL_BODY_CODEC = os.environ.get('EMAIL_BODY_CODEC') or 'zlib'
+    EMAIL_BODY_COMPRESSION_LEVEL = int(os.environ.get('EMAIL_BODY_COMPRESSION_LEVEL') or 6)
+    # Sender filters resolved to sender ids, and /api/senders/suggest answers
+    SENDER_CACHE_SIZE = int(os.environ.get('SENDER_CACHE_SIZE') or 2048)
+    SENDER_CACHE_TTL = int(os.environ.get('SENDER_CACHE_TTL') or 600)
+    SENDER_SUGGEST_LIMIT = int(os.environ.get('SENDER_SUGGEST_LIMIT') or 10)
+
+    # Whole search result sets of up to RESULT_CACHE_MAX_ROWS rows, so every
+    # page of a repeated query is served from memory. 'memory' is per worker;
+    # 'file' is shared by the workers on a host through RESULT_CACHE_DIR (use
+    # a directory under /dev/shm to keep it in RAM). Unset, it is 'file' in
+    # uWSGI with more than one process, so a comment posted in one worker
+    # invalidates the results of all of them, and 'memory' otherwise.
+    # Scripts that insert emails (seed.py) only reach the workers' results
+    # through 'file'.
+    RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+    RESULT_CACHE_BACKEND = os.environ.get('RESULT_CACHE_BACKEND') or None
+    RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR') or '/dev/shm/email_search_results'
+    RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES') or 64 * 1024 * 1024)
+    RESULT_CACHE_MAX_ROWS = int(os.environ.get('RESULT_CACHE_MAX_ROWS') or 10000)
+    RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL') or 300)
+
+    # Exports read EXPORT_CHUNK_SIZE rows per fetch from a server-side cursor
+    # and send them in pieces of about EXPORT_BUFFER_SIZE bytes
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE') or 1000)
+    EXPORT_BUFFER_SIZE = int(os.environ.get('EXPORT_BUFFER_SIZE') or 64 * 1024)
+
+    # Rendered pagination fragments for format=json responses
+    PAGINATION_CACHE_ENABLED = os.environ.get('PAGINATION_CACHE_ENABLED', 'true').lower() == 'true'
+    PAGINATION_CACHE_SIZE = int(os.environ.get('PAGINATION_CACHE_SIZE') or 512)
+    PAGINATION_CACHE_TTL = int(os.environ.get('PAGINATION_CACHE_TTL') or 300)
+
+    # Comment threads are loaded COMMENT_PAGE_SIZE top-level comments at a
+    # time; the email page polls for new comments every
+    # COMMENT_POLL_INTERVAL seconds (0 turns polling off), at most
+    # COMMENT_POLL_LIMIT per poll
+    COMMENT_PAGE_SIZE = int(os.environ.get('COMMENT_PAGE_SIZE') or 20)
+    COMMENT_POLL_INTERVAL = int(os.environ.get('COMMENT_POLL_INTERVAL') or 30)
+    COMMENT_POLL_LIMIT = int(os.environ.get('COMMENT_POLL_LIMIT') or 200)
+
+    # Email bodies with their references already turned into links
+    LINKED_BODY_CACHE_SIZE = int(os.environ.get('LINKED_BODY_CACHE_SIZE') or 256)
+    LINKED_BODY_CACHE_TTL = int(os.environ.get('LINKED_BODY_CACHE_TTL') or 600)
+
+    # Activity rows are queued and bulk-inserted by a background thread.
+    # When the queue is full, 'drop' discards the row immediately and 'block'
+    # waits up to ACTIVITY_BLOCK_TIMEOUT_MS before discarding it.
+    ACTIVITY_LOG_ASYNC = os.environ.get('ACTIVITY_LOG_ASYNC', 'true').lower() == 'true'
+    ACTIVITY_BATCH_SIZE = int(os.environ.get('ACTIVITY_BATCH_SIZE') or 100)
+    ACTIVITY_FLUSH_INTERVAL_MS = int(os.environ.get('ACTIVITY_FLUSH_INTERVAL_MS') or 500)
+    ACTIVITY_QUEUE_SIZE = int(os.environ.get('ACTIVITY_QUEUE_SIZE') or 10000)
+    ACTIVITY_QUEUE_POLICY = os.environ.get('ACTIVITY_QUEUE_POLICY') or 'drop'
+    ACTIVITY_BLOCK_TIMEOUT_MS = int(os.environ.get('ACTIVITY_BLOCK_TIMEOUT_MS') or 50)
+
+    # Complete days of raw activity are rolled up into daily per-user,
+    # per-activity counts and the raw rows deleted after
+    # ACTIVITY_RETENTION_DAYS (python -m webapp.activity_retention). With
+    # ACTIVITY_PARTITIONED, user_activity is created interval-partitioned by
+    # day on Oracle and expired days are dropped a partition at a time.
+    ACTIVITY_RETENTION_DAYS = int(os.environ.get('ACTIVITY_RETENTION_DAYS') or 30)
+    ACTIVITY_PARTITIONED = os.environ.get('ACTIVITY_PARTITIONED', 'false').lower() == 'true'
+
+    # Views over their query budget raise instead of logging a warning (on in tests/conftest.py)
+    QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', 'false').lower() == 'true'
+
+    # current_user is loaded from a per-worker cache of user identities
+    USER_CACHE_ENABLED = os.environ.get('USER_CACHE_ENABLED', 'true').lower() == 'true'
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 1024)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 300)
+
+    # Failed logins drain a token bucket per username and per client address;
+    # while either is empty, logins are refused before the password is hashed
+    LOGIN_THROTTLE_ENABLED = os.environ.get('LOGIN_THROTTLE_ENABLED', 'true').lower() == 'true'
+    LOGIN_USER_BURST = int(os.environ.get('LOGIN_USER_BURST') or 5)
+    LOGIN_USER_PER_MINUTE = int(os.environ.get('LOGIN_USER_PER_MINUTE') or 5)
+    LOGIN_IP_BURST = int(os.environ.get('LOGIN_IP_BURST') or 20)
+    LOGIN_IP_PER_MINUTE = int(os.environ.get('LOGIN_IP_PER_MINUTE') or 20)
+
+    # Per-endpoint request profiling, reported at /profiling and, with
+    # SERVER_TIMING_ENABLED, in a Server-Timing header on the admin's responses
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'true').lower() == 'true'
+    SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+    # Statements at least this slow are logged with their bind shapes
+    SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS') or 500)
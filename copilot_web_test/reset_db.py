@@ -1,14 +1,9 @@
-from webapp.database import Base, engine
-# Import all the models, so that Base has them registered
-from webapp.models import User, Email, UserActivity
+from webapp.database import get_engine
+from webapp.migrate import reset
 
 def reset_database():
-    print("Dropping all tables...")
-    # Drop all tables
-    Base.metadata.drop_all(bind=engine)
-    print("Creating all tables...")
-    # Create all tables
-    Base.metadata.create_all(bind=engine)
+    print("Dropping and recreating all tables...")
+    reset(get_engine())
     print("Database has been reset.")
 
 if __name__ == '__main__':
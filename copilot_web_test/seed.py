@@ -1,13 +1,58 @@
+"""
+Seeds the database with users, emails and comments.
+
+Rows are generated lazily and written in chunks with Core insert()
+executemany, each chunk in its own transaction together with its search
+index postings, reference edges and facet counts, so memory stays flat
+however many emails are generated. Pass --seed to generate the same data on every run:
+
+    python seed.py --seed 42 --emails-per-sender-per-year 1000 --chunk-size 5000
+"""
+import time
 import random
 import string
+import argparse
 import datetime
 from faker import Faker
-from sqlalchemy import func
+from sqlalchemy import select, insert, func
 from webapp.database import db_session
-from webapp.models import User, Email, Comment
+from webapp.models import User, Email, Comment, EMAIL_TYPES
+from webapp.search_index import index_emails
+from webapp.references import link_emails
+from webapp.result_cache import result_cache
+from webapp.counters import count_references, add_comment_counts
+from webapp.facets import add_facet_counts
+from webapp.senders import assign_senders
+from webapp.bodies import email_rows, insert_bodies
+from config import Config
 
 fake = Faker()
 
+FIRST_SENDER_NUMBER = 1000
+REFERENCE_RATE = 0.3
+# Comments are dated within this window after the email (or comment) they answer
+COMMENT_WINDOW = datetime.timedelta(days=90)
+
+def set_seed(seed):
+    """Makes every generated value reproducible."""
+    random.seed(seed)
+    fake.seed_instance(seed)
+
+def _chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _report(label, count, started):
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed else 0
+    print(f"  {count} {label} ({rate:.0f} rows/s)")
+
 def seed_users():
     """Creates initial users if they don't exist."""
     users_to_add = [
@@ -21,7 +66,7 @@ def seed_users():
             new_user = User(username=user_data['username'])
             new_user.set_password(user_data['password'])
             db_session.add(new_user)
-    
+
     db_session.commit()
 
 def create_random_string(length=10):
@@ -29,126 +74,213 @@ def create_random_string(length=10):
     letters = string.ascii_lowercase
     return ''.join(random.choice(letters) for i in range(length))
 
-def seed_emails(num_senders=20, emails_per_sender_per_year=75):
+def _sender_names(num_senders):
+    names = []
+    while len(names) < num_senders:
+        name = fake.name()
+        if name not in names:
+            names.append(name)
+    return names
+
+class EmailIdSpace:
+    """
+    Maps the position of a generated email to its unique_email_id. Emails are
+    generated user by user, then sender, year and number, and the per
+    sender-and-year counter runs on across users, so any earlier email can
+    be referenced without keeping the ids in memory.
+    """
+    def __init__(self, num_users, sender_names, years, per_year):
+        self.num_users = num_users
+        self.sender_slugs = [name.replace(' ', '') for name in sender_names]
+        self.years = years
+        self.per_year = per_year
+
+    def __len__(self):
+        return self.num_users * len(self.sender_slugs) * len(self.years) * self.per_year
+
+    def unique_id(self, index):
+        index, number = divmod(index, self.per_year)
+        index, year_index = divmod(index, len(self.years))
+        user_index, sender_index = divmod(index, len(self.sender_slugs))
+        sender_number = FIRST_SENDER_NUMBER + user_index * self.per_year + number
+        return f"{self.sender_slugs[sender_index]}-{self.years[year_index] % 100:02d}-{sender_number}"
+
+def generate_emails(user_ids, sender_names, years, per_year):
+    """Yields email rows in id-space order, with references to earlier emails."""
+    id_space = EmailIdSpace(len(user_ids), sender_names, years, per_year)
+    index = 0
+    for user_id in user_ids:
+        for sender_name in sender_names:
+            sender_email = f"{sender_name.replace(' ', '.').lower()}@example.com"
+            for year in years:
+                for _ in range(per_year):
+                    body = fake.paragraph(nb_sentences=15)
+                    references = None
+                    if index and random.random() < REFERENCE_RATE:
+                        num_references = random.randint(1, 3)
+                        referenced_ids = list(dict.fromkeys(
+                            id_space.unique_id(random.randrange(index)) for _ in range(num_references)
+                        ))
+                        # Store references in the 'references' column as a comma-separated string
+                        references = ",".join(referenced_ids)
+                        # Inject references into the body
+                        for ref_id in referenced_ids:
+                            body += f"\n\nReference to: {ref_id}"
+
+                    yield {
+                        'unique_email_id': id_space.unique_id(index),
+                        'user_id': user_id,
+                        'sender_name': sender_name,
+                        'sender_email': sender_email,
+                        'title': fake.sentence(nb_words=6),
+                        'body': body,
+                        'email_type': random.choice(EMAIL_TYPES),
+                        'date_sent': fake.date_time_between(
+                            start_date=datetime.datetime(year, 1, 1),
+                            end_date=datetime.datetime(year, 12, 31)
+                        ),
+                        'references': references,
+                        'reference_count': count_references(references),
+                    }
+                    index += 1
+
+def seed_emails(num_senders=20, emails_per_sender_per_year=75, num_years=3, end_year=None, chunk_size=1000):
     """Seeds the database with random emails from a limited set of senders."""
-    users = User.query.all()
-    if not users:
+    user_ids = db_session.execute(select(User.id).order_by(User.id)).scalars().all()
+    if not user_ids:
         print("No users found. Please seed users first.")
         return
 
-    # Generate a list of unique sender names
-    sender_names = [fake.name() for _ in range(num_senders)]
-    sender_year_counter = {}
-    all_new_emails = []
+    end_year = end_year or datetime.datetime.now().year
+    years = list(range(end_year - num_years + 1, end_year + 1))
+    sender_names = _sender_names(num_senders)
+    total = len(user_ids) * num_senders * len(years) * emails_per_sender_per_year
 
-    print("Generating email data...")
-    for user in users:
-        for sender_name in sender_names:
-            for year in range(datetime.datetime.now().year - 2, datetime.datetime.now().year + 1):
-                for _ in range(emails_per_sender_per_year):
-                    date_sent = fake.date_time_between(start_date=datetime.datetime(year, 1, 1), end_date=datetime.datetime(year, 12, 31))
-                    year_short = date_sent.strftime('%y')
-
-                    counter_key = (sender_name, year)
-                    if counter_key not in sender_year_counter:
-                        sender_year_counter[counter_key] = 1000
-                    else:
-                        sender_year_counter[counter_key] += 1
-                    
-                    sender_number = sender_year_counter[counter_key]
-
-                    unique_email_id = f"{sender_name.replace(' ', '')}-{year_short}-{sender_number}"
-
-                    body_content = fake.paragraph(nb_sentences=15)
-
-                    new_email = Email(
-                        unique_email_id=unique_email_id,
-                        user_id=user.id,
-                        sender_name=sender_name,
-                        sender_email=f"{sender_name.replace(' ', '.').lower()}@example.com",
-                        title=fake.sentence(nb_words=6),
-                        body=body_content,
-                        email_type=random.choice(['Work', 'Personal', 'Spam', 'Promotion']),
-                        date_sent=date_sent
-                    )
-                    all_new_emails.append(new_email)
-
-    db_session.add_all(all_new_emails)
-    print(f"Generated {len(all_new_emails)} emails.")
-
-    print("Injecting email references...")
-    all_unique_ids = [email.unique_email_id for email in all_new_emails]
-
-    for email in all_new_emails:
-        if random.random() < 0.3 and len(all_unique_ids) > 1:
-            num_references = random.randint(1, 3)
-            referenced_ids = random.sample(all_unique_ids, num_references)
-            
-            # Store references in the 'references' column as a comma-separated string
-            email.references = ",".join(referenced_ids)
-
-            # Inject references into the body
-            for ref_id in referenced_ids:
-                email.body += f"\n\nReference to: {ref_id}"
-
-    db_session.commit()
+    print(f"Seeding {total} emails with their index postings and references...")
+    started = time.perf_counter()
+    done = 0
+    emails = generate_emails(user_ids, sender_names, years, emails_per_sender_per_year)
+    for chunk in _chunks(emails, chunk_size):
+        assign_senders(db_session, chunk)
+        db_session.execute(insert(Email.__table__), email_rows(chunk))
+        insert_bodies(db_session, chunk)
+        index_emails(db_session, [(row['unique_email_id'], row['title'], row['body']) for row in chunk], replace=False)
+        link_emails(db_session, [(row['unique_email_id'], row['references'], row['body']) for row in chunk])
+        add_facet_counts(db_session, chunk)
+        db_session.commit()
+        done += len(chunk)
+        _report('emails', done, started)
+    result_cache.invalidate()
     print("Finished seeding emails and references.")
 
-def seed_comments(num_top_level_comments=150, max_replies=5):
-    """Seeds the database with random comments and replies."""
-    users = User.query.all()
-    emails = Email.query.all()
+def _iter_keyset(column, columns, chunk_size, *criteria):
+    """Yields rows of ``columns`` in ``column`` order, one short query per chunk."""
+    last = None
+    while True:
+        stmt = select(*columns).where(*criteria).order_by(column).limit(chunk_size)
+        if last is not None:
+            stmt = stmt.where(column > last)
+        rows = db_session.execute(stmt).all()
+        if not rows:
+            return
+        yield from rows
+        last = rows[-1][0]
+
+def generate_top_level_comments(user_ids, num_comments, chunk_size):
+    """Yields comment rows on randomly chosen emails, walking the emails once."""
+    num_emails = db_session.execute(select(func.count(Email.unique_email_id))).scalar()
+    if not num_emails:
+        return
+    positions = sorted(random.randrange(num_emails) for _ in range(num_comments))
+    next_position = 0
+    emails = _iter_keyset(Email.unique_email_id, (Email.unique_email_id, Email.date_sent), chunk_size)
+    for position, (email_id, date_sent) in enumerate(emails):
+        while next_position < len(positions) and positions[next_position] == position:
+            yield {
+                'body': fake.paragraph(nb_sentences=random.randint(1, 4)),
+                'timestamp': fake.date_time_between(start_date=date_sent, end_date=date_sent + COMMENT_WINDOW),
+                'user_id': random.choice(user_ids),
+                'email_id': email_id,
+                'parent_id': None,
+            }
+            next_position += 1
+        if next_position == len(positions):
+            return
+
+def generate_replies(user_ids, max_replies, chunk_size):
+    """Yields replies to the top-level comments, streamed back in id order."""
+    parents = _iter_keyset(
+        Comment.id, (Comment.id, Comment.email_id, Comment.timestamp), chunk_size, Comment.parent_id.is_(None)
+    )
+    for parent_id, email_id, timestamp in parents:
+        for _ in range(random.randint(0, max_replies)):
+            yield {
+                'body': fake.paragraph(nb_sentences=random.randint(1, 3)),
+                'timestamp': fake.date_time_between(start_date=timestamp, end_date=timestamp + COMMENT_WINDOW),
+                'user_id': random.choice(user_ids),
+                'email_id': email_id,
+                'parent_id': parent_id,
+            }
 
-    if not users or not emails:
+def _insert_comments(label, comments, chunk_size):
+    started = time.perf_counter()
+    done = 0
+    for chunk in _chunks(comments, chunk_size):
+        db_session.execute(insert(Comment.__table__), chunk)
+        add_comment_counts(db_session, [row['email_id'] for row in chunk])
+        db_session.commit()
+        done += len(chunk)
+        _report(label, done, started)
+    return done
+
+def seed_comments(num_top_level_comments=150, max_replies=5, chunk_size=1000):
+    """Seeds the database with random comments and replies."""
+    user_ids = db_session.execute(select(User.id).order_by(User.id)).scalars().all()
+    if not user_ids or not db_session.execute(select(Email.unique_email_id).limit(1)).first():
         print("Users or emails not found. Please seed them first.")
         return
 
     print("--- Seeding Comments ---")
-    
+
     # 1. Create top-level comments
-    top_level_comments = []
-    for _ in range(num_top_level_comments):
-        random_email = random.choice(emails)
-        random_user = random.choice(users)
-        comment = Comment(
-            body=fake.paragraph(nb_sentences=random.randint(1, 4)),
-            timestamp=fake.date_time_between(start_date=random_email.date_sent),
-            user_id=random_user.id,
-            email_id=random_email.unique_email_id,
-            parent_id=None
-        )
-        top_level_comments.append(comment)
-
-    db_session.add_all(top_level_comments)
-    db_session.commit()
-    print(f"Created {len(top_level_comments)} top-level comments.")
+    created = _insert_comments(
+        'top-level comments', generate_top_level_comments(user_ids, num_top_level_comments, chunk_size), chunk_size
+    )
+    print(f"Created {created} top-level comments.")
 
     # 2. Create replies
-    all_replies = []
-    all_comments = Comment.query.filter(Comment.parent_id.is_(None)).all()
-
-    for parent_comment in all_comments:
-        num_replies = random.randint(0, max_replies)
-        for _ in range(num_replies):
-            random_user = random.choice(users)
-            reply = Comment(
-                body=fake.paragraph(nb_sentences=random.randint(1, 3)),
-                timestamp=fake.date_time_between(start_date=parent_comment.timestamp),
-                user_id=random_user.id,
-                email_id=parent_comment.email_id,
-                parent_id=parent_comment.id
-            )
-            all_replies.append(reply)
-
-    db_session.add_all(all_replies)
-    db_session.commit()
-    print(f"Created {len(all_replies)} replies.")
+    created = _insert_comments('replies', generate_replies(user_ids, max_replies, chunk_size), chunk_size)
+    print(f"Created {created} replies.")
+    result_cache.invalidate()
     print("Finished seeding comments.")
 
 if __name__ == '__main__':
-    # First, ensure you have the Faker library installed:
-    # pip install Faker
+    parser = argparse.ArgumentParser(description='Seed the database with random users, emails and comments.')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible data.')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Rows written per transaction.')
+    parser.add_argument('--senders', type=int, default=20, help='Distinct senders.')
+    parser.add_argument('--emails-per-sender-per-year', type=int, default=75)
+    parser.add_argument('--years', type=int, default=3, help='Years of email, ending with --end-year.')
+    parser.add_argument('--end-year', type=int, default=None, help='Last year of email (defaults to this year).')
+    parser.add_argument('--comments', type=int, default=150, help='Top-level comments.')
+    parser.add_argument('--max-replies', type=int, default=5, help='Maximum replies per top-level comment.')
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        set_seed(args.seed)
+    # Core inserts bypass the session events, so cached search results are
+    # dropped explicitly. That reaches the running workers only through a
+    # shared 'file' result cache (RESULT_CACHE_BACKEND=file); with 'memory'
+    # each worker keeps serving its cached results until RESULT_CACHE_TTL.
+    result_cache.configure(vars(Config))
+
     print("--- Seeding Database ---")
     seed_users()
-    seed_emails() 
-    seed_comments()
+    seed_emails(
+        num_senders=args.senders,
+        emails_per_sender_per_year=args.emails_per_sender_per_year,
+        num_years=args.years,
+        end_year=args.end_year,
+        chunk_size=args.chunk_size
+    )
+    seed_comments(num_top_level_comments=args.comments, max_replies=args.max_replies, chunk_size=args.chunk_size)
@@ -0,0 +1,76 @@
+"""
+Shared fixtures.
+
+The tests run against a SQLite database in a temporary directory, created
+with webapp.migrate and seeded once per session with seed.py's generator
+(a fixed seed, so every run sees the same data). Views over their query
+budget raise, as QUERY_BUDGET_STRICT is on, and activity is written
+inline rather than by the background writer. Run from the project
+directory:
+
+    python -m pytest -q
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+_DB_DIR = tempfile.mkdtemp(prefix='email_app_tests_')
+# Read by config.Config when it is first imported, below
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_DB_DIR, 'tests.db')
+os.environ['QUERY_BUDGET_STRICT'] = 'true'
+os.environ['ACTIVITY_LOG_ASYNC'] = 'false'
+os.environ['RESULT_CACHE_BACKEND'] = 'memory'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import seed
+from webapp import create_app
+from webapp.database import db_session, get_engine
+from webapp.migrate import upgrade
+
+SEED = 7
+# 2 users x 5 senders x 2 years x 20 emails
+SEED_EMAILS = dict(num_senders=5, emails_per_sender_per_year=20, num_years=2, end_year=2024, chunk_size=100)
+SEED_COMMENTS = dict(num_top_level_comments=80, max_replies=3, chunk_size=100)
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app()
+    app.config['TESTING'] = True
+    upgrade(get_engine())
+    seed.set_seed(SEED)
+    seed.seed_users()
+    seed.seed_emails(**SEED_EMAILS)
+    seed.seed_comments(**SEED_COMMENTS)
+    db_session.remove()
+    yield app
+    db_session.remove()
+    get_engine().dispose()
+    shutil.rmtree(_DB_DIR, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def _session(app):
+    # Each test starts without leftover objects or an open transaction
+    yield
+    db_session.remove()
+
+
+@pytest.fixture
+def client(app):
+    """A test client logged in as admin."""
+    client = app.test_client()
+    response = client.post('/auth/login', data={'username': 'admin', 'password': 'password'})
+    assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def user_client(app):
+    """A test client logged in as testuser, who is not an admin."""
+    client = app.test_client()
+    response = client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+    assert response.status_code == 302
+    return client
@@ -0,0 +1,94 @@
+import uuid
+from datetime import date, datetime, timedelta
+import pytest
+from sqlalchemy import select, insert, delete, func
+from webapp.database import db_session
+from webapp.models import User, UserActivity, ActivityRollup, ActivityRollupLog
+from webapp.activity_retention import rollup_activity, purge_activity, rolled_up_through
+from webapp.services import get_activity_summary
+from webapp.instrumentation import count_queries
+
+# Long before the activity the other tests write, so only these days are rolled up
+FIRST_DAY = date(2020, 1, 1)
+DAYS = 6
+TODAY = FIRST_DAY + timedelta(days=DAYS)
+
+
+@pytest.fixture
+def old_activity():
+    user_ids = db_session.execute(select(User.id).order_by(User.id)).scalars().all()
+    rows = []
+    for offset in range(DAYS):
+        day = datetime.combine(FIRST_DAY + timedelta(days=offset), datetime.min.time())
+        for i in range(offset + 2):
+            rows.append({
+                'id': str(uuid.uuid4()),
+                'user_id': user_ids[i % len(user_ids)],
+                'token': 'test',
+                'activity': ('search', 'view_activity')[i % 2],
+                'timestamp': day + timedelta(hours=i, minutes=offset),
+            })
+    db_session.execute(insert(UserActivity.__table__), rows)
+    db_session.commit()
+    yield user_ids
+    old = UserActivity.timestamp < datetime.combine(TODAY, datetime.min.time())
+    db_session.execute(delete(UserActivity).where(old))
+    db_session.execute(delete(ActivityRollup).where(ActivityRollup.day < TODAY))
+    db_session.execute(delete(ActivityRollupLog).where(ActivityRollupLog.day < TODAY))
+    db_session.commit()
+
+
+def _raw_rows():
+    return db_session.execute(
+        select(func.count()).select_from(UserActivity)
+        .where(UserActivity.timestamp < datetime.combine(TODAY, datetime.min.time()))
+    ).scalar()
+
+
+def test_summary_is_unchanged_by_rollup_and_purge(old_activity):
+    last_day = TODAY - timedelta(days=1)
+    before = get_activity_summary(FIRST_DAY, last_day)
+    before_user = get_activity_summary(FIRST_DAY, last_day, old_activity[0])
+    assert before['rolled_up_through'] is None
+    assert sum(row['count'] for row in before['rows']) == _raw_rows() > 0
+
+    days, rows, _ = rollup_activity(db_session, today=TODAY)
+    assert (days, rows) == (DAYS, _raw_rows())
+    assert rolled_up_through(db_session) == last_day
+    assert purge_activity(db_session, retain_days=0, chunk_size=7, today=TODAY) == rows
+    assert _raw_rows() == 0
+
+    after = get_activity_summary(FIRST_DAY, last_day)
+    assert after['rows'] == before['rows']
+    assert after['rolled_up_through'] == last_day.isoformat()
+    assert get_activity_summary(FIRST_DAY, last_day, old_activity[0])['rows'] == before_user['rows']
+
+
+def test_purge_keeps_days_that_are_not_rolled_up(old_activity):
+    # Only the first three days are rolled up
+    rollup_activity(db_session, today=FIRST_DAY + timedelta(days=3))
+    purge_activity(db_session, retain_days=0, today=TODAY)
+    first_kept = db_session.execute(select(func.min(UserActivity.timestamp))).scalar()
+    assert first_kept.date() == FIRST_DAY + timedelta(days=3)
+
+    summary = get_activity_summary(FIRST_DAY, TODAY - timedelta(days=1))
+    assert sum(row['count'] for row in summary['rows']) == sum(offset + 2 for offset in range(DAYS))
+
+
+@pytest.mark.parametrize('rolled_up_days', [0, 3])
+def test_summary_of_a_long_range_is_a_few_queries(old_activity, rolled_up_days):
+    if rolled_up_days:
+        rollup_activity(db_session, today=FIRST_DAY + timedelta(days=rolled_up_days))
+    with count_queries() as counter:
+        summary = get_activity_summary(date(2000, 1, 1), date(2024, 12, 31))
+    assert counter.count <= 4
+    days = {row['day'] for row in summary['rows']}
+    assert {(FIRST_DAY + timedelta(days=offset)).isoformat() for offset in range(DAYS)} <= days
+    old = [row for row in summary['rows'] if row['day'] < TODAY.isoformat()]
+    assert sum(row['count'] for row in old) == sum(offset + 2 for offset in range(DAYS))
+
+
+def test_summary_view_stays_within_budget(client, old_activity):
+    response = client.get('/api/activity/summary?start_date=2000-01-01&end_date=2024-12-31')
+    assert response.status_code == 200
+    assert response.get_json()['rows']
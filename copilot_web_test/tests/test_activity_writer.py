@@ -0,0 +1,105 @@
+"""
+The background activity writer: rows queued by requests are written in
+batches by a worker thread, and a full queue drops rather than waits.
+"""
+import json
+import threading
+from datetime import datetime
+import pytest
+from sqlalchemy import select, delete, func
+from config import Config
+from webapp import metrics
+from webapp.database import db_session
+from webapp.models import User, UserActivity
+from webapp.activity_writer import ActivityWriter, activity_writer
+from webapp.instrumentation import count_queries
+
+TOKEN = 'writer-test'
+
+
+@pytest.fixture
+def user_id(app):
+    yield db_session.execute(select(User.id).where(User.username == 'testuser')).scalar_one()
+    db_session.rollback()
+    db_session.execute(delete(UserActivity).where(UserActivity.token == TOKEN))
+    db_session.commit()
+
+
+def _writer(**overrides):
+    writer = ActivityWriter()
+    writer.configure(dict(vars(Config), **overrides))
+    return writer
+
+
+def _row(user_id, i):
+    return {'user_id': user_id, 'token': TOKEN, 'activity': f'writer_test_{i}',
+            'details': {'i': i}, 'timestamp': datetime.utcnow()}
+
+
+def _written():
+    db_session.remove()
+    return db_session.execute(
+        select(UserActivity.activity, UserActivity.details).where(UserActivity.token == TOKEN)
+    ).all()
+
+
+def test_rows_are_written_in_batches(user_id, monkeypatch):
+    writer = _writer(ACTIVITY_BATCH_SIZE=10, ACTIVITY_FLUSH_INTERVAL_MS=5000)
+    batches = []
+    flush = writer._flush
+    monkeypatch.setattr(writer, '_flush', lambda batch: batches.append(len(batch)) or flush(batch))
+
+    for i in range(25):
+        assert writer.submit(_row(user_id, i))
+    writer.stop()
+
+    assert sum(batches) == 25
+    assert max(batches) <= 10
+    rows = _written()
+    assert len(rows) == 25
+    # Details are serialized on the writer thread
+    assert {json.loads(details)['i'] for _, details in rows} == set(range(25))
+
+
+def test_full_queue_drops_rows(user_id, monkeypatch):
+    writer = _writer(ACTIVITY_BATCH_SIZE=1, ACTIVITY_QUEUE_SIZE=2, ACTIVITY_QUEUE_POLICY='drop')
+    release = threading.Event()
+    busy = threading.Event()
+    flush = writer._flush
+
+    def slow_flush(batch):
+        busy.set()
+        release.wait(5)
+        flush(batch)
+    monkeypatch.setattr(writer, '_flush', slow_flush)
+
+    dropped = metrics.snapshot()['counters'].get('activity_writer.dropped', 0)
+    assert writer.submit(_row(user_id, 0))
+    # The writer holds the first row; two more fill the queue
+    assert busy.wait(5)
+    assert writer.submit(_row(user_id, 1))
+    assert writer.submit(_row(user_id, 2))
+    assert not writer.submit(_row(user_id, 3))
+    assert metrics.snapshot()['counters']['activity_writer.dropped'] == dropped + 1
+
+    release.set()
+    writer.stop()
+    assert len(_written()) == 3
+
+
+def _searches():
+    db_session.remove()
+    return db_session.execute(
+        select(func.count()).select_from(UserActivity).where(UserActivity.activity == 'search')
+    ).scalar()
+
+
+def test_requests_queue_activity_instead_of_inserting(client, monkeypatch):
+    monkeypatch.setitem(client.application.config, 'ACTIVITY_LOG_ASYNC', True)
+    before = _searches()
+    with count_queries() as counter:
+        assert client.get('/search').status_code == 200
+    assert not any(statement.startswith('INSERT INTO user_activity') for statement in counter.statements)
+
+    activity_writer.stop()
+    assert _searches() == before + 1
@@ -0,0 +1,49 @@
+"""
+The render-free JSON mode of /api/search and /api/activity: plain rows in
+the column order the grid shows, and a pagination fragment without the
+keyset cursor.
+"""
+from webapp.api.routes import SEARCH_COLUMNS, ACTIVITY_COLUMNS, pagination_cache
+from webapp.instrumentation import count_queries
+
+
+def test_search_rows_match_the_html_results(client):
+    data = client.get('/api/search?format=json&per_page=20&sort_by=unique_email_id&sort_order=asc').get_json()
+    html = client.get('/api/search?per_page=20&sort_by=unique_email_id&sort_order=asc').get_json()
+    assert data['columns'] == SEARCH_COLUMNS
+    assert len(data['rows']) == 20
+    assert all(len(row) == len(SEARCH_COLUMNS) for row in data['rows'])
+    for row in data['rows']:
+        assert row[0] in html['results_html']
+    assert data['total'] == html['total']
+    assert data['next_cursor'] == html['next_cursor']
+
+
+def test_pagination_fragment_has_no_cursor_and_is_cached(client):
+    pagination_cache.clear()
+    url = '/api/search?format=json&per_page=20'
+    first = client.get(url).get_json()
+    assert first['next_cursor']
+    assert 'cursor=' not in first['pagination_html']
+    assert len(pagination_cache) == 1
+    assert client.get(url).get_json()['pagination_html'] == first['pagination_html']
+    assert len(pagination_cache) == 1
+
+
+def test_activity_rows(client):
+    client.get('/search')
+    data = client.get('/api/activity?format=json&per_page=10').get_json()
+    assert data['columns'] == ACTIVITY_COLUMNS
+    assert 0 < len(data['rows']) <= 10
+    assert all(len(row) == len(ACTIVITY_COLUMNS) for row in data['rows'])
+    assert all(row[0] in ('admin', 'testuser') for row in data['rows'])
+
+
+def test_activity_users_are_joined_not_loaded_per_row(client):
+    for _ in range(5):
+        client.get('/search')
+    with count_queries() as small:
+        client.get('/api/activity?format=json&per_page=2')
+    with count_queries() as large:
+        client.get('/api/activity?format=json&per_page=50')
+    assert large.count == small.count
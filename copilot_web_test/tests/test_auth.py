@@ -0,0 +1,129 @@
+"""
+Login throttling and the cached user identities, driven through
+/auth/login with the test client.
+"""
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import select, delete
+from webapp.database import db_session
+from webapp.models import User, UserActivity
+from webapp.auth import throttle
+from webapp.auth.throttle import login_throttle
+from webapp.auth.identity import identity_cache
+from webapp.instrumentation import count_queries
+
+
+@pytest.fixture
+def clock(app, monkeypatch):
+    """Fresh buckets on a clock the test moves forward."""
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(throttle, 'time', SimpleNamespace(monotonic=lambda: now.value))
+    login_throttle._buckets = None
+    yield now
+    login_throttle._buckets = None
+
+
+def _login(client, username, password='wrong', ip='10.0.0.1'):
+    return client.post('/auth/login', data={'username': username, 'password': password},
+                       environ_base={'REMOTE_ADDR': ip})
+
+
+def test_user_bucket_refuses_after_the_burst(app, clock):
+    client = app.test_client()
+    burst = app.config['LOGIN_USER_BURST']
+    # From a new address each time, so only the user's bucket empties
+    for i in range(burst):
+        assert _login(client, 'admin', ip=f'10.0.1.{i}').status_code == 200
+    assert _login(client, 'admin', 'password', ip='10.0.2.1').status_code == 429
+    # Other users are not affected
+    assert _login(client, 'testuser', 'password', ip='10.0.2.1').status_code == 302
+
+
+def test_ip_bucket_refuses_after_the_burst(app, clock):
+    client = app.test_client()
+    burst = app.config['LOGIN_IP_BURST']
+    for i in range(burst):
+        assert _login(client, f'nobody{i}', ip='10.0.3.1').status_code == 200
+    assert _login(client, 'admin', 'password', ip='10.0.3.1').status_code == 429
+    assert _login(client, 'admin', 'password', ip='10.0.3.2').status_code == 302
+
+
+def test_buckets_refill(app, clock):
+    client = app.test_client()
+    for _ in range(app.config['LOGIN_USER_BURST']):
+        _login(client, 'testuser')
+    assert _login(client, 'testuser', 'password').status_code == 429
+
+    # One token comes back every 60 / LOGIN_USER_PER_MINUTE seconds
+    clock.value += 60 / app.config['LOGIN_USER_PER_MINUTE']
+    assert _login(client, 'testuser', 'password').status_code == 302
+
+
+def test_successful_logins_are_not_throttled(app, clock):
+    client = app.test_client()
+    for _ in range(app.config['LOGIN_USER_BURST'] + 1):
+        assert _login(client, 'testuser', 'password').status_code == 302
+
+
+def test_refused_login_does_not_check_the_password(app, clock, monkeypatch):
+    client = app.test_client()
+    for _ in range(app.config['LOGIN_USER_BURST']):
+        _login(client, 'testuser')
+
+    checked = []
+    monkeypatch.setattr(User, 'check_password', lambda user, password: checked.append(password) or False)
+    with count_queries() as counter:
+        assert _login(client, 'testuser').status_code == 429
+    assert checked == []
+    assert not any('FROM users' in statement for statement in counter.statements)
+
+
+def test_identity_is_cached(user_client):
+    user_client.get('/')
+    with count_queries() as counter:
+        assert b'testuser' in user_client.get('/').data
+    assert not any('FROM users' in statement for statement in counter.statements)
+
+
+@pytest.fixture
+def temporary_user(app):
+    user = User(username='temporary')
+    user.set_password('password')
+    db_session.add(user)
+    db_session.commit()
+    user_id = user.id
+    yield user_id
+    db_session.rollback()
+    db_session.execute(delete(UserActivity).where(UserActivity.user_id == user_id))
+    db_session.execute(delete(User).where(User.id == user_id))
+    db_session.commit()
+
+
+def _temporary_client(app):
+    client = app.test_client()
+    assert _login(client, 'temporary', 'password').status_code == 302
+    return client
+
+
+def test_renamed_user_is_reloaded(app, temporary_user):
+    client = _temporary_client(app)
+    assert b'temporary,' in client.get('/').data
+    assert identity_cache.get(temporary_user) is not None
+
+    db_session.get(User, temporary_user).username = 'renamed'
+    db_session.commit()
+    assert identity_cache.get(temporary_user) is None
+    assert b'renamed,' in client.get('/').data
+
+
+def test_deleted_user_is_logged_out(app, temporary_user):
+    client = _temporary_client(app)
+    assert client.get('/').status_code == 200
+
+    db_session.execute(delete(UserActivity).where(UserActivity.user_id == temporary_user))
+    db_session.delete(db_session.get(User, temporary_user))
+    db_session.commit()
+    assert identity_cache.get(temporary_user) is None
+    response = client.get('/')
+    assert response.status_code == 302
+    assert '/auth/login' in response.headers['Location']
@@ -0,0 +1,106 @@
+"""
+Email bodies: deferred on the emails table, previewed at ingest, and with
+EMAIL_BODY_STORAGE = 'compressed' kept compressed in email_bodies and read
+back through webapp.bodies.
+"""
+from datetime import datetime
+import pytest
+from sqlalchemy import create_engine, select, delete, insert, inspect, text
+from sqlalchemy.orm import Session
+from config import Config
+from webapp.database import Base, db_session
+from webapp.models import Email, EmailBody
+from webapp.references import linked_body_cache
+from webapp.bodies import (PREVIEW_LENGTH, make_preview, compress_body, body_text, load_body, email_rows,
+                           insert_bodies, add_preview_column, backfill_bodies)
+
+BODY = 'Quarterly figures.\n\n  The market moved   on policy news. ' + 'More detail follows. ' * 20
+EMAIL_ID = 'Stored-24-90003'
+
+
+def test_preview_is_one_line_cut_at_a_word():
+    preview = make_preview(BODY)
+    assert preview.startswith('Quarterly figures. The market moved on policy news.')
+    assert preview.endswith('...')
+    assert len(preview) <= PREVIEW_LENGTH + 3
+    assert make_preview('Short body.') == 'Short body.'
+    assert make_preview('') is None
+    assert make_preview(None) is None
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'zstd'])
+def test_compressed_body_round_trip(codec):
+    if codec == 'zstd':
+        pytest.importorskip('zstandard')
+    data = compress_body(BODY, codec)
+    assert len(data) < len(BODY.encode('utf-8'))
+    assert body_text(None, codec, data) == BODY
+    assert body_text('inline', None, None) == 'inline'
+
+
+def test_lists_do_not_load_bodies():
+    emails = db_session.execute(select(Email).limit(5)).scalars().all()
+    assert emails
+    assert all('body' not in vars(email) for email in emails)
+    assert all(email.preview for email in emails)
+
+
+@pytest.fixture
+def compressed_email(app, monkeypatch):
+    monkeypatch.setattr(Config, 'EMAIL_BODY_STORAGE', 'compressed')
+    rows = [{'unique_email_id': EMAIL_ID, 'title': 'Stored email', 'body': BODY, 'sender_name': 'Stored Sender',
+             'email_type': 'Work', 'date_sent': datetime(2024, 6, 1)}]
+    db_session.execute(insert(Email.__table__), email_rows(rows))
+    insert_bodies(db_session, rows)
+    db_session.commit()
+    yield
+    db_session.rollback()
+    db_session.execute(delete(EmailBody).where(EmailBody.email_id == EMAIL_ID))
+    db_session.execute(delete(Email).where(Email.unique_email_id == EMAIL_ID))
+    db_session.commit()
+
+
+def test_compressed_body_is_stored_off_the_emails_table(compressed_email):
+    row = db_session.execute(select(Email.body, Email.preview).where(Email.unique_email_id == EMAIL_ID)).one()
+    assert row.body is None
+    assert row.preview == make_preview(BODY)
+    stored = db_session.execute(select(EmailBody).where(EmailBody.email_id == EMAIL_ID)).scalar_one()
+    assert stored.codec == Config.EMAIL_BODY_CODEC
+    assert load_body(db_session, EMAIL_ID) == BODY
+    assert load_body(db_session, 'No-Such-Email') is None
+
+
+def test_view_shows_a_compressed_body(client, compressed_email):
+    linked_body_cache.clear()
+    response = client.get(f'/email/{EMAIL_ID}')
+    assert response.status_code == 200
+    assert b'The market moved   on policy news.' in response.data
+
+
+@pytest.fixture
+def old_database(tmp_path):
+    """A database from before previews: an emails table without the column, and inline bodies."""
+    engine = create_engine(f'sqlite:///{tmp_path / "old.db"}')
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(text('ALTER TABLE emails DROP COLUMN preview'))
+        for number in range(5):
+            connection.execute(text('INSERT INTO emails (unique_email_id, title, body) VALUES (:id, :title, :body)'),
+                               {'id': f'Old-24-{number}', 'title': f'Old {number}', 'body': f'{number} {BODY}'})
+    yield engine
+    engine.dispose()
+
+
+def test_backfill_fills_previews_and_moves_bodies(old_database):
+    add_preview_column(old_database)
+    add_preview_column(old_database)
+    assert 'preview' in {column['name'] for column in inspect(old_database).get_columns('emails')}
+
+    with Session(old_database) as session:
+        assert backfill_bodies(session, chunk_size=2) == (5, 0)
+        assert backfill_bodies(session, compress=True, chunk_size=2) == (0, 5)
+        assert backfill_bodies(session, compress=True, chunk_size=2) == (0, 0)
+        assert session.execute(select(Email.unique_email_id).where(Email.body.isnot(None))).all() == []
+        for number in range(5):
+            assert load_body(session, f'Old-24-{number}') == f'{number} {BODY}'
+            assert session.get(Email, f'Old-24-{number}').preview == make_preview(f'{number} {BODY}')
@@ -0,0 +1,108 @@
+"""
+The comment thread of an email, paged by top-level comment and polled with
+`since`. The thread is built on an email without seeded comments and
+removed again afterwards.
+"""
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import select, delete
+from webapp.database import db_session
+from webapp.models import Email, Comment, User
+
+START = datetime(2024, 6, 1, 9, 0)
+
+
+@pytest.fixture
+def thread(app):
+    """
+    Three top-level comments an hour apart with replies; the reply to the
+    oldest one is posted last, so it is on the last page but has the highest id.
+    """
+    email_id = db_session.execute(
+        select(Email.unique_email_id).where(Email.comment_count == 0).order_by(Email.unique_email_id).limit(1)
+    ).scalar_one()
+    user_id = db_session.execute(select(User.id).where(User.username == 'admin')).scalar_one()
+
+    def add(body, minutes, parent=None):
+        comment = Comment(email_id=email_id, user_id=user_id, body=body,
+                          timestamp=START + timedelta(minutes=minutes), parent_id=parent and parent.id)
+        db_session.add(comment)
+        db_session.flush()
+        return comment
+
+    first = add('first', 0)
+    second = add('second', 60)
+    add('reply to second', 70, second)
+    third = add('third', 120)
+    late = add('late reply to first', 180, first)
+    add('reply to the late reply', 190, late)
+    db_session.commit()
+
+    yield email_id, [first, second, third], late
+    db_session.execute(delete(Comment).where(Comment.email_id == email_id, Comment.parent_id.is_not(None)))
+    db_session.execute(delete(Comment).where(Comment.email_id == email_id))
+    db_session.commit()
+
+
+def _comments(client, email_id, **args):
+    response = client.get(f'/api/emails/{email_id}/comments', query_string=args)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_pages_cover_the_thread_once(client, thread):
+    email_id, top_level, _ = thread
+    seen = []
+    cursor = ''
+    while True:
+        data = _comments(client, email_id, per_page=1, cursor=cursor)
+        seen.extend(data['comments'])
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+
+    ids = [comment['id'] for comment in seen]
+    assert len(ids) == len(set(ids)) == 6
+    assert [comment['body'] for comment in seen if comment['parent_id'] is None] == ['third', 'second', 'first']
+    # Replies follow their parent, one level deeper
+    depths = {comment['id']: comment['depth'] for comment in seen}
+    for comment in seen:
+        if comment['parent_id'] is not None:
+            assert ids.index(comment['parent_id']) < ids.index(comment['id'])
+            assert comment['depth'] == depths[comment['parent_id']] + 1
+
+
+def test_latest_id_includes_replies_on_later_pages(client, thread):
+    email_id, _, _ = thread
+    newest = db_session.execute(
+        select(Comment.id).where(Comment.email_id == email_id).order_by(Comment.id.desc()).limit(1)
+    ).scalar_one()
+
+    data = _comments(client, email_id, per_page=1)
+    assert [comment['body'] for comment in data['comments']] == ['third']
+    assert data['latest_id'] == newest
+    # Polling with it finds nothing new
+    assert _comments(client, email_id, since=data['latest_id'])['comments'] == []
+
+
+def test_since_id_returns_only_newer_comments(client, thread):
+    email_id, _, late = thread
+    data = _comments(client, email_id, since=late.id - 1)
+    assert [comment['body'] for comment in data['comments']] == ['late reply to first', 'reply to the late reply']
+    assert [comment['depth'] for comment in data['comments']] == [1, 2]
+    assert data['latest_id'] == late.id + 1
+    assert data['next_cursor'] is None
+
+
+def test_since_timestamp_returns_only_newer_comments(client, thread):
+    email_id, _, _ = thread
+    since = (START + timedelta(minutes=90)).isoformat()
+    data = _comments(client, email_id, since=since)
+    assert [comment['body'] for comment in data['comments']] == [
+        'third', 'late reply to first', 'reply to the late reply']
+
+
+def test_invalid_since_is_rejected(client, thread):
+    email_id, _, _ = thread
+    response = client.get(f'/api/emails/{email_id}/comments', query_string={'since': 'yesterday'})
+    assert response.status_code == 400
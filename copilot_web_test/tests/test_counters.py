@@ -0,0 +1,73 @@
+"""
+The denormalized comment_count and reference_count columns agree with
+the comments and references they count, and drift is repaired.
+"""
+from sqlalchemy import select, update, func, exists
+from webapp.database import db_session
+from webapp.models import Email, Comment
+from webapp.counters import repair_counters, count_references
+
+
+def _search_total(client, **filters):
+    query = '&'.join(f'{name}={value}' for name, value in filters.items())
+    return client.get(f'/api/search?format=json&count=exact&{query}').get_json()['total']
+
+
+def test_count_references():
+    assert count_references(None) == 0
+    assert count_references('') == 0
+    assert count_references('A-24-1001, B-24-1002,,') == 2
+
+
+def test_seeded_counters_are_consistent(app):
+    checked, fixed = repair_counters(db_session, chunk_size=64, dry_run=True)
+    assert checked == db_session.execute(select(func.count()).select_from(Email)).scalar()
+    assert fixed == 0
+
+
+def test_filters_match_the_rows_they_count(client):
+    with_comments = db_session.execute(
+        select(func.count()).select_from(Email)
+        .where(exists().where(Comment.email_id == Email.unique_email_id))
+    ).scalar()
+    with_references = db_session.execute(
+        select(func.count()).select_from(Email).where(func.length(Email.references) > 0)
+    ).scalar()
+    assert _search_total(client, has_comments='true') == with_comments > 0
+    assert _search_total(client, has_references='true') == with_references > 0
+
+
+def test_most_discussed_sort(client):
+    rows = client.get('/api/search?format=json&sort_by=comment_count&sort_order=desc&per_page=5').get_json()['rows']
+    most = db_session.execute(select(func.max(Email.comment_count))).scalar()
+    assert rows[0][4] == most
+    assert [row[4] for row in rows] == sorted((row[4] for row in rows), reverse=True)
+
+
+def test_drifted_counter_is_repaired(app):
+    email_id = db_session.execute(
+        select(Email.unique_email_id).where(Email.comment_count > 0).order_by(Email.unique_email_id).limit(1)
+    ).scalar_one()
+    actual = db_session.execute(select(func.count()).where(Comment.email_id == email_id)).scalar()
+    db_session.execute(update(Email.__table__).where(Email.__table__.c.unique_email_id == email_id)
+                       .values(comment_count=actual + 5))
+    db_session.commit()
+
+    assert repair_counters(db_session, dry_run=True)[1] == 1
+    assert repair_counters(db_session)[1] == 1
+    assert db_session.execute(select(Email.comment_count).where(Email.unique_email_id == email_id)).scalar() == actual
+
+
+def test_orm_writes_keep_reference_count(app):
+    email = db_session.execute(
+        select(Email).where(Email.reference_count == 0).order_by(Email.unique_email_id).limit(1)
+    ).scalar_one()
+    original = email.references
+    try:
+        email.references = 'A-24-1001,B-24-1002'
+        db_session.commit()
+        assert email.reference_count == 2
+    finally:
+        email.references = original
+        db_session.commit()
+    assert email.reference_count == count_references(original)
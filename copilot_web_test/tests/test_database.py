@@ -0,0 +1,68 @@
+"""
+Engine setup: one engine per process, built from the pool settings in
+Config, and a fresh one in a forked worker.
+"""
+import os
+from types import SimpleNamespace
+from sqlalchemy import text
+from config import Config
+from webapp import metrics
+from webapp.database import get_engine, db_session, _create_engine, TimedQueuePool
+
+
+def _config(tmp_path, **overrides):
+    settings = dict(vars(Config), SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path}/pool.db')
+    settings.update(overrides)
+    return SimpleNamespace(**settings)
+
+
+def test_engine_is_created_once_per_process(app):
+    assert get_engine() is get_engine()
+    assert db_session.get_bind() is get_engine()
+
+
+def test_forked_worker_gets_its_own_engine(app):
+    parent = get_engine()
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            child = get_engine()
+            ok = child is not parent and child.pool is not parent.pool
+            os.write(write_end, b'1' if ok else b'0')
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    os.waitpid(pid, 0)
+    assert os.read(read_end, 1) == b'1'
+    os.close(read_end)
+    # The parent keeps its engine and its connections
+    assert get_engine() is parent
+    db_session.execute(text('SELECT 1'))
+
+
+def test_pool_is_sized_from_config(tmp_path):
+    engine = _create_engine(_config(tmp_path, DB_POOL_SIZE=3, DB_MAX_OVERFLOW=2, DB_POOL_TIMEOUT=7,
+                                    DB_POOL_RECYCLE=600))
+    try:
+        pool = engine.pool
+        assert isinstance(pool, TimedQueuePool)
+        assert pool.size() == 3
+        assert pool._max_overflow == 2
+        assert pool.timeout() == 7
+        assert pool._recycle == 600
+    finally:
+        engine.dispose()
+
+
+def test_checkout_wait_is_recorded(tmp_path):
+    engine = _create_engine(_config(tmp_path))
+    try:
+        before = metrics.snapshot()['timings'].get('db.pool.checkout_wait', {}).get('count', 0)
+        with engine.connect() as connection:
+            # SQLite connections are set up for concurrent readers
+            assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert metrics.snapshot()['gauges']['db.pool.checked_out'] == 1
+        assert metrics.snapshot()['timings']['db.pool.checkout_wait']['count'] == before + 1
+    finally:
+        engine.dispose()
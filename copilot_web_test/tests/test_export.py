@@ -0,0 +1,62 @@
+"""
+Streamed exports of search results and the activity log, as CSV or
+NDJSON and optionally gzipped.
+"""
+import csv
+import gzip
+import io
+import json
+from sqlalchemy import select
+from webapp.database import db_session
+from webapp.models import Email
+from webapp.services import SEARCH_EXPORT_COLUMNS, ACTIVITY_EXPORT_COLUMNS
+from webapp.export import iter_export
+
+
+def _search_total(client, query):
+    return client.get(f'/api/search?format=json&count=exact&{query}').get_json()['total']
+
+
+def test_search_export_csv(client):
+    response = client.get('/api/search/export?email_type=Work&sort_by=unique_email_id&sort_order=asc')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/csv')
+    assert 'emails.csv' in response.headers['Content-Disposition']
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == list(SEARCH_EXPORT_COLUMNS)
+    assert len(rows) - 1 == _search_total(client, 'email_type=Work') > 0
+    ids = [row[0] for row in rows[1:]]
+    assert ids == sorted(ids)
+    assert {row[SEARCH_EXPORT_COLUMNS.index('email_type')] for row in rows[1:]} == {'Work'}
+
+
+def test_search_export_ndjson_gzip(client):
+    response = client.get('/api/search/export?format=ndjson&gzip=true&email_type=Spam')
+    assert response.headers['Content-Type'] == 'application/gzip'
+    assert 'emails.ndjson.gz' in response.headers['Content-Disposition']
+    lines = gzip.decompress(response.get_data()).decode('utf-8').splitlines()
+    records = [json.loads(line) for line in lines]
+    assert len(records) == _search_total(client, 'email_type=Spam') > 0
+    assert set(records[0]) == set(SEARCH_EXPORT_COLUMNS)
+    # Datetimes are written as ISO strings
+    assert 'T' in records[0]['date_sent']
+
+
+def test_activity_export_is_for_the_admin(client, user_client):
+    client.get('/search')
+    response = client.get('/api/activity/export?format=ndjson')
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert records and set(records[0]) == set(ACTIVITY_EXPORT_COLUMNS)
+    assert user_client.get('/api/activity/export').status_code == 403
+
+
+def test_export_is_written_in_buffered_chunks(app):
+    statement = select(Email.unique_email_id).order_by(Email.unique_email_id)
+    total = len(db_session.execute(statement).all())
+    chunks = list(iter_export(statement, {}, ['unique_email_id'], chunk_size=50, buffer_size=1024))
+    assert len(chunks) > 1
+    assert all(len(chunk) >= 1024 for chunk in chunks[:-1])
+    lines = b''.join(chunks).decode('utf-8').splitlines()
+    assert lines[0] == 'unique_email_id'
+    assert len(lines) - 1 == total
@@ -0,0 +1,85 @@
+"""
+Search facets: the counts per sender, type and month agree with the totals
+of the searches they narrow to, whether they come from email_facet_counts
+or from grouping the matching emails.
+"""
+from datetime import datetime
+import pytest
+from sqlalchemy import select
+from webapp.database import db_session
+from webapp.facets import add_facet_counts, rebuild_facet_counts
+from webapp.instrumentation import count_queries
+from webapp.models import EmailFacetCount
+from webapp.result_cache import result_cache
+
+
+def _search_total(client, **filters):
+    query = '&'.join(f'{name}={value}' for name, value in filters.items())
+    return client.get(f'/api/search?format=json&count=exact&{query}').get_json()['total']
+
+
+def _facet_rows():
+    return sorted(db_session.execute(
+        select(EmailFacetCount.day, EmailFacetCount.sender_name, EmailFacetCount.email_type, EmailFacetCount.count)
+    ).all())
+
+
+@pytest.mark.parametrize('filters', [
+    {},
+    {'start_date': '2024-03-01', 'end_date': '2024-06-30'},
+    {'search_term': 'market'},
+    {'has_comments': 'true'},
+])
+def test_facets_add_up_to_the_search_total(client, filters):
+    query = '&'.join(f'{name}={value}' for name, value in filters.items())
+    facets = client.get(f'/api/search/facets?{query}').get_json()
+    assert facets['total'] == _search_total(client, **filters)
+    for name in ('senders', 'email_types', 'months'):
+        assert sum(item['count'] for item in facets[name]) == facets['total']
+
+
+@pytest.mark.parametrize('search_term', ['', 'market'])
+def test_each_sender_count_is_the_total_of_its_filter(client, search_term):
+    facets = client.get(f'/api/search/facets?search_term={search_term}').get_json()
+    assert facets['senders']
+    for item in facets['senders']:
+        assert item['count'] == _search_total(client, search_term=search_term, sender=item['value'])
+
+
+def test_facets_are_cached_with_the_results(client):
+    result_cache.invalidate()
+    url = '/api/search/facets?email_type=Work'
+    first = client.get(url).get_json()
+    assert first['total']
+    with count_queries() as counter:
+        assert client.get(url).get_json() == first
+    # Only the activity row of the second request
+    assert len(counter.statements) == 1
+
+
+def test_seeded_counts_match_a_rebuild():
+    seeded = _facet_rows()
+    assert seeded
+    rebuild_facet_counts(db_session)
+    assert _facet_rows() == seeded
+
+
+def test_new_emails_are_counted():
+    day, sender_name, email_type, count = _facet_rows()[0]
+    date_sent = datetime(day.year, day.month, day.day, 12)
+    add_facet_counts(db_session, [
+        {'date_sent': date_sent, 'sender_name': sender_name, 'email_type': email_type},
+        {'date_sent': date_sent, 'sender_name': sender_name, 'email_type': email_type},
+        {'date_sent': datetime(1999, 1, 1), 'sender_name': None, 'email_type': 'Work'},
+        {'date_sent': None, 'sender_name': sender_name, 'email_type': email_type},
+    ])
+    rows = {row[:3]: row[3] for row in _facet_rows()}
+    assert rows[day, sender_name, email_type] == count + 2
+    assert rows[datetime(1999, 1, 1).date(), '(none)', 'Work'] == 1
+    db_session.rollback()
+
+
+@pytest.mark.parametrize('search_term', ['policy', '"market policy"'])
+def test_query_text_stays_within_budget(client, search_term):
+    result_cache.invalidate()
+    assert client.get(f'/api/search/facets?search_term={search_term}').status_code == 200
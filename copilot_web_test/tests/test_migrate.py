@@ -0,0 +1,17 @@
+import pytest
+from sqlalchemy import Integer
+from sqlalchemy.dialects import oracle
+from sqlalchemy.schema import CreateTable
+from webapp.database import Base
+
+
+@pytest.mark.parametrize('table', [table for table in Base.metadata.sorted_tables
+                                   if any(isinstance(column.type, Integer) for column in table.primary_key)
+                                   and len(table.primary_key) == 1],
+                         ids=lambda table: table.name)
+def test_integer_keys_have_an_oracle_default(table):
+    # Oracle has no autoincrement; an integer key without a default makes every ORM insert fail
+    ddl = str(CreateTable(table).compile(dialect=oracle.dialect()))
+    key = next(iter(table.primary_key)).name
+    line = next(line for line in ddl.splitlines() if line.strip().startswith(key + ' '))
+    assert 'DEFAULT' in line
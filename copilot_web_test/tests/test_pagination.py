@@ -0,0 +1,65 @@
+import pytest
+
+
+def _walk(client, url):
+    """Follows next_cursor from the first page to the last; returns (total, ids)."""
+    data = client.get(url).get_json()
+    total = data['total']
+    ids = [row[0] for row in data['rows']]
+    while data['next_cursor']:
+        data = client.get(f"{url}&cursor={data['next_cursor']}").get_json()
+        ids.extend(row[0] for row in data['rows'])
+    return total, ids
+
+
+# references is NULL for most emails, date_sent never; comment_count is NOT NULL
+@pytest.mark.parametrize('sort_by', ['references', 'date_sent', 'title', 'comment_count'])
+@pytest.mark.parametrize('sort_order', ['asc', 'desc'])
+@pytest.mark.parametrize('count', ['exact', 'cached'])
+def test_cursor_walk_returns_every_row(client, sort_by, sort_order, count):
+    total, ids = _walk(client, f'/api/search?format=json&per_page=37&count={count}'
+                               f'&sort_by={sort_by}&sort_order={sort_order}')
+    assert total > 37
+    assert len(ids) == total
+    assert len(set(ids)) == total
+
+
+def test_cursor_walk_matches_offset_pages(client):
+    url = '/api/search?format=json&per_page=50&count=exact&sort_by=references&sort_order=asc'
+    _, ids = _walk(client, url)
+    paged = []
+    page = 1
+    while True:
+        rows = client.get(f'{url}&page={page}').get_json()['rows']
+        if not rows:
+            break
+        paged.extend(row[0] for row in rows)
+        page += 1
+    assert ids == paged
+
+
+def _sender_surname():
+    from webapp.database import db_session
+    from webapp.models import Sender
+    return db_session.query(Sender.name).order_by(Sender.name).first()[0].split()[-1]
+
+
+def test_cached_total_is_kept_per_filter(client):
+    from webapp.services import count_cache, search_plan
+    surname = _sender_surname()
+    exact = client.get(f'/api/search?format=json&count=exact&sender={surname}').get_json()['total']
+    assert exact > 0
+    _, _, count_key = search_plan('', 'date_sent', 'desc', surname, '', '', '', '')
+    assert count_cache.get(count_key) == exact
+
+
+@pytest.mark.parametrize('variant', ['{} ', ' {}', '{upper}'])
+def test_sender_variants_get_the_same_results(client, variant):
+    surname = _sender_surname()
+    sender = variant.format(surname, upper=surname.upper())
+    # The variant is cached first, so the plain name is answered from its entries
+    cached = client.get(f'/api/search?format=json&sender={sender}').get_json()
+    plain = client.get(f'/api/search?format=json&sender={surname}').get_json()
+    exact = client.get(f'/api/search?format=json&count=exact&sender={surname}').get_json()
+    assert cached['total'] == plain['total'] == exact['total'] > 0
+    assert [row[0] for row in plain['rows']] == [row[0] for row in exact['rows']]
@@ -0,0 +1,33 @@
+"""
+Request profiles: the Server-Timing header is off by default and, when
+enabled, only sent to the admin, who can also read /profiling.
+"""
+import pytest
+from webapp.profiling import profiler
+
+
+@pytest.fixture
+def server_timing(monkeypatch):
+    monkeypatch.setattr(profiler, 'server_timing', True)
+
+
+def test_server_timing_is_off_by_default(app, client):
+    assert not app.config['SERVER_TIMING_ENABLED']
+    assert 'Server-Timing' not in client.get('/').headers
+
+
+def test_server_timing_is_sent_to_the_admin(client, server_timing):
+    header = client.get('/').headers.get('Server-Timing', '')
+    assert header.startswith('sql;dur=')
+
+
+def test_server_timing_is_not_sent_to_other_users(app, user_client, server_timing):
+    assert 'Server-Timing' not in user_client.get('/').headers
+    assert 'Server-Timing' not in app.test_client().get('/auth/login').headers
+
+
+def test_profiling_is_for_the_admin(client, user_client):
+    client.get('/')
+    endpoints = {stats['endpoint'] for stats in client.get('/profiling').get_json()['endpoints']}
+    assert 'main.index' in endpoints
+    assert user_client.get('/profiling').status_code == 403
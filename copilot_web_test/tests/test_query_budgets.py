@@ -0,0 +1,54 @@
+"""
+Views run within their query budgets. QUERY_BUDGET_STRICT is on in the
+tests, so a view over its budget fails the request with
+QueryBudgetExceeded rather than logging a warning.
+"""
+import pytest
+from sqlalchemy import select, text
+from webapp.database import db_session
+from webapp.models import Email
+from webapp.instrumentation import query_budget, QueryBudgetExceeded
+
+
+def _discussed_email_id():
+    """An email with both references and comments, so every part of its page is loaded."""
+    return db_session.execute(
+        select(Email.unique_email_id)
+        .where(Email.reference_count > 0, Email.comment_count > 0)
+        .order_by(Email.unique_email_id)
+        .limit(1)
+    ).scalar_one()
+
+
+def test_budget_is_enforced_in_strict_mode(app):
+    @query_budget(1)
+    def two_queries():
+        db_session.execute(text('SELECT 1'))
+        db_session.execute(text('SELECT 2'))
+
+    with app.test_request_context('/'):
+        with pytest.raises(QueryBudgetExceeded):
+            two_queries()
+
+
+def test_view_email(client):
+    email_id = _discussed_email_id()
+    response = client.get(f'/email/{email_id}')
+    assert response.status_code == 200
+    assert email_id.encode() in response.data
+
+
+def test_activity(client):
+    response = client.get('/activity')
+    assert response.status_code == 200
+
+
+def test_email_comments(client):
+    email_id = _discussed_email_id()
+    response = client.get(f'/api/emails/{email_id}/comments')
+    assert response.status_code == 200
+    assert response.get_json()['comments']
+
+    latest_id = response.get_json()['latest_id']
+    response = client.get(f'/api/emails/{email_id}/comments?since={latest_id}')
+    assert response.status_code == 200
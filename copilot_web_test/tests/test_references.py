@@ -0,0 +1,60 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import select, delete
+from webapp.database import db_session
+from webapp.models import Email, EmailReference
+from webapp.references import linked_body, linked_body_cache, link_emails, get_referenced_emails
+from webapp.instrumentation import count_queries
+
+
+def _linked_email():
+    return db_session.execute(
+        select(EmailReference.source_id, EmailReference.target_id).order_by(EmailReference.source_id).limit(1)
+    ).one()
+
+
+def test_references_become_links():
+    source_id, target_id = _linked_email()
+    html = linked_body(db_session, source_id, {target_id})
+    assert f'aria-controls="collapse-{target_id}"' in html
+
+
+def test_cached_body_is_not_read_again():
+    source_id, target_id = _linked_email()
+    linked_body_cache.clear()
+    with count_queries() as first:
+        html = linked_body(db_session, source_id, {target_id})
+    with count_queries() as second:
+        assert linked_body(db_session, source_id, {target_id}) == html
+    assert first.count == 1
+    assert second.count == 0
+
+
+SOURCE_ID = 'Early-24-90001'
+TARGET_ID = 'Late-24-90002'
+
+
+@pytest.fixture
+def late_target(app):
+    yield
+    db_session.rollback()
+    db_session.execute(delete(EmailReference).where(EmailReference.source_id.in_([SOURCE_ID, TARGET_ID])))
+    db_session.execute(delete(Email).where(Email.unique_email_id.in_([SOURCE_ID, TARGET_ID])))
+    db_session.commit()
+
+
+def _ingest(email_id, body):
+    db_session.add(Email(unique_email_id=email_id, title=email_id, body=body, sender_name='Late Sender',
+                         email_type='Work', date_sent=datetime(2024, 6, 1)))
+    link_emails(db_session, [(email_id, None, body)])
+    db_session.commit()
+
+
+def test_source_ingested_before_its_target(client, late_target):
+    _ingest(SOURCE_ID, f'See {TARGET_ID} once it is filed.')
+    assert get_referenced_emails(SOURCE_ID) == []
+    assert f'collapse-{TARGET_ID}'.encode() not in client.get(f'/email/{SOURCE_ID}').data
+
+    _ingest(TARGET_ID, 'The late email.')
+    assert [email.unique_email_id for email in get_referenced_emails(SOURCE_ID)] == [TARGET_ID]
+    assert f'aria-controls="collapse-{TARGET_ID}"'.encode() in client.get(f'/email/{SOURCE_ID}').data
@@ -0,0 +1,96 @@
+import pytest
+from sqlalchemy import select
+from config import Config
+from webapp.database import db_session
+from webapp.models import Email
+from webapp.result_cache import ResultCache, MemoryStore, FileStore, result_cache
+from webapp.instrumentation import count_queries
+from webapp.services import search_emails_service, get_search_facets
+
+
+def _search(client, **params):
+    query = '&'.join(f'{name}={value}' for name, value in params.items())
+    return client.get(f'/api/search?format=json&{query}').get_json()
+
+
+def test_comment_invalidates_cached_results(client):
+    email_id = db_session.execute(
+        select(Email.unique_email_id).where(Email.comment_count == 0).order_by(Email.unique_email_id).limit(1)
+    ).scalar_one()
+    db_session.remove()
+    before = _search(client, has_comments='true')
+    # Served from the result cache the second time
+    assert _search(client, has_comments='true')['total'] == before['total']
+
+    response = client.post('/api/comments/add', data={'email_id': email_id, 'body': 'A new comment'})
+    assert response.get_json()['success']
+
+    after = _search(client, has_comments='true', per_page=1000)
+    assert after['total'] == before['total'] + 1
+    row = next(row for row in after['rows'] if row[0] == email_id)
+    assert row[4] == 1
+
+
+def _config(**overrides):
+    return dict(vars(Config), RESULT_CACHE_ENABLED=True, **overrides)
+
+
+def test_file_store_invalidation_reaches_other_processes(tmp_path):
+    # Two caches on one directory stand in for two uWSGI workers
+    first, second = ResultCache(), ResultCache()
+    for cache in (first, second):
+        cache.configure(_config(RESULT_CACHE_BACKEND='file', RESULT_CACHE_DIR=str(tmp_path)))
+    first.set('key', [1, 2, 3], first.generation())
+    assert second.get('key') == [1, 2, 3]
+
+    second.invalidate()
+    assert first.get('key') is None
+
+
+def test_memory_store_invalidation_is_per_process():
+    first, second = ResultCache(), ResultCache()
+    for cache in (first, second):
+        cache.configure(_config(RESULT_CACHE_BACKEND='memory'))
+    first.set('key', [1, 2, 3], first.generation())
+    second.invalidate()
+    assert first.get('key') == [1, 2, 3]
+
+
+def test_backend_defaults_to_memory_outside_uwsgi(tmp_path):
+    cache = ResultCache()
+    cache.configure(_config(RESULT_CACHE_BACKEND=None))
+    assert cache.backend == 'memory'
+    assert isinstance(cache.store, MemoryStore)
+    cache.configure(_config(RESULT_CACHE_BACKEND='file', RESULT_CACHE_DIR=str(tmp_path)))
+    assert isinstance(cache.store, FileStore)
+
+
+def _search_types():
+    return search_emails_service('', 1, 10, 'date_sent', 'desc', '', 'Work', '', '', '')
+
+
+def _facet_types():
+    return get_search_facets('', '', 'Work', '', '', '')
+
+
+@pytest.mark.parametrize('run', [_search_types, _facet_types])
+def test_results_loaded_across_an_invalidation_are_not_served(app, monkeypatch, run):
+    cache_set = result_cache.set
+
+    def set_after_insert(*args):
+        # Another worker commits an email after this request's queries ran
+        result_cache.invalidate()
+        cache_set(*args)
+
+    with app.app_context():
+        result_cache.invalidate()
+        monkeypatch.setattr(result_cache, 'set', set_after_insert)
+        run()
+        monkeypatch.undo()
+        with count_queries() as counter:
+            run()
+        assert counter.count > 0
+        # Loaded and stored in the current generation, so served from the cache now
+        with count_queries() as counter:
+            run()
+        assert counter.count == 0
@@ -0,0 +1,29 @@
+from sqlalchemy import insert
+from webapp.database import db_session
+from webapp.models import Email
+from webapp.search_index import (_encode_positions, _decode_positions, index_emails, phrase_email_ids,
+                                 MAX_POSITIONS_LENGTH)
+
+
+def test_positions_round_trip():
+    assert _decode_positions(_encode_positions([3, 17, 250])) == ({3, 17, 250}, False)
+
+
+def test_long_positions_are_cut_and_marked():
+    encoded = _encode_positions(range(5000))
+    assert len(encoded) <= MAX_POSITIONS_LENGTH
+    positions, truncated = _decode_positions(encoded)
+    assert truncated
+    assert positions == set(range(len(positions)))
+
+
+def test_phrase_past_truncated_positions_is_found():
+    # The positions of "zyzzyva" are cut long before the phrase
+    body = 'zyzzyva ' * 2000 + 'zyzzyva quokka'
+    db_session.execute(insert(Email.__table__), [{'unique_email_id': 'Truncated-24-0001', 'body': body}])
+    index_emails(db_session, [('Truncated-24-0001', 'A long email', body)], replace=False)
+    try:
+        assert phrase_email_ids(db_session, ['zyzzyva', 'quokka']) == ['Truncated-24-0001']
+        assert phrase_email_ids(db_session, ['quokka', 'zyzzyva']) == []
+    finally:
+        db_session.rollback()
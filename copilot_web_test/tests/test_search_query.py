@@ -0,0 +1,155 @@
+from datetime import date
+import pytest
+from sqlalchemy.dialects import sqlite
+from sqlalchemy import select, func
+from webapp.database import db_session
+from config import Config
+from webapp.models import Email, EmailToken
+from webapp.search_index import tokenize, phrase_email_ids
+from webapp.search_query import parse_query, plan_query, query_filters, phrase_cache
+from webapp.services import search_emails_service
+
+
+def text(value, prefix=False):
+    return ('text', value, prefix)
+
+
+def both(*nodes):
+    return ('and', tuple(sorted(nodes, key=repr)))
+
+
+def either(*nodes):
+    return ('or', tuple(sorted(nodes, key=repr)))
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('', None),
+    ('   ', None),
+    ('market', text('market')),
+    ('Market', text('market')),
+    ('market policy', either(text('market'), text('policy'))),
+    ('manag*', text('manag', True)),
+    ('"annual budget"', text('annual budget')),
+    ('"annual budget', text('annual budget')),
+    ('market AND policy', both(text('market'), text('policy'))),
+    ('market OR policy', either(text('market'), text('policy'))),
+    # AND binds tighter than OR
+    ('a OR b AND c', either(text('a'), both(text('b'), text('c')))),
+    ('a AND b OR c', either(both(text('a'), text('b')), text('c'))),
+    ('(a OR b) AND c', both(either(text('a'), text('b')), text('c'))),
+    # Bare words are alternatives; every other item is required
+    ('market policy "annual budget" -draft',
+     both(either(text('market'), text('policy')), text('annual budget'), ('not', text('draft')))),
+    ('NOT spam', ('not', text('spam'))),
+    ('-spam', ('not', text('spam'))),
+    ('NOT NOT spam', text('spam')),
+    ('NOT (a OR b)', ('not', either(text('a'), text('b')))),
+    # Operators are upper case only
+    ('a and b', either(text('a'), text('and'), text('b'))),
+    # Dangling operators and stray parentheses are ignored
+    ('AND market OR', text('market')),
+    ('market )(', text('market')),
+    ('from:Alice', ('field', 'from', 'alice')),
+    ('title:"Annual Budget"', ('field', 'title', 'annual budget')),
+    ('id:Sender01-24-1000', ('field', 'id', 'Sender01-24-1000')),
+    ('after:2024-01-01', ('field', 'after', date(2024, 1, 1))),
+    ('before:2024-13-01', None),
+    ('type:work', ('field', 'type', 'Work')),
+    ('type:PROMOTION', ('field', 'type', 'Promotion')),
+    ('type:Other', ('field', 'type', 'Other')),
+])
+def test_parse(query, expected):
+    assert parse_query(query) == expected
+
+
+def test_equivalent_queries_share_an_ast():
+    assert parse_query('a AND b') == parse_query('b AND a')
+    assert parse_query('x y') == parse_query('y x')
+
+
+def _sql(query):
+    shape, params = plan_query(db_session, parse_query(query))
+    return str(query_filters(shape)[0].compile(dialect=sqlite.dialect())), params
+
+
+def test_type_compares_the_stored_value():
+    sql, params = _sql('type:work')
+    assert 'lower' not in sql.lower()
+    assert 'emails.email_type =' in sql
+    assert list(params.values()) == ['Work']
+
+
+def test_type_field_matches_the_email_type_filter(client):
+    field = client.get('/api/search?format=json&count=exact&search_term=type:spam').get_json()
+    filtered = client.get('/api/search?format=json&count=exact&email_type=Spam').get_json()
+    assert field['total'] == filtered['total'] > 0
+    assert field['rows'] == filtered['rows']
+
+
+def _total(query, use_index):
+    return search_emails_service(query, 1, 10, 'date_sent', 'desc', '', '', '', '', '',
+                                 use_index=use_index, count_mode='exact').total
+
+
+def _word_and_stem():
+    """A frequent indexed word, and the word less its last letter when that is not a word of its own."""
+    tokens = db_session.execute(
+        select(EmailToken.token).group_by(EmailToken.token)
+        .having(func.length(EmailToken.token) >= 6)
+        .order_by(func.count().desc(), EmailToken.token)
+    ).scalars().all()
+    indexed = set(tokens)
+    word = next(token for token in tokens
+                if token[:-1] not in indexed and _total(token[:-1], use_index=False) > 0)
+    return word, word[:-1]
+
+
+def test_index_matches_whole_words(app):
+    word, stem = _word_and_stem()
+    # The body scan finds the stem inside the word; the index only finds whole words
+    assert _total(stem, use_index=False) > 0
+    assert _total(stem, use_index=True) == 0
+    assert _total(stem + '*', use_index=True) >= _total(word, use_index=True) > 0
+
+
+def test_body_scan_matches_inside_words(app):
+    # "the" is also found in "other", "then", ... by the scan, but only as itself in the index
+    assert _total('the', use_index=False) > _total('the', use_index=True)
+
+
+def _common_phrase():
+    """Two words that follow each other in several of the seeded emails."""
+    bodies = db_session.execute(select(Email.body).order_by(Email.unique_email_id).limit(20)).scalars()
+    for body in bodies:
+        tokens = tokenize(body)
+        for pair in zip(tokens, tokens[1:]):
+            if len(phrase_email_ids(db_session, pair)) >= 5:
+                return pair
+    raise AssertionError('no phrase occurs in five emails')
+
+
+def _email_ids(query):
+    pagination = search_emails_service(query, 1, 1000, 'unique_email_id', 'asc', '', '', '', '', '',
+                                       count_mode='exact')
+    return [email.unique_email_id for email in pagination.items]
+
+
+def test_common_phrase_is_matched_without_binding_its_ids(app, monkeypatch):
+    first, second = _common_phrase()
+    query = f'"{first} {second}"'
+    phrase_cache.clear()
+    expected = _email_ids(query)
+
+    candidates = len(db_session.execute(
+        select(EmailToken.email_id).where(EmailToken.token.in_({first, second}))
+        .group_by(EmailToken.email_id).having(func.count() == len({first, second}))
+    ).all())
+    assert phrase_email_ids(db_session, (first, second), limit=candidates - 1) is None
+
+    monkeypatch.setattr(Config, 'SEARCH_PHRASE_CANDIDATE_LIMIT', 2)
+    phrase_cache.clear()
+    shape, params = plan_query(db_session, parse_query(query))
+    assert shape[0] == 'phrase'
+    assert not any(name.startswith('q') and '_ids' in name for name in params)
+    assert _email_ids(query) == expected
+    phrase_cache.clear()
@@ -0,0 +1,55 @@
+"""
+A sender filter resolved to sender ids through the sender dimension finds
+the same emails as the ILIKE over every email it replaces.
+"""
+from sqlalchemy import select
+from webapp.database import db_session
+from webapp.models import Email, Sender
+from webapp.senders import matching_sender_ids, sender_cache
+from webapp.services import search_plan, search_statements
+
+
+def _sender_name():
+    return db_session.execute(select(Sender.name).order_by(Sender.name).limit(1)).scalar_one()
+
+
+def _values(name):
+    first, last = name.split(' ', 1)
+    return [
+        name,
+        name.upper(),
+        last,
+        # Across the space, inside both words
+        first[1:] + ' ' + last[:2],
+        # Under three characters, so without trigrams
+        first[:2].lower(),
+        'e',
+        'no such sender',
+    ]
+
+
+def _email_ids(shape, params):
+    rows = db_session.execute(search_statements(shape)['export'], params)
+    return [row.unique_email_id for row in rows]
+
+
+def test_sender_ids_match_ilike(app):
+    for value in _values(_sender_name()):
+        sender_cache.clear()
+        shape, params, _ = search_plan('', 'unique_email_id', 'asc', value, '', '', '', '')
+        # The same search with the sender filter forced to the ILIKE
+        expected = _email_ids(('like',) + shape[1:], params)
+        if expected:
+            assert shape[0] == 'ids', value
+            assert _email_ids(shape, params) == expected, value
+        else:
+            assert shape[0] == 'none', value
+
+
+def test_matching_sender_ids_match_ilike(app):
+    for value in _values(_sender_name()):
+        sender_cache.clear()
+        expected = db_session.execute(
+            select(Email.sender_id).where(Email.sender_name.ilike(f'%{value}%')).distinct()
+        ).scalars().all()
+        assert matching_sender_ids(db_session, value) == sorted(expected)
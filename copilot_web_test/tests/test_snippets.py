@@ -0,0 +1,55 @@
+"""
+Snippets are HTML: the body is escaped and the only markup in them is
+the <mark> around each match.
+"""
+import re
+from webapp.search_query import parse_query
+from webapp.snippets import query_matcher, make_snippet
+
+
+def _snippet(query, body, **kwargs):
+    return str(make_snippet(query_matcher(parse_query(query)), body, **kwargs))
+
+
+def _tags(html):
+    return re.findall(r'<[^>]*>', html)
+
+
+def test_body_markup_is_escaped():
+    html = _snippet('budget', '<script>alert("x")</script> the <b>budget</b> & more')
+    assert html == ('&lt;script&gt;alert(&#34;x&#34;)&lt;/script&gt; the '
+                    '&lt;b&gt;<mark>budget</mark>&lt;/b&gt; &amp; more')
+
+
+def test_markup_inside_a_phrase_match_is_escaped():
+    html = _snippet('"fish chips"', 'Friday: fish & <chips> for lunch')
+    assert '<mark>fish &amp; &lt;chips</mark>' in html
+    assert _tags(html) == ['<mark>', '</mark>']
+
+
+def test_only_matches_are_marked():
+    html = _snippet('budget OR plan*', 'The <i>budget</i> plans, budgetary planning and a <plan>.')
+    assert re.findall(r'<mark>(.*?)</mark>', html) == ['budget', 'plans', 'planning', 'plan']
+    assert set(_tags(html)) == {'<mark>', '</mark>'}
+
+
+def test_negated_terms_are_not_marked():
+    html = _snippet('budget -draft', 'A draft of the budget')
+    assert re.findall(r'<mark>(.*?)</mark>', html) == ['budget']
+
+
+def test_excerpt_without_a_match_is_escaped():
+    body = '<p>' + 'word ' * 100 + '</p>'
+    html = _snippet('missing', body, length=40)
+    assert html.startswith('&lt;p&gt;word')
+    assert html.endswith('...')
+    assert not _tags(html)
+
+
+def test_excerpt_around_a_late_match():
+    body = 'x<y ' * 100 + 'budget ' + 'a>b ' * 100
+    html = _snippet('budget', body, length=40)
+    assert html.startswith('...')
+    assert html.endswith('...')
+    assert '<mark>budget</mark>' in html
+    assert _tags(html) == ['<mark>', '</mark>']
@@ -1,9 +1,24 @@
-from flask import Flask
+import os
+import time
+import logging
+
+# Measured from the first import of the package, so it includes loading Flask and SQLAlchemy
+_import_started = time.perf_counter()
+
+from flask import Flask, current_app
 from flask_login import LoginManager
-from .database import db_session, init_db
+from .database import db_session
 from .models import User
+from .activity_writer import activity_writer
+from .profiling import profiler
+from .result_cache import result_cache
+from .auth.identity import load_identity
+from .auth.throttle import login_throttle
+from . import metrics
 from config import Config
 
+logger = logging.getLogger(__name__)
+
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
 
@@ -13,6 +28,10 @@ def create_app(config_class=Config):
 
     # Initialize extensions
     login_manager.init_app(app)
+    activity_writer.init_app(app)
+    profiler.init_app(app)
+    result_cache.init_app(app)
+    login_throttle.init_app(app)
 
     # Register blueprints
     from .auth import auth_bp
@@ -30,9 +49,13 @@ def create_app(config_class=Config):
 
     @login_manager.user_loader
     def load_user(user_id):
+        if current_app.config['USER_CACHE_ENABLED']:
+            return load_identity(int(user_id))
         return db_session.get(User, int(user_id))
 
-    with app.app_context():
-        init_db()
+    # The schema is managed by `python -m webapp.migrate`, not at startup
+    cold_start_ms = (time.perf_counter() - _import_started) * 1000
+    metrics.set_gauge('app.cold_start_ms', round(cold_start_ms, 1))
+    logger.info("App created in %.0f ms (pid %d)", cold_start_ms, os.getpid())
 
     return app
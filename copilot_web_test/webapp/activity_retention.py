@@ -0,0 +1,193 @@
+"""
+Activity log retention.
+
+Raw user_activity rows are only kept for ACTIVITY_RETENTION_DAYS. Before
+they go, each complete day is rolled up into activity_rollups, one row per
+(day, user, activity) with its count, so the admin summary can still cover
+older ranges from a table that grows by a few hundred rows a day instead of
+one row per request. Days are rolled up in order and every day commits
+with its ActivityRollupLog row, so a stopped run resumes after the last
+day it finished. Days are UTC, like the timestamps; run the job a while
+after midnight so the async activity writer has flushed the day before:
+
+    python -m webapp.activity_retention
+
+With ACTIVITY_PARTITIONED set, user_activity is created on Oracle with
+daily interval partitions and expired days are dropped a partition at a
+time instead of being deleted row by row. ``--ensure-schema`` adds the
+rollup tables and the (user_id, timestamp) index to an existing database;
+partitioning an existing table needs an online redefinition by the DBA.
+"""
+import time
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, insert, func, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateTable
+from .models import UserActivity, ActivityRollup, ActivityRollupLog
+from .facets import day_start
+
+# Every interval partitioned table needs one range partition to start from
+INITIAL_PARTITION_BOUND = '2000-01-01'
+
+
+@compiles(CreateTable, 'oracle')
+def _create_interval_partitioned_table(create, compiler, **kw):
+    ddl = compiler.visit_create_table(create, **kw)
+    column = create.element.info.get('interval_partition')
+    if column:
+        ddl = (ddl.rstrip() +
+               f"\nPARTITION BY RANGE ({column}) INTERVAL (NUMTODSINTERVAL(1, 'DAY'))"
+               f"\n(PARTITION p_initial VALUES LESS THAN (DATE '{INITIAL_PARTITION_BOUND}'))\n\n")
+    return ddl
+
+
+def _day_start(day):
+    return datetime(day.year, day.month, day.day)
+
+
+def rolled_up_through(session):
+    """The last day rolled up, or None."""
+    return session.execute(select(func.max(ActivityRollupLog.day))).scalar()
+
+
+def next_day_with_activity(session, after, before):
+    """The first day with raw activity on or after `after` (a date or None) and before `before`."""
+    stmt = select(func.min(UserActivity.timestamp)).where(UserActivity.timestamp < _day_start(before))
+    if after is not None:
+        stmt = stmt.where(UserActivity.timestamp >= _day_start(after))
+    first = session.execute(stmt).scalar()
+    return first.date() if first is not None else None
+
+
+def daily_counts(session, day, user_id=None):
+    """(user_id, activity, count) rows of the raw activity on one day."""
+    start = _day_start(day)
+    stmt = (
+        select(UserActivity.user_id, UserActivity.activity, func.count())
+        .where(UserActivity.timestamp >= start, UserActivity.timestamp < start + timedelta(days=1))
+        .group_by(UserActivity.user_id, UserActivity.activity)
+    )
+    if user_id is not None:
+        stmt = stmt.where(UserActivity.user_id == user_id)
+    return session.execute(stmt).all()
+
+
+def range_counts(session, start_day, end_day, user_id=None):
+    """(day, activity, count) rows of the raw activity from start_day through end_day, in one grouped query."""
+    day_column = day_start(UserActivity.timestamp)
+    stmt = (
+        select(day_column, UserActivity.activity, func.count())
+        .where(UserActivity.timestamp >= _day_start(start_day),
+               UserActivity.timestamp < _day_start(end_day + timedelta(days=1)))
+        .group_by(day_column, UserActivity.activity)
+    )
+    if user_id is not None:
+        stmt = stmt.where(UserActivity.user_id == user_id)
+    # Oracle hands TRUNC() back as a datetime
+    return [(day.date() if isinstance(day, datetime) else day, activity, count)
+            for day, activity, count in session.execute(stmt)]
+
+
+def rollup_activity(session, today=None):
+    """
+    Rolls up every complete day before today that is not rolled up yet,
+    skipping days without activity. Returns (days, rows, rollups).
+    """
+    today = today or datetime.utcnow().date()
+    last = rolled_up_through(session)
+    after = last + timedelta(days=1) if last else None
+
+    days = rows_total = rollups_total = 0
+    while True:
+        day = next_day_with_activity(session, after, today)
+        if day is None:
+            break
+        counts = daily_counts(session, day)
+        if counts:
+            session.execute(insert(ActivityRollup), [
+                {'day': day, 'user_id': user_id, 'activity': activity, 'count': count}
+                for user_id, activity, count in counts
+            ])
+        rows = sum(count for _, _, count in counts)
+        session.add(ActivityRollupLog(day=day, rows_rolled_up=rows, rollups_created=len(counts)))
+        session.commit()
+
+        days += 1
+        rows_total += rows
+        rollups_total += len(counts)
+        after = day + timedelta(days=1)
+    return days, rows_total, rollups_total
+
+
+def _drop_partitions(session, cutoff):
+    dropped = 0
+    day = next_day_with_activity(session, None, cutoff)
+    while day is not None:
+        session.execute(text(
+            f"ALTER TABLE {UserActivity.__tablename__} DROP PARTITION FOR (DATE '{day.isoformat()}') UPDATE GLOBAL INDEXES"
+        ))
+        dropped += 1
+        day = next_day_with_activity(session, day + timedelta(days=1), cutoff)
+    return dropped
+
+
+def purge_activity(session, retain_days, chunk_size=1000, partitioned=False, today=None):
+    """
+    Deletes raw activity older than retain_days, but never a day that has
+    not been rolled up. Returns the number of rows deleted, or of
+    partitions dropped when partitioned.
+    """
+    today = today or datetime.utcnow().date()
+    last = rolled_up_through(session)
+    if last is None:
+        return 0
+    cutoff = min(today - timedelta(days=retain_days), last + timedelta(days=1))
+    if partitioned:
+        return _drop_partitions(session, cutoff)
+
+    deleted = 0
+    while True:
+        ids = session.execute(
+            select(UserActivity.id).where(UserActivity.timestamp < _day_start(cutoff)).limit(chunk_size)
+        ).scalars().all()
+        if not ids:
+            break
+        session.execute(delete(UserActivity).where(UserActivity.id.in_(ids)))
+        session.commit()
+        deleted += len(ids)
+    return deleted
+
+
+def ensure_schema(engine):
+    """Creates the rollup tables and the (user_id, timestamp) index on an existing database."""
+    ActivityRollup.__table__.create(engine, checkfirst=True)
+    ActivityRollupLog.__table__.create(engine, checkfirst=True)
+    for index in UserActivity.__table__.indexes:
+        index.create(engine, checkfirst=True)
+
+
+if __name__ == '__main__':
+    from .database import db_session, get_engine
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Roll up and age out raw user activity.')
+    parser.add_argument('--ensure-schema', action='store_true', help='Create the rollup tables and index first.')
+    parser.add_argument('--rollup-only', action='store_true', help='Roll up complete days without deleting anything.')
+    parser.add_argument('--retain-days', type=int, default=Config.ACTIVITY_RETENTION_DAYS,
+                        help='Days of raw activity to keep.')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Rows deleted per transaction.')
+    args = parser.parse_args()
+
+    if args.ensure_schema:
+        ensure_schema(get_engine())
+
+    started = time.perf_counter()
+    days, rows, rollups = rollup_activity(db_session)
+    print(f"Rolled up {rows} rows from {days} days into {rollups} rollups.")
+    if not args.rollup_only:
+        partitioned = Config.ACTIVITY_PARTITIONED and get_engine().dialect.name == 'oracle'
+        purged = purge_activity(db_session, args.retain_days, args.chunk_size, partitioned)
+        unit = 'partitions' if partitioned else 'rows'
+        print(f"Purged {purged} {unit} older than {args.retain_days} days.")
+    print(f"Done in {time.perf_counter() - started:.1f}s.")
@@ -0,0 +1,167 @@
+"""
+Background writer for user activity rows.
+
+Requests hand their activity rows to an in-process queue instead of
+committing them inline; a daemon thread drains the queue and inserts the
+rows in batches with a single executemany, every ``batch_size`` rows or
+``flush_interval`` seconds, whichever comes first.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from sqlalchemy import insert
+from . import metrics
+from .database import get_engine
+from .models import UserActivity
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ActivityWriter:
+    def __init__(self, batch_size=100, flush_interval=0.5, max_queue=10000, policy='drop', block_timeout=0.05):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.configure(app.config)
+        atexit.register(self.stop)
+        try:
+            import uwsgi
+        except ImportError:
+            pass
+        else:
+            # Drain the queue when uWSGI recycles or stops this worker
+            previous_atexit = getattr(uwsgi, 'atexit', None)
+
+            def flush_on_exit():
+                self.stop()
+                if previous_atexit:
+                    previous_atexit()
+            uwsgi.atexit = flush_on_exit
+
+    def configure(self, config):
+        """Sets the writer up from a config mapping (the Flask config, or Config.__dict__ outside Flask)."""
+        self.batch_size = config['ACTIVITY_BATCH_SIZE']
+        self.flush_interval = config['ACTIVITY_FLUSH_INTERVAL_MS'] / 1000
+        self.max_queue = config['ACTIVITY_QUEUE_SIZE']
+        self.policy = config['ACTIVITY_QUEUE_POLICY']
+        self.block_timeout = config['ACTIVITY_BLOCK_TIMEOUT_MS'] / 1000
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Queues and threads do not survive a fork; each worker gets its own
+                self._queue = queue.Queue(maxsize=self.max_queue)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='activity-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, row):
+        """
+        Queues one activity row (a dict of UserActivity columns). Returns
+        False if the row was dropped because the queue is full.
+        """
+        self._ensure_started()
+        try:
+            if self.policy == 'block':
+                self._queue.put(row, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(row)
+        except queue.Full:
+            metrics.incr('activity_writer.dropped')
+            return False
+        metrics.set_gauge('activity_writer.queue_depth', self._queue.qsize())
+        return True
+
+    def _run(self):
+        work_queue = self._queue
+        while True:
+            item = work_queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = work_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+            metrics.set_gauge('activity_writer.queue_depth', work_queue.qsize())
+            if stopping:
+                self._drain(work_queue)
+                return
+
+    def _drain(self, work_queue):
+        batch = []
+        while True:
+            try:
+                item = work_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+
+    def _flush(self, batch):
+        rows = []
+        for row in batch:
+            row = dict(row)
+            if row.get('details') is not None:
+                row['details'] = json.dumps(row['details'], separators=(',', ':'))
+            rows.append(row)
+
+        started = time.perf_counter()
+        try:
+            with get_engine().begin() as connection:
+                connection.execute(insert(UserActivity.__table__), rows)
+        except Exception:
+            logger.exception("Failed to write %d activity rows", len(rows))
+            metrics.incr('activity_writer.failed', len(rows))
+            return
+        metrics.record_timing('activity_writer.flush', time.perf_counter() - started)
+        metrics.incr('activity_writer.written', len(rows))
+
+    def stop(self, timeout=5):
+        """Flushes everything still queued and stops the writer thread."""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("Activity queue still full at shutdown; unflushed rows are lost")
+            return
+        thread.join(timeout)
+
+
+activity_writer = ActivityWriter()
@@ -1,10 +1,42 @@
-from flask import request, jsonify, render_template, g
+from flask import request, jsonify, render_template, g, current_app
 from flask_login import login_required, current_user
 from . import api_bp
 from ..models import User, Email, Comment
 from ..utils import log_activity
-from ..services import search_emails_service, get_activity_logs_service
+from ..instrumentation import query_budget
+from ..services import (search_emails_service, get_activity_logs_service, search_plan, search_statements,
+                        activity_plan, activity_statements, get_activity_summary,
+                        get_search_facets, get_comment_page, get_new_comments,
+                        SEARCH_EXPORT_COLUMNS, ACTIVITY_EXPORT_COLUMNS)
+from ..export import export_response
+from ..cache import TTLCache
+from ..counters import increment_comment_count
+from ..senders import suggest_senders
 from .. import db_session
+from config import Config
+from datetime import datetime, timedelta
+
+# Rendered pagination fragments for JSON responses. They depend only on the
+# page arithmetic; the keyset cursor travels separately as next_cursor.
+pagination_cache = TTLCache(maxsize=Config.PAGINATION_CACHE_SIZE, ttl=Config.PAGINATION_CACHE_TTL)
+
+SEARCH_COLUMNS = ['unique_email_id', 'title', 'sender_name', 'date_sent', 'comment_count', 'snippet']
+ACTIVITY_COLUMNS = ['username', 'timestamp', 'activity', 'details']
+
+def _pagination_fragment(pagination, endpoint, args):
+    """Renders pagination.html without a cursor, reusing a cached copy when enabled."""
+    if not current_app.config['PAGINATION_CACHE_ENABLED']:
+        return render_template('pagination.html', pagination=pagination, endpoint=endpoint, args=args, with_cursor=False)
+
+    key = (endpoint, pagination.total, pagination.page, pagination.per_page, pagination.has_next)
+    html = pagination_cache.get(key)
+    if html is None:
+        html = render_template('pagination.html', pagination=pagination, endpoint=endpoint, args=args, with_cursor=False)
+        pagination_cache.set(key, html)
+    return html
+
+def _format_datetime(value, fmt):
+    return value.strftime(fmt) if value else None
 
 @api_bp.route('/search')
 @login_required
@@ -24,18 +56,85 @@ def api_search():
     date_filter = args.get('date_filter', '')
     has_references = args.get('has_references') == 'true'
     has_comments = args.get('has_comments') == 'true'
+    cursor = args.get('cursor', '')
+    count_mode = args.get('count', 'cached')
 
-    pagination = search_emails_service(query, page, per_page, sort_by, sort_order, sender, email_type, start_date, end_date, date_filter, has_references, has_comments)
+    pagination = search_emails_service(query, page, per_page, sort_by, sort_order, sender, email_type, start_date, end_date, date_filter, has_references, has_comments,
+                                       use_index=current_app.config['SEARCH_USE_INDEX'], cursor=cursor, count_mode=count_mode,
+                                       snippets=current_app.config['SEARCH_SNIPPETS_ENABLED'])
     
     emails = pagination.items
 
+    if args.get('format') == 'json':
+        return jsonify({
+            'columns': SEARCH_COLUMNS,
+            'rows': [
+                [email.unique_email_id, email.title, email.sender_name, _format_datetime(email.date_sent, '%Y-%m-%d %H:%M'),
+                 email.comment_count, pagination.snippets.get(email.unique_email_id)]
+                for email in emails
+            ],
+            'pagination_html': _pagination_fragment(pagination, 'api.api_search', args),
+            'total': pagination.total,
+            'next_cursor': pagination.next_cursor
+        })
+
     return jsonify({
-        'results_html': render_template('search_results.html', emails=emails, sort_by=sort_by, sort_order=sort_order),
-        'pagination_html': render_template('pagination.html', pagination=pagination, endpoint='api.api_search', args=args)
+        'results_html': render_template('search_results.html', emails=emails, snippets=pagination.snippets,
+                                        sort_by=sort_by, sort_order=sort_order),
+        'pagination_html': render_template('pagination.html', pagination=pagination, endpoint='api.api_search', args=args),
+        'total': pagination.total,
+        'next_cursor': pagination.next_cursor
     })
 
+@api_bp.route('/search/facets')
+@login_required
+# The activity row and the facet query, plus for query text the planner's token
+# statistics (frequencies, email total) and a phrase's candidates and postings
+@query_budget(6)
+def api_search_facets():
+    """Email counts per sender, email type and month for the search filters, to show next to the results."""
+    args = request.args
+    log_activity('api_search_facets', details={k: v for k, v in args.items()})
+
+    facets = get_search_facets(args.get('search_term', ''), args.get('sender', ''), args.get('email_type', ''),
+                               args.get('start_date', ''), args.get('end_date', ''), args.get('date_filter', ''),
+                               has_references=args.get('has_references') == 'true',
+                               has_comments=args.get('has_comments') == 'true',
+                               use_index=current_app.config['SEARCH_USE_INDEX'],
+                               limit=current_app.config['SEARCH_FACET_LIMIT'])
+    return jsonify(facets)
+
+@api_bp.route('/senders/suggest')
+@login_required
+@query_budget(1)
+def api_sender_suggest():
+    """Senders whose name or address contains q, for the sender filter's autocomplete."""
+    value = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', current_app.config['SENDER_SUGGEST_LIMIT'], type=int), 50)
+    if not value or limit < 1:
+        return jsonify({'senders': []})
+    return jsonify({'senders': suggest_senders(db_session, value, limit)})
+
+@api_bp.route('/search/export')
+@login_required
+def api_search_export():
+    """Streams every email matching the search filters as CSV or NDJSON (format=csv|ndjson, gzip=true)."""
+    args = request.args
+    log_activity('api_search_export', details={k: v for k, v in args.items()})
+
+    shape, params, _ = search_plan(args.get('search_term', ''), args.get('sort_by', 'date_sent'),
+                                   args.get('sort_order', 'desc'), args.get('sender', ''), args.get('email_type', ''),
+                                   args.get('start_date', ''), args.get('end_date', ''), args.get('date_filter', ''),
+                                   has_references=args.get('has_references') == 'true',
+                                   has_comments=args.get('has_comments') == 'true',
+                                   use_index=current_app.config['SEARCH_USE_INDEX'])
+
+    return export_response(search_statements(shape)['export'], params, SEARCH_EXPORT_COLUMNS, 'emails',
+                           fmt=args.get('format', 'csv'), compress=args.get('gzip') == 'true')
+
 @api_bp.route('/activity')
 @login_required
+@query_budget(3)
 def api_activity():
     if current_user.username != 'admin':
         log_activity('api_activity_denied', details={'reason': 'Non-admin user tried to access'})
@@ -49,14 +148,123 @@ def api_activity():
     selected_user_id = args.get('user_id', '')
     sort_by = args.get('sort_by', 'timestamp')
     sort_order = args.get('sort_order', 'desc')
+    cursor = args.get('cursor', '')
+    count_mode = args.get('count', 'cached')
 
-    pagination = get_activity_logs_service(page, per_page, sort_by, sort_order, selected_user_id)
+    pagination = get_activity_logs_service(page, per_page, sort_by, sort_order, selected_user_id,
+                                           cursor=cursor, count_mode=count_mode)
     
     activities = pagination.items
+
+    if args.get('format') == 'json':
+        return jsonify({
+            'columns': ACTIVITY_COLUMNS,
+            'rows': [
+                [activity.user.username if activity.user else None,
+                 _format_datetime(activity.timestamp, '%Y-%m-%d %H:%M:%S'),
+                 activity.activity,
+                 activity.details]
+                for activity in activities
+            ],
+            'pagination_html': _pagination_fragment(pagination, 'api.api_activity', args),
+            'total': pagination.total,
+            'next_cursor': pagination.next_cursor
+        })
     
     return jsonify({
         'table_html': render_template('activity_table.html', activities=activities, sort_by=sort_by, sort_order=sort_order),
-        'pagination_html': render_template('pagination.html', pagination=pagination, endpoint='api.api_activity', args=args)
+        'pagination_html': render_template('pagination.html', pagination=pagination, endpoint='api.api_activity', args=args),
+        'total': pagination.total,
+        'next_cursor': pagination.next_cursor
+    })
+
+@api_bp.route('/activity/summary')
+@login_required
+@query_budget(5)
+def api_activity_summary():
+    """Daily activity counts (start_date, end_date as YYYY-MM-DD, default the last 30 days)."""
+    if current_user.username != 'admin':
+        log_activity('api_activity_summary_denied', details={'reason': 'Non-admin user tried to access'})
+        return jsonify({'error': 'Permission denied'}), 403
+
+    args = request.args
+    log_activity('api_activity_summary', details={k: v for k, v in args.items()})
+
+    today = datetime.utcnow().date()
+    try:
+        end_date = datetime.strptime(args['end_date'], '%Y-%m-%d').date() if args.get('end_date') else today
+        start_date = (datetime.strptime(args['start_date'], '%Y-%m-%d').date() if args.get('start_date')
+                      else end_date - timedelta(days=29))
+        user_id = int(args['user_id']) if args.get('user_id') else None
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD and user_id a number'}), 400
+    if start_date > end_date:
+        return jsonify({'error': 'start_date is after end_date'}), 400
+
+    summary = get_activity_summary(start_date, end_date, user_id)
+    summary.update({'start_date': start_date.isoformat(), 'end_date': end_date.isoformat()})
+    return jsonify(summary)
+
+@api_bp.route('/activity/export')
+@login_required
+def api_activity_export():
+    """Streams the activity log as CSV or NDJSON (format=csv|ndjson, gzip=true)."""
+    if current_user.username != 'admin':
+        log_activity('api_activity_export_denied', details={'reason': 'Non-admin user tried to access'})
+        return jsonify({'error': 'Permission denied'}), 403
+
+    args = request.args
+    log_activity('api_activity_export', details={k: v for k, v in args.items()})
+
+    shape, params, _ = activity_plan(args.get('sort_by', 'timestamp'), args.get('sort_order', 'desc'),
+                                     args.get('user_id', ''))
+
+    return export_response(activity_statements(shape)['export'], params, ACTIVITY_EXPORT_COLUMNS, 'activity',
+                           fmt=args.get('format', 'csv'), compress=args.get('gzip') == 'true')
+
+def _comment_json(comment_id, parent_id, depth, username, timestamp, body):
+    return {
+        'id': comment_id,
+        'parent_id': parent_id,
+        'depth': depth,
+        'username': username,
+        'timestamp': _format_datetime(timestamp, '%Y-%m-%d %H:%M'),
+        'body': body,
+    }
+
+@api_bp.route('/emails/<string:email_id>/comments')
+@login_required
+@query_budget(1)
+def email_comments(email_id):
+    """
+    The comment thread of an email as a flat, depth-first list with the
+    depth of each comment. Without `since`, one page of top-level comments
+    with all their replies, and next_cursor for the next page; with
+    `since` (a comment id or an ISO timestamp), only the comments posted
+    after it. latest_id is what to poll with next: on a page, the highest
+    comment id on the email, including replies on pages not loaded yet.
+    Polls are not logged as activity; opening the email already is.
+    """
+    args = request.args
+    since = args.get('since', '')
+    if since:
+        rows = get_new_comments(email_id, since, current_app.config['COMMENT_POLL_LIMIT'])
+        if rows is None:
+            return jsonify({'error': 'since must be a comment id or an ISO timestamp'}), 400
+        next_cursor = None
+        ids = [row.id for row in rows]
+        if since.isdigit():
+            ids.append(int(since))
+        latest_id = max(ids) if ids else None
+    else:
+        per_page = args.get('per_page', current_app.config['COMMENT_PAGE_SIZE'], type=int)
+        rows, next_cursor, latest_id = get_comment_page(email_id, max(per_page, 1), args.get('cursor', ''))
+
+    return jsonify({
+        'comments': [_comment_json(row.id, row.parent_id, row.depth, row.username, row.timestamp, row.body)
+                     for row in rows],
+        'next_cursor': next_cursor,
+        'latest_id': latest_id
     })
 
 @api_bp.route('/comments/add', methods=['POST'])
@@ -80,15 +288,18 @@ def add_comment():
         parent_id=int(parent_id) if parent_id and parent_id != 'null' else None
     )
     db_session.add(new_comment)
+    db_session.flush()
+    # Taken before the commit expires the row; the author is the current
+    # user. A reply's depth is left to the page, which has its parent.
+    comment = _comment_json(new_comment.id, new_comment.parent_id, None if new_comment.parent_id else 0,
+                            current_user.username, new_comment.timestamp, new_comment.body)
+    increment_comment_count(db_session, email.unique_email_id)
     db_session.commit()
 
     log_activity(f"Posted a {'reply' if parent_id else 'comment'} on email: {email.title}")
 
-    # Render the single new comment using the macro
-    html = render_template('_comments.html', comment=new_comment)
-    
     return jsonify({
         'success': True,
-        'html': html,
+        'comment': comment,
         'parentId': new_comment.parent_id
     })
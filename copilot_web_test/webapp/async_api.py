@@ -0,0 +1,251 @@
+"""
+Async API tier.
+
+Serves the read-heavy API endpoints (/api/search, /api/activity and
+/api/activity/summary) from an ASGI app, so a slow search waits on the
+database without holding a whole uWSGI process. Many requests can wait
+on one event loop, limited only by the ASYNC_DB_POOL_SIZE connections of
+the asyncio engine. Run it next to the uWSGI app and have the proxy send
+these paths here:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 2
+
+The app shares webapp.models and webapp.services with the Flask views.
+Each request runs the same service function through
+AsyncSession.run_sync, where every query it issues is awaited on the
+event loop. Requests are authenticated with the Flask session cookie, and
+responses match the format=json responses of the Flask views. Activity
+rows always go through the background activity writer, so nothing blocks
+the loop.
+"""
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from flask.sessions import SecureCookieSessionInterface
+from jinja2 import Environment, FileSystemLoader
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from .database import get_async_engine
+from .models import User
+from .services import search_emails_service, get_activity_logs_service, get_activity_summary
+from .auth.identity import identity_cache, CachedUser
+from .activity_writer import activity_writer
+from .result_cache import result_cache
+from .api.routes import SEARCH_COLUMNS, ACTIVITY_COLUMNS, pagination_cache
+from config import Config
+
+# Flask's default, as the Flask app does not override it
+SESSION_LIFETIME = getattr(Config, 'PERMANENT_SESSION_LIFETIME', timedelta(days=31))
+
+templates = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), 'templates')),
+                        autoescape=True)
+
+
+def _session_serializer(secret_key):
+    """The serializer Flask signs its session cookie with."""
+    interface = SecureCookieSessionInterface()
+    return URLSafeTimedSerializer(secret_key, salt=interface.salt, serializer=interface.serializer,
+                                  signer_kwargs={'key_derivation': interface.key_derivation,
+                                                 'digest_method': interface.digest_method})
+
+
+def _flask_session(request):
+    cookie = request.cookies.get('session')
+    if not cookie:
+        return {}
+    try:
+        return request.app.state.session_serializer.loads(cookie, max_age=int(SESSION_LIFETIME.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+async def _load_identity(session, user_id):
+    """The async counterpart of auth.identity.load_identity, sharing its cache."""
+    identity = identity_cache.get(user_id)
+    if identity is not None:
+        return identity
+    row = (await session.execute(select(User.id, User.username).where(User.id == user_id))).first()
+    if row is None:
+        return None
+    identity = CachedUser(row.id, row.username)
+    identity_cache.set(user_id, identity)
+    return identity
+
+
+async def _current_user(request, session):
+    """Returns (user, flask_session); user is None unless the request carries a valid login."""
+    flask_session = _flask_session(request)
+    try:
+        user_id = int(flask_session.get('_user_id'))
+    except (TypeError, ValueError):
+        return None, flask_session
+    return await _load_identity(session, user_id), flask_session
+
+
+def _log_activity(request, user, flask_session, activity_type, endpoint, details):
+    """Queues an activity row the way utils.log_activity does."""
+    if 'user_token' not in flask_session:
+        return
+    details['endpoint'] = endpoint
+    details['path'] = request.url.path
+    referrer = request.headers.get('referer')
+    if referrer:
+        details['referrer'] = referrer
+    activity_writer.submit({
+        'user_id': user.id,
+        'token': flask_session['user_token'],
+        'activity': activity_type,
+        'details': details,
+        'timestamp': datetime.utcnow(),
+    })
+
+
+def _int_arg(args, name, default):
+    try:
+        return int(args.get(name, default))
+    except ValueError:
+        return default
+
+
+def _pagination_fragment(pagination, endpoint):
+    key = (endpoint, pagination.total, pagination.page, pagination.per_page, pagination.has_next)
+    html = pagination_cache.get(key)
+    if html is None:
+        html = templates.get_template('pagination.html').render(pagination=pagination, with_cursor=False)
+        pagination_cache.set(key, html)
+    return html
+
+
+def _format_datetime(value, fmt):
+    return value.strftime(fmt) if value else None
+
+
+def _login_required():
+    return JSONResponse({'error': 'Login required'}, status_code=401)
+
+
+def _permission_denied():
+    return JSONResponse({'error': 'Permission denied'}, status_code=403)
+
+
+async def api_search(request):
+    args = request.query_params
+    async with AsyncSession(get_async_engine()) as session:
+        user, flask_session = await _current_user(request, session)
+        if user is None:
+            return _login_required()
+        _log_activity(request, user, flask_session, 'api_search', 'api.api_search', dict(args))
+
+        page = _int_arg(args, 'page', 1)
+        per_page = _int_arg(args, 'per_page', 50)
+        pagination = await session.run_sync(lambda sync_session: search_emails_service(
+            args.get('search_term', ''), page, per_page, args.get('sort_by', 'date_sent'),
+            args.get('sort_order', 'desc'), args.get('sender', ''), args.get('email_type', ''),
+            args.get('start_date', ''), args.get('end_date', ''), args.get('date_filter', ''),
+            args.get('has_references') == 'true', args.get('has_comments') == 'true',
+            use_index=request.app.state.config['SEARCH_USE_INDEX'], cursor=args.get('cursor', ''),
+            count_mode=args.get('count', 'cached'), session=sync_session,
+            snippets=request.app.state.config['SEARCH_SNIPPETS_ENABLED']
+        ))
+
+    return JSONResponse({
+        'columns': SEARCH_COLUMNS,
+        'rows': [
+            [email.unique_email_id, email.title, email.sender_name, _format_datetime(email.date_sent, '%Y-%m-%d %H:%M'),
+             email.comment_count, pagination.snippets.get(email.unique_email_id)]
+            for email in pagination.items
+        ],
+        'pagination_html': _pagination_fragment(pagination, 'api.api_search'),
+        'total': pagination.total,
+        'next_cursor': pagination.next_cursor
+    })
+
+
+async def api_activity(request):
+    args = request.query_params
+    async with AsyncSession(get_async_engine()) as session:
+        user, flask_session = await _current_user(request, session)
+        if user is None:
+            return _login_required()
+        if user.username != 'admin':
+            _log_activity(request, user, flask_session, 'api_activity_denied', 'api.api_activity',
+                          {'reason': 'Non-admin user tried to access'})
+            return _permission_denied()
+        _log_activity(request, user, flask_session, 'api_activity_view', 'api.api_activity', dict(args))
+
+        page = _int_arg(args, 'page', 1)
+        per_page = _int_arg(args, 'per_page', 25)
+        pagination = await session.run_sync(lambda sync_session: get_activity_logs_service(
+            page, per_page, args.get('sort_by', 'timestamp'), args.get('sort_order', 'desc'), args.get('user_id', ''),
+            cursor=args.get('cursor', ''), count_mode=args.get('count', 'cached'), session=sync_session
+        ))
+
+    return JSONResponse({
+        'columns': ACTIVITY_COLUMNS,
+        'rows': [
+            [activity.user.username if activity.user else None,
+             _format_datetime(activity.timestamp, '%Y-%m-%d %H:%M:%S'),
+             activity.activity,
+             activity.details]
+            for activity in pagination.items
+        ],
+        'pagination_html': _pagination_fragment(pagination, 'api.api_activity'),
+        'total': pagination.total,
+        'next_cursor': pagination.next_cursor
+    })
+
+
+async def api_activity_summary(request):
+    args = request.query_params
+    async with AsyncSession(get_async_engine()) as session:
+        user, flask_session = await _current_user(request, session)
+        if user is None:
+            return _login_required()
+        if user.username != 'admin':
+            _log_activity(request, user, flask_session, 'api_activity_summary_denied', 'api.api_activity_summary',
+                          {'reason': 'Non-admin user tried to access'})
+            return _permission_denied()
+        _log_activity(request, user, flask_session, 'api_activity_summary', 'api.api_activity_summary', dict(args))
+
+        today = datetime.utcnow().date()
+        try:
+            end_date = datetime.strptime(args['end_date'], '%Y-%m-%d').date() if args.get('end_date') else today
+            start_date = (datetime.strptime(args['start_date'], '%Y-%m-%d').date() if args.get('start_date')
+                          else end_date - timedelta(days=29))
+            user_id = int(args['user_id']) if args.get('user_id') else None
+        except ValueError:
+            return JSONResponse({'error': 'Dates must be YYYY-MM-DD and user_id a number'}, status_code=400)
+        if start_date > end_date:
+            return JSONResponse({'error': 'start_date is after end_date'}, status_code=400)
+
+        summary = await session.run_sync(
+            lambda sync_session: get_activity_summary(start_date, end_date, user_id, session=sync_session)
+        )
+
+    summary.update({'start_date': start_date.isoformat(), 'end_date': end_date.isoformat()})
+    return JSONResponse(summary)
+
+
+def create_asgi_app(config_class=Config):
+    config = {name: getattr(config_class, name) for name in dir(config_class) if name.isupper()}
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        activity_writer.stop()
+        await get_async_engine().dispose()
+
+    app = Starlette(routes=[
+        Route('/api/search', api_search),
+        Route('/api/activity', api_activity),
+        Route('/api/activity/summary', api_activity_summary),
+    ], lifespan=lifespan)
+    app.state.config = config
+    app.state.session_serializer = _session_serializer(config['SECRET_KEY'])
+    activity_writer.configure(config)
+    result_cache.configure(config)
+    return app
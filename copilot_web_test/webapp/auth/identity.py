@@ -0,0 +1,50 @@
+"""
+Cached user identities for the Flask-Login user loader.
+
+Authenticated requests only need the id and username of the current user,
+so the loader keeps those in a per-worker cache instead of loading the
+User row on every request. Entries expire after USER_CACHE_TTL seconds
+and are dropped as soon as this worker updates or deletes the user.
+"""
+from flask_login import UserMixin
+from sqlalchemy import select, event
+from ..database import db_session
+from ..models import User
+from ..cache import TTLCache
+from config import Config
+
+identity_cache = TTLCache(maxsize=Config.USER_CACHE_SIZE, ttl=Config.USER_CACHE_TTL)
+
+
+class CachedUser(UserMixin):
+    """The fields of a User that views and templates read from current_user."""
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+    def __repr__(self):
+        return f'<CachedUser {self.username}>'
+
+
+def load_identity(user_id):
+    """Returns the CachedUser for user_id, or None if the user does not exist."""
+    identity = identity_cache.get(user_id)
+    if identity is not None:
+        return identity
+
+    row = db_session.execute(select(User.id, User.username).where(User.id == user_id)).first()
+    if row is None:
+        return None
+    identity = CachedUser(row.id, row.username)
+    identity_cache.set(user_id, identity)
+    return identity
+
+
+def invalidate_identity(user_id):
+    identity_cache.pop(user_id)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate_identity(target.id)
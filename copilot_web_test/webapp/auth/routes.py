@@ -5,12 +5,17 @@ from . import auth_bp
 from ..database import db_session
 from ..models import User, UserActivity
 from ..utils import log_activity
+from .throttle import login_throttle
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        if not login_throttle.allow(username, request.remote_addr):
+            # Refused before the password is hashed
+            flash('Too many failed login attempts. Please try again later.')
+            return render_template('login.html'), 429
         user = User.query.filter_by(username=username).first()
         if user and user.check_password(password):
             login_user(user)
@@ -18,6 +23,7 @@ def login():
             log_activity('login') # Use the new logger
             return redirect(url_for('main.index'))
         else:
+            login_throttle.failed(username, request.remote_addr)
             log_activity('login_failed', details={'username': username}) # Log failed attempt
             flash('Invalid username or password')
     return render_template('login.html')
@@ -0,0 +1,85 @@
+"""
+Token-bucket throttling for login attempts.
+
+Every failed login takes a token from the bucket of the username and the
+bucket of the client address. Buckets refill at a steady rate, and a login
+is refused before the password is hashed while either bucket is empty, so
+a flood of bad passwords costs a worker almost nothing.
+"""
+import time
+import threading
+from ..cache import TTLCache
+from .. import metrics
+
+
+class TokenBucket:
+    """``capacity`` tokens, refilled at ``rate`` tokens per second."""
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self):
+        self._refill()
+        return self.tokens >= 1
+
+    def take(self):
+        self._refill()
+        self.tokens = max(0.0, self.tokens - 1)
+
+
+class LoginThrottle:
+    def __init__(self, user_capacity=5, user_rate=5 / 60, ip_capacity=20, ip_rate=20 / 60, max_buckets=10000):
+        self.enabled = True
+        self.limits = {'user': (user_capacity, user_rate), 'ip': (ip_capacity, ip_rate)}
+        self.max_buckets = max_buckets
+        self._buckets = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config['LOGIN_THROTTLE_ENABLED']
+        self.limits = {
+            'user': (app.config['LOGIN_USER_BURST'], app.config['LOGIN_USER_PER_MINUTE'] / 60),
+            'ip': (app.config['LOGIN_IP_BURST'], app.config['LOGIN_IP_PER_MINUTE'] / 60),
+        }
+        self._buckets = None
+
+    def _bucket(self, kind, key):
+        if self._buckets is None:
+            # A bucket left alone is full again after capacity / rate seconds,
+            # so it can be forgotten by then
+            ttl = max(capacity / rate for capacity, rate in self.limits.values())
+            self._buckets = TTLCache(maxsize=self.max_buckets, ttl=ttl)
+        bucket = self._buckets.get((kind, key))
+        if bucket is None:
+            bucket = TokenBucket(*self.limits[kind])
+        return bucket
+
+    def allow(self, username, ip):
+        """Returns False if a login for username from ip must be refused without checking it."""
+        if not self.enabled:
+            return True
+        with self._lock:
+            if self._bucket('user', username).available() and self._bucket('ip', ip).available():
+                return True
+        metrics.incr('login.throttled')
+        return False
+
+    def failed(self, username, ip):
+        """Records a failed login against both buckets."""
+        if not self.enabled:
+            return
+        with self._lock:
+            for kind, key in (('user', username), ('ip', ip)):
+                bucket = self._bucket(kind, key)
+                bucket.take()
+                self._buckets.set((kind, key), bucket)
+
+
+login_throttle = LoginThrottle()
@@ -0,0 +1,192 @@
+"""
+Email body storage.
+
+List pages never need a body: ``emails.body`` is deferred, and
+``emails.preview`` holds its start, computed at ingest. With
+EMAIL_BODY_STORAGE = 'compressed' the body is not stored in emails at all
+but compressed into ``email_bodies``, so the emails table and its blocks
+stay small, and view_email decompresses the one body it shows. Each stored
+body records its codec, so changing EMAIL_BODY_CODEC leaves older bodies
+readable.
+
+Email writers pass their rows through email_rows before inserting them and
+call insert_bodies afterwards, as seed.py does. To add the preview column
+to an existing database and fill it, and optionally to move the inline
+bodies already there into email_bodies:
+
+    python -m webapp.bodies --backfill [--compress]
+"""
+import re
+import time
+import zlib
+import argparse
+from sqlalchemy import select, update, insert, delete, bindparam, inspect, text
+from .models import Email, EmailBody
+from config import Config
+
+# Characters of body kept in emails.preview (String(255)), before the ellipsis
+PREVIEW_LENGTH = 200
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _zstd():
+    # Optional: only needed for EMAIL_BODY_CODEC = 'zstd'
+    import zstandard
+    return zstandard
+
+
+CODECS = {
+    'zlib': (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    'zstd': (lambda data, level: _zstd().ZstdCompressor(level=level).compress(data),
+             lambda data: _zstd().ZstdDecompressor().decompress(data)),
+}
+
+
+def make_preview(body):
+    """The start of a body on one line, cut at a word boundary."""
+    if not body:
+        return None
+    preview = _WHITESPACE.sub(' ', body[:PREVIEW_LENGTH * 2]).strip()
+    if len(preview) <= PREVIEW_LENGTH:
+        return preview
+    cut = preview.rfind(' ', 0, PREVIEW_LENGTH)
+    return preview[:cut if cut > 0 else PREVIEW_LENGTH].rstrip() + '...'
+
+
+def compress_body(body, codec=None, level=None):
+    compress = CODECS[codec or Config.EMAIL_BODY_CODEC][0]
+    return compress(body.encode('utf-8'), level or Config.EMAIL_BODY_COMPRESSION_LEVEL)
+
+
+def body_text(body, codec, data):
+    """The text of a body from emails.body, or from its email_bodies row when that is set."""
+    if data is None:
+        return body
+    return CODECS[codec][1](data).decode('utf-8')
+
+
+def load_body(session, email_id):
+    """Reads one email's body, inline or compressed, in a single query."""
+    row = session.execute(
+        select(Email.body, EmailBody.codec, EmailBody.data)
+        .outerjoin(EmailBody, EmailBody.email_id == Email.unique_email_id)
+        .where(Email.unique_email_id == email_id)
+    ).first()
+    return body_text(*row) if row else None
+
+
+def body_select(*columns):
+    """select(*columns) with the stored body appended; with_bodies turns its rows into (*columns, body)."""
+    return (
+        select(*columns, Email.body, EmailBody.codec, EmailBody.data)
+        .outerjoin(EmailBody, EmailBody.email_id == Email.unique_email_id)
+    )
+
+
+def with_bodies(rows):
+    return [(*row[:-3], body_text(*row[-3:])) for row in rows]
+
+
+def email_rows(emails):
+    """
+    Sets preview on email rows (dicts) that are about to be inserted, and
+    returns the rows to insert into emails: without their bodies when
+    bodies are stored compressed.
+    """
+    for row in emails:
+        row['preview'] = make_preview(row.get('body'))
+    if Config.EMAIL_BODY_STORAGE != 'compressed':
+        return emails
+    return [dict(row, body=None) for row in emails]
+
+
+def insert_bodies(session, emails):
+    """Writes the compressed bodies of just inserted emails, when bodies are stored compressed."""
+    if Config.EMAIL_BODY_STORAGE != 'compressed':
+        return
+    rows = [
+        {'email_id': row['unique_email_id'], 'codec': Config.EMAIL_BODY_CODEC, 'data': compress_body(row['body'])}
+        for row in emails if row.get('body')
+    ]
+    if rows:
+        session.execute(insert(EmailBody.__table__), rows)
+
+
+def add_preview_column(engine):
+    """Adds emails.preview to an existing emails table."""
+    existing = {column['name'].lower() for column in inspect(engine).get_columns('emails')}
+    if 'preview' not in existing:
+        with engine.begin() as connection:
+            connection.execute(text('ALTER TABLE emails ADD preview VARCHAR(255)'))
+
+
+def backfill_bodies(session, compress=False, chunk_size=1000):
+    """
+    Fills emails.preview where it is missing and, with compress, moves
+    every inline body into email_bodies, in unique_email_id order and
+    committing per chunk, so a stopped run resumes where it left off.
+    Returns (previews set, bodies compressed).
+    """
+    table = Email.__table__
+    set_preview = (update(table).where(table.c.unique_email_id == bindparam('email_id'))
+                   .values(preview=bindparam('preview')))
+    clear_body = update(table).where(table.c.unique_email_id == bindparam('email_id')).values(body=None)
+    # An email that somehow has both keeps the inline body, the newer one
+    bodies = EmailBody.__table__
+    drop_copy = delete(bodies).where(bodies.c.email_id == bindparam('copy_id'))
+    pending = Email.preview.is_(None)
+    if compress:
+        pending = pending | Email.body.isnot(None)
+
+    previews = compressed = 0
+    last_id = None
+    while True:
+        stmt = body_select(Email.unique_email_id, Email.preview).where(pending).order_by(Email.unique_email_id)
+        if last_id is not None:
+            stmt = stmt.where(Email.unique_email_id > last_id)
+        chunk = session.execute(stmt.limit(chunk_size)).all()
+        if not chunk:
+            break
+
+        missing = []
+        moved = []
+        for email_id, preview, body, codec, data in chunk:
+            if preview is None:
+                full = body if body is not None else body_text(None, codec, data)
+                missing.append({'email_id': email_id, 'preview': make_preview(full)})
+            if compress and body is not None:
+                moved.append({'email_id': email_id, 'codec': Config.EMAIL_BODY_CODEC, 'data': compress_body(body)})
+
+        if missing:
+            session.execute(set_preview, missing)
+            previews += len(missing)
+        if moved:
+            session.execute(drop_copy, [{'copy_id': row['email_id']} for row in moved])
+            session.execute(insert(bodies), moved)
+            session.execute(clear_body, [{'email_id': row['email_id']} for row in moved])
+            compressed += len(moved)
+        session.commit()
+        last_id = chunk[-1].unique_email_id
+    return previews, compressed
+
+
+if __name__ == '__main__':
+    from .database import db_session, get_engine
+
+    parser = argparse.ArgumentParser(description='Maintain email previews and compressed bodies.')
+    parser.add_argument('--backfill', action='store_true',
+                        help='Add emails.preview if needed and fill it for every email without one.')
+    parser.add_argument('--compress', action='store_true',
+                        help='Also move every inline body into email_bodies, compressed with EMAIL_BODY_CODEC.')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Emails handled per transaction.')
+    args = parser.parse_args()
+    if not args.backfill:
+        parser.error('nothing to do; pass --backfill')
+
+    EmailBody.__table__.create(get_engine(), checkfirst=True)
+    add_preview_column(get_engine())
+
+    started = time.perf_counter()
+    previews, compressed = backfill_bodies(db_session, compress=args.compress, chunk_size=args.chunk_size)
+    print(f"Set {previews} previews and compressed {compressed} bodies in {time.perf_counter() - started:.1f}s.")
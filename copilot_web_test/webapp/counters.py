@@ -0,0 +1,144 @@
+"""
+Denormalized per-email counters.
+
+``Email.comment_count`` and ``Email.reference_count`` let the search
+filters and the "most discussed" sort use an index instead of an EXISTS
+over comments or a scan of the references text. They are maintained where
+rows are written: the ORM keeps reference_count in step with the
+references column, and comment writers call the helpers below. To add the
+columns to an existing database and recompute every counter:
+
+    python -m webapp.counters --add-columns
+"""
+import time
+import argparse
+from collections import Counter
+from sqlalchemy import select, update, bindparam, func, event, inspect, text
+from .models import Email, Comment
+
+# Oracle rejects IN lists with more than 1000 expressions
+IN_CLAUSE_LIMIT = 1000
+
+COUNTER_COLUMNS = ('comment_count', 'reference_count')
+
+
+def count_references(references):
+    """The number of email ids in a comma-separated references value."""
+    if not references:
+        return 0
+    return sum(1 for ref in references.split(',') if ref.strip())
+
+
+@event.listens_for(Email, 'before_insert')
+@event.listens_for(Email, 'before_update')
+def _sync_reference_count(mapper, connection, target):
+    target.reference_count = count_references(target.references)
+
+
+def increment_comment_count(session, email_id, by=1):
+    """Adds to one email's comment_count in the current transaction."""
+    session.execute(
+        update(Email.__table__)
+        .where(Email.__table__.c.unique_email_id == email_id)
+        .values(comment_count=Email.__table__.c.comment_count + by)
+    )
+
+
+def add_comment_counts(session, email_ids):
+    """Adds one to comment_count for every occurrence of an id in email_ids, with one executemany."""
+    counts = Counter(email_ids)
+    if not counts:
+        return
+    table = Email.__table__
+    session.execute(
+        update(table)
+        .where(table.c.unique_email_id == bindparam('email_id'))
+        .values(comment_count=table.c.comment_count + bindparam('added')),
+        [{'email_id': email_id, 'added': added} for email_id, added in counts.items()]
+    )
+
+
+def _comment_counts(session, email_ids):
+    counts = {}
+    for i in range(0, len(email_ids), IN_CLAUSE_LIMIT):
+        rows = session.execute(
+            select(Comment.email_id, func.count())
+            .where(Comment.email_id.in_(email_ids[i:i + IN_CLAUSE_LIMIT]))
+            .group_by(Comment.email_id)
+        )
+        counts.update(rows.all())
+    return counts
+
+
+def repair_counters(session, chunk_size=1000, dry_run=False):
+    """
+    Recomputes both counters for every email in id order and rewrites the
+    ones that drifted, committing per chunk. Returns (checked, fixed).
+    """
+    table = Email.__table__
+    fix = (
+        update(table)
+        .where(table.c.unique_email_id == bindparam('email_id'))
+        .values(comment_count=bindparam('comments'), reference_count=bindparam('refs'))
+    )
+
+    checked = 0
+    fixed = 0
+    last_id = None
+    while True:
+        stmt = select(Email.unique_email_id, Email.references, Email.comment_count, Email.reference_count) \
+            .order_by(Email.unique_email_id).limit(chunk_size)
+        if last_id is not None:
+            stmt = stmt.where(Email.unique_email_id > last_id)
+        chunk = session.execute(stmt).all()
+        if not chunk:
+            break
+
+        comment_counts = _comment_counts(session, [row.unique_email_id for row in chunk])
+        drifted = []
+        for row in chunk:
+            comments = comment_counts.get(row.unique_email_id, 0)
+            refs = count_references(row.references)
+            if row.comment_count != comments or row.reference_count != refs:
+                drifted.append({'email_id': row.unique_email_id, 'comments': comments, 'refs': refs})
+
+        if drifted and not dry_run:
+            session.execute(fix, drifted)
+        session.commit()
+
+        checked += len(chunk)
+        fixed += len(drifted)
+        last_id = chunk[-1].unique_email_id
+
+    return checked, fixed
+
+
+def add_counter_columns(engine):
+    """Adds the counter columns and their indexes to an existing emails table."""
+    existing = {column['name'].lower() for column in inspect(engine).get_columns('emails')}
+    with engine.begin() as connection:
+        for name in COUNTER_COLUMNS:
+            if name not in existing:
+                connection.execute(text(f'ALTER TABLE emails ADD {name} INTEGER DEFAULT 0 NOT NULL'))
+    for index in Email.__table__.indexes:
+        if {column.name for column in index.columns} & set(COUNTER_COLUMNS):
+            index.create(engine, checkfirst=True)
+
+
+if __name__ == '__main__':
+    from .database import db_session, get_engine
+
+    parser = argparse.ArgumentParser(description='Check and repair the per-email comment and reference counters.')
+    parser.add_argument('--add-columns', action='store_true', help='Add the counter columns to an existing database first.')
+    parser.add_argument('--dry-run', action='store_true', help='Report drifted counters without fixing them.')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Emails checked per transaction.')
+    args = parser.parse_args()
+
+    if args.add_columns:
+        add_counter_columns(get_engine())
+
+    started = time.perf_counter()
+    checked, fixed = repair_counters(db_session, chunk_size=args.chunk_size, dry_run=args.dry_run)
+    elapsed = time.perf_counter() - started
+    verb = 'would fix' if args.dry_run else 'fixed'
+    print(f"Checked {checked} emails, {verb} {fixed} in {elapsed:.1f}s.")
@@ -1,27 +1,186 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
+"""
+Engine and session setup.
+
+The engine is created on first use in each process rather than at import
+time, and is discarded in forked children, so uWSGI workers never share
+the master's sockets. Pooling is configured from Config: SQLAlchemy's own
+QueuePool by default, or a python-oracledb session pool (optionally on
+DRCP) with DB_POOL_MODE = 'oracledb' or 'drcp'. Time spent waiting for a
+pooled connection is recorded as the ``db.pool.checkout_wait`` timing.
+With a sqlite:/// DATABASE_URL the same QueuePool hands out connections to
+a local file in WAL mode, so the app runs without Oracle.
+The async API tier gets an asyncio engine of its own from
+get_async_engine().
+"""
+import os
+import time
+import threading
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker, Session
+from sqlalchemy.pool import QueuePool, NullPool
 from sqlalchemy.ext.declarative import declarative_base
 from config import Config
+from . import metrics
+
+_lock = threading.Lock()
+_engine = None
+_engine_pid = None
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that reports how long each checkout waited."""
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.record_timing('db.pool.checkout_wait', time.perf_counter() - started)
+            metrics.set_gauge('db.pool.checked_out', self.checkedout())
+
+
+def _configure_oracledb(config):
+    import oracledb
+    # Applies to every connection and cursor the driver creates
+    oracledb.defaults.stmtcachesize = config.DB_STMT_CACHE_SIZE
+    oracledb.defaults.arraysize = config.DB_ARRAYSIZE
+    oracledb.defaults.prefetchrows = config.DB_PREFETCHROWS
+    return oracledb
+
+
+def _oracledb_pool_engine(config, oracledb):
+    pool_args = {}
+    if config.DB_POOL_MODE == 'drcp':
+        pool_args = {'server_type': 'pooled', 'cclass': config.DB_DRCP_CLASS, 'purity': oracledb.PURITY_SELF}
+    pool = oracledb.create_pool(
+        user=config.DB_USER,
+        password=config.DB_PASSWORD,
+        dsn=f'{config.DB_HOST}:{config.DB_PORT}/{config.DB_SERVICE_NAME}',
+        min=config.DB_POOL_MIN,
+        max=config.DB_POOL_SIZE + config.DB_MAX_OVERFLOW,
+        increment=1,
+        wait_timeout=config.DB_POOL_TIMEOUT * 1000,
+        getmode=oracledb.POOL_GETMODE_TIMEDWAIT,
+        max_lifetime_session=config.DB_POOL_RECYCLE if config.DB_POOL_RECYCLE > 0 else 0,
+        ping_interval=0 if config.DB_POOL_PRE_PING else -1,
+        **pool_args
+    )
+
+    def acquire():
+        started = time.perf_counter()
+        try:
+            return pool.acquire()
+        finally:
+            metrics.record_timing('db.pool.checkout_wait', time.perf_counter() - started)
+            metrics.set_gauge('db.pool.checked_out', pool.busy)
+
+    # The driver pools the connections, so SQLAlchemy must not hold on to them
+    return create_engine('oracle+oracledb://', creator=acquire, poolclass=NullPool)
+
+
+def _configure_sqlite(engine):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # Readers are not blocked by the activity writer's inserts
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+    return engine
+
+
+def _create_engine(config=Config):
+    url = config.SQLALCHEMY_DATABASE_URI
+    connect_args = {}
+    if url.startswith('oracle'):
+        oracledb = _configure_oracledb(config)
+        if config.DB_POOL_MODE in ('oracledb', 'drcp'):
+            return _oracledb_pool_engine(config, oracledb)
+    elif url.startswith('sqlite'):
+        # Pooled connections move between request threads
+        connect_args = {'check_same_thread': False}
+    engine = create_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        pool_pre_ping=config.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+    if url.startswith('sqlite'):
+        _configure_sqlite(engine)
+    return engine
 
-username = Config.DB_USER
-password = Config.DB_PASSWORD
-oracle_host = Config.DB_HOST
-oracle_port = Config.DB_PORT
-oracle_service_name = Config.DB_SERVICE_NAME
 
-# Construct the database URL using the settings
-database_url = f'oracle+oracledb://{username}:{password}@{oracle_host}:{oracle_port}/?service_name={oracle_service_name}'
+def get_engine():
+    """Returns this process's engine, creating it on first use."""
+    global _engine, _engine_pid
+    if _engine is not None and _engine_pid == os.getpid():
+        return _engine
+    with _lock:
+        if _engine is None or _engine_pid != os.getpid():
+            _engine = _create_engine()
+            _engine_pid = os.getpid()
+    return _engine
 
-engine = create_engine(database_url)
-db_session = scoped_session(sessionmaker(autocommit=False,
-                                         autoflush=False,
-                                         bind=engine))
+
+_async_engine = None
+_async_engine_pid = None
+
+
+def _create_async_engine(config=Config):
+    from sqlalchemy.ext.asyncio import create_async_engine
+    url = config.SQLALCHEMY_ASYNC_DATABASE_URI
+    if url.startswith('oracle'):
+        _configure_oracledb(config)
+    return create_async_engine(
+        url,
+        pool_size=config.ASYNC_DB_POOL_SIZE,
+        max_overflow=config.ASYNC_DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        pool_pre_ping=config.DB_POOL_PRE_PING,
+    )
+
+
+def get_async_engine():
+    """Returns this process's asyncio engine for the async API tier, creating it on first use."""
+    global _async_engine, _async_engine_pid
+    if _async_engine is not None and _async_engine_pid == os.getpid():
+        return _async_engine
+    with _lock:
+        if _async_engine is None or _async_engine_pid != os.getpid():
+            _async_engine = _create_async_engine()
+            _async_engine_pid = os.getpid()
+    return _async_engine
+
+
+def _discard_engine_after_fork():
+    global _engine, _engine_pid, _async_engine, _async_engine_pid
+    if _engine is not None:
+        # Leave the parent's connections open for the parent
+        _engine.dispose(close=False)
+    _engine = None
+    _engine_pid = None
+    # An asyncio engine belongs to its parent's event loop; the child makes its own
+    _async_engine = None
+    _async_engine_pid = None
+
+
+os.register_at_fork(after_in_child=_discard_engine_after_fork)
+
+
+class LazySession(Session):
+    """Binds to get_engine() unless a bind was configured explicitly."""
+    def get_bind(self, mapper=None, **kwargs):
+        if self.bind is None:
+            return get_engine()
+        return super().get_bind(mapper, **kwargs)
+
+
+db_session = scoped_session(sessionmaker(class_=LazySession,
+                                         autocommit=False,
+                                         autoflush=False))
 Base = declarative_base()
 Base.query = db_session.query_property()
-
-def init_db():
-    # import all modules here that might define models so that
-    # they will be registered properly on the metadata.  Otherwise
-    # you will have to import them first before calling init_db()
-    from .models import User, Email, UserActivity
-    Base.metadata.create_all(bind=engine)
@@ -0,0 +1,98 @@
+"""
+Streaming exports.
+
+Rows are read from a server-side cursor on a dedicated connection, a
+``yield_per`` partition at a time, and written out as CSV or NDJSON in
+chunks of roughly EXPORT_BUFFER_SIZE bytes, optionally through a gzip
+stream. Memory stays flat however many rows the export returns.
+"""
+import io
+import csv
+import json
+import zlib
+import datetime
+from flask import Response, stream_with_context, current_app
+from .database import db_session
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def _value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def _csv_lines(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if columns is not None:
+        writer.writerow(columns)
+    writer.writerows([[_value(value) for value in row] for row in rows])
+    return buffer.getvalue()
+
+
+def _ndjson_lines(columns, rows):
+    return ''.join(
+        json.dumps(dict(zip(columns, (_value(value) for value in row))), ensure_ascii=False) + '\n'
+        for row in rows
+    )
+
+
+def iter_rows(statement, params, chunk_size):
+    """Yields lists of rows from a server-side cursor, closing it when done or abandoned."""
+    with db_session.get_bind().connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(statement, params)
+        for partition in result.partitions():
+            yield partition
+
+
+def iter_export(statement, params, columns, fmt='csv', compress=False, chunk_size=1000, buffer_size=65536):
+    """Yields the encoded export, CSV with a header row or NDJSON with one object per row."""
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31: gzip container
+    pending = []
+    pending_size = 0
+
+    def emit(text):
+        data = text.encode('utf-8')
+        return compressor.compress(data) if compressor else data
+
+    if fmt == 'csv':
+        pending.append(emit(_csv_lines(columns, [])))
+    for rows in iter_rows(statement, params, chunk_size):
+        text = _csv_lines(None, rows) if fmt == 'csv' else _ndjson_lines(columns, rows)
+        data = emit(text)
+        pending.append(data)
+        pending_size += len(data)
+        if pending_size >= buffer_size:
+            yield b''.join(pending)
+            pending = []
+            pending_size = 0
+
+    if compressor:
+        pending.append(compressor.flush())
+    if pending:
+        yield b''.join(pending)
+
+
+def export_response(statement, params, columns, filename, fmt='csv', compress=False):
+    """A streamed download of the rows of statement."""
+    if fmt not in CONTENT_TYPES:
+        fmt = 'csv'
+    filename = f'{filename}.{fmt}'
+    content_type = CONTENT_TYPES[fmt]
+    if compress:
+        filename += '.gz'
+        content_type = 'application/gzip'
+
+    body = iter_export(statement, params, columns, fmt, compress,
+                       chunk_size=current_app.config['EXPORT_CHUNK_SIZE'],
+                       buffer_size=current_app.config['EXPORT_BUFFER_SIZE'])
+    response = Response(stream_with_context(body), content_type=content_type)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # Let uWSGI or a proxy pass the chunks straight through
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
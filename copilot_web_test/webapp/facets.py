@@ -0,0 +1,143 @@
+"""
+Search facet counts.
+
+``email_facet_counts`` holds the number of emails per (day, sender, type).
+A search without query text or counter filters is faceted from it alone,
+a table of a few rows per sender per day, instead of grouping every
+matching email. Email writers call add_facet_counts in the transaction that
+inserts the emails, as seed.py does. To fill the table for an existing
+database, or to recompute it after emails were changed by hand:
+
+    python -m webapp.facets --rebuild
+"""
+import time
+import argparse
+from datetime import datetime
+from collections import Counter
+from sqlalchemy import select, update, insert, delete, bindparam, func, Date
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from .models import Email, EmailFacetCount
+
+# Oracle rejects IN lists with more than 1000 expressions
+IN_CLAUSE_LIMIT = 1000
+
+# Stands in for a missing sender or type, as both are part of the key (and
+# Oracle would store an empty string as NULL)
+NO_VALUE = '(none)'
+
+
+class day_start(FunctionElement):
+    """The date part of a datetime."""
+    type = Date()
+    name = 'day_start'
+    inherit_cache = True
+
+
+class month_start(FunctionElement):
+    """The first day of the month of a date or datetime."""
+    type = Date()
+    name = 'month_start'
+    inherit_cache = True
+
+
+@compiles(day_start)
+def _day_start(element, compiler, **kw):
+    return 'TRUNC(%s)' % compiler.process(element.clauses, **kw)
+
+
+@compiles(day_start, 'sqlite')
+def _day_start_sqlite(element, compiler, **kw):
+    return 'date(%s)' % compiler.process(element.clauses, **kw)
+
+
+@compiles(month_start)
+def _month_start(element, compiler, **kw):
+    return "TRUNC(%s, 'MM')" % compiler.process(element.clauses, **kw)
+
+
+@compiles(month_start, 'sqlite')
+def _month_start_sqlite(element, compiler, **kw):
+    return "date(%s, 'start of month')" % compiler.process(element.clauses, **kw)
+
+
+def _facet_key(row):
+    return row['date_sent'].date(), row['sender_name'] or NO_VALUE, row['email_type'] or NO_VALUE
+
+
+def _existing_keys(session, days):
+    """The (day, sender, type) keys already counted on the given days."""
+    keys = set()
+    days = sorted(days)
+    for i in range(0, len(days), IN_CLAUSE_LIMIT):
+        rows = session.execute(
+            select(EmailFacetCount.day, EmailFacetCount.sender_name, EmailFacetCount.email_type)
+            .where(EmailFacetCount.day.in_(days[i:i + IN_CLAUSE_LIMIT]))
+        )
+        for day, sender_name, email_type in rows:
+            # Oracle hands DATE columns back as datetimes
+            keys.add((day.date() if isinstance(day, datetime) else day, sender_name, email_type))
+    return keys
+
+
+def add_facet_counts(session, emails):
+    """
+    Counts newly inserted emails (dicts with date_sent, sender_name and
+    email_type) into email_facet_counts in the current transaction.
+    """
+    counts = Counter(_facet_key(row) for row in emails if row.get('date_sent'))
+    if not counts:
+        return
+    existing = _existing_keys(session, {day for day, _, _ in counts})
+
+    table = EmailFacetCount.__table__
+    rows = [
+        {'facet_day': day, 'facet_sender': sender_name, 'facet_type': email_type, 'added': added}
+        for (day, sender_name, email_type), added in counts.items() if (day, sender_name, email_type) in existing
+    ]
+    if rows:
+        session.execute(
+            update(table)
+            .where(table.c.day == bindparam('facet_day'), table.c.sender_name == bindparam('facet_sender'),
+                   table.c.email_type == bindparam('facet_type'))
+            .values(count=table.c.count + bindparam('added')),
+            rows
+        )
+    rows = [
+        {'day': day, 'sender_name': sender_name, 'email_type': email_type, 'count': added}
+        for (day, sender_name, email_type), added in counts.items() if (day, sender_name, email_type) not in existing
+    ]
+    if rows:
+        session.execute(insert(table), rows)
+
+
+def rebuild_facet_counts(session):
+    """Recomputes email_facet_counts from the emails table. Returns the number of facet rows."""
+    day = day_start(Email.date_sent)
+    sender_name = func.coalesce(Email.sender_name, NO_VALUE)
+    email_type = func.coalesce(Email.email_type, NO_VALUE)
+    session.execute(delete(EmailFacetCount))
+    session.execute(
+        insert(EmailFacetCount).from_select(
+            ['day', 'sender_name', 'email_type', 'count'],
+            select(day, sender_name, email_type, func.count())
+            .where(Email.date_sent.isnot(None))
+            .group_by(day, sender_name, email_type)
+        )
+    )
+    session.commit()
+    return session.execute(select(func.count()).select_from(EmailFacetCount)).scalar()
+
+
+if __name__ == '__main__':
+    from .database import db_session
+
+    parser = argparse.ArgumentParser(description='Maintain the precomputed search facet counts.')
+    parser.add_argument('--rebuild', action='store_true', help='Recompute every facet count from the emails.')
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.error('nothing to do; pass --rebuild')
+
+    started = time.perf_counter()
+    rows = rebuild_facet_counts(db_session)
+    print(f"Rebuilt {rows} facet rows in {time.perf_counter() - started:.1f}s.")
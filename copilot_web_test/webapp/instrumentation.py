@@ -0,0 +1,111 @@
+"""
+SQL statement counting, timing and per-view query budgets.
+
+Every statement executed on the current thread is counted and timed by
+the active ``count_queries()`` blocks. ``query_budget`` wraps a view in one
+and complains when the view (including the templates it renders) runs more
+statements than it is allowed; with QUERY_BUDGET_STRICT it raises, as it
+does in the tests (tests/conftest.py).
+
+Statements slower than SLOW_QUERY_MS are logged with the shape of their
+bind parameters (names and types, never values) on any thread.
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = []
+
+
+def _active_counters():
+    counters = getattr(_local, 'counters', None)
+    if counters is None:
+        counters = _local.counters = []
+    return counters
+
+
+def bind_shape(parameters, executemany=False):
+    """Describes bind parameters by name and type, leaving out their values."""
+    if executemany:
+        parameters = list(parameters)
+        if not parameters:
+            return '[]'
+        return f"{len(parameters)} x {bind_shape(parameters[0])}"
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f"{name}: {type(value).__name__}" for name, value in parameters.items()) + '}'
+    if isinstance(parameters, (list, tuple)):
+        return '(' + ', '.join(type(value).__name__ for value in parameters) + ')'
+    return type(parameters).__name__
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._statement_start = time.perf_counter()
+    for counter in _active_counters():
+        counter.count += 1
+        counter.statements.append(statement)
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _time_statement(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_statement_start', None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    for counter in _active_counters():
+        counter.duration += duration
+
+    if duration * 1000 >= Config.SLOW_QUERY_MS:
+        logger.warning("Slow query (%.1f ms) with binds %s:\n%s",
+                       duration * 1000, bind_shape(parameters, executemany), statement)
+
+
+@contextmanager
+def count_queries():
+    """Counts the SQL statements executed on this thread inside the block."""
+    counter = QueryCounter()
+    counters = _active_counters()
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def query_budget(max_queries):
+    """A decorator that enforces an upper bound on the queries a view runs."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with count_queries() as counter:
+                response = f(*args, **kwargs)
+
+            if counter.count > max_queries:
+                message = f"{request.endpoint} ran {counter.count} queries (budget {max_queries})"
+                if current_app.config['QUERY_BUDGET_STRICT']:
+                    raise QueryBudgetExceeded(message + ':\n' + '\n'.join(counter.statements))
+                logger.warning(message)
+
+            return response
+        return decorated_function
+    return decorator
@@ -0,0 +1,188 @@
+"""
+Incremental document link generation.
+
+Streams new documents from the database in chunks, extracts their <REF>
+tags across a process pool, resolves them against the reference map and
+bulk-inserts ``document_links`` and ``dangling_references`` per chunk.
+Each chunk commits together with a ``link_job_log`` row, so a crashed run
+resumes from the last committed chunk:
+
+    python -m webapp.link_pipeline --chunk-size 500 --workers 4
+"""
+import io
+import os
+import re
+import time
+import hashlib
+import logging
+import argparse
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import select, insert
+from .models import Document, document_links, DanglingReference, LinkJobLog
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+REFERENCE_TAG = 'REF'
+REFERENCE_PATTERN = re.compile(r'^([A-Z]{2,5})-(\d{2,5})-(\d{4})$')
+DANGLING_ID_LENGTH = 50
+
+# The reference map, installed once per worker process by _init_worker
+_refmap = None
+
+# --- Functions ---
+
+def parse_reference(ref_text):
+    match = REFERENCE_PATTERN.match(ref_text.strip())
+    if match:
+        doctype, scno, year = match.groups()
+        return doctype, scno, year
+    return None
+
+def extract_refs_from_xml(xml_text):
+    """Returns the text of every <REF> element, parsing the document incrementally."""
+    refs = []
+    try:
+        for _, node in ET.iterparse(io.BytesIO(xml_text.encode('utf-8')), events=('end',)):
+            if node.tag == REFERENCE_TAG and node.text:
+                refs.append(node.text.strip())
+            node.clear()
+    except ET.ParseError:
+        logger.warning("Invalid XML encountered.")
+    return refs
+
+def build_reference_map(session):
+    rows = session.execute(select(Document.uniqid, Document.doctype, Document.scno, Document.docdate))
+    refmap = {}
+    for uniqid, doctype, scno, docdate in rows:
+        year = docdate[:4] if docdate else None
+        refmap[(doctype, scno, year)] = uniqid
+    return refmap
+
+def get_resume_point(session):
+    """Returns the last uniqid of the most recently committed chunk."""
+    return session.execute(
+        select(LinkJobLog.max_uniqid).order_by(LinkJobLog.id.desc()).limit(1)
+    ).scalar()
+
+def _dangling_id(source_uniqid, ref):
+    dangling_id = f"{source_uniqid}-{ref}"
+    if len(dangling_id) > DANGLING_ID_LENGTH:
+        digest = hashlib.sha1(dangling_id.encode('utf-8')).hexdigest()[:8]
+        dangling_id = f"{dangling_id[:DANGLING_ID_LENGTH - 9]}-{digest}"
+    return dangling_id
+
+def _init_worker(refmap):
+    global _refmap
+    _refmap = refmap
+
+def process_document(document, refmap=None):
+    """Resolves the references of one (uniqid, xml_text) pair into (links, dangling) rows."""
+    refmap = refmap if refmap is not None else _refmap
+    source_uniqid, xml_text = document
+    links = {}
+    dangling = {}
+    if not xml_text:
+        return [], []
+
+    refs = extract_refs_from_xml(xml_text)
+    logger.debug("Document %s has %d <REF> tags", source_uniqid, len(refs))
+
+    for ref in refs:
+        parsed = parse_reference(ref)
+        if parsed:
+            target_uniqid = refmap.get(parsed)
+            if target_uniqid and target_uniqid != source_uniqid:
+                links.setdefault(target_uniqid, {
+                    'source_uniqid': source_uniqid,
+                    'target_uniqid': target_uniqid,
+                    'ref_text': ref
+                })
+                continue
+            reason = 'No match or self-reference'
+        else:
+            reason = 'Failed regex'
+        dangling_id = _dangling_id(source_uniqid, ref)
+        dangling.setdefault(dangling_id, {
+            'id': dangling_id,
+            'source_uniqid': source_uniqid,
+            'ref_text': ref,
+            'reason': reason
+        })
+
+    return list(links.values()), list(dangling.values())
+
+def iter_document_chunks(connection, after_uniqid, chunk_size):
+    """Yields lists of (uniqid, xml_text) in uniqid order from a server-side cursor."""
+    stmt = select(Document.uniqid, Document.xml_text).order_by(Document.uniqid)
+    if after_uniqid is not None:
+        stmt = stmt.where(Document.uniqid > after_uniqid)
+    result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(stmt)
+    for partition in result.partitions():
+        yield [tuple(row) for row in partition]
+
+def generate_links(session, chunk_size=500, workers=None):
+    """
+    Links every document added since the last committed chunk. Documents are
+    read on a dedicated connection so the per-chunk commits on ``session``
+    never close the streaming cursor.
+    """
+    workers = workers or os.cpu_count()
+    refmap = build_reference_map(session)
+    resume_point = get_resume_point(session)
+    session.commit()
+    logger.info("Starting link generation after uniqid %s (%d known documents)", resume_point, len(refmap))
+
+    totals = {'docs': 0, 'links': 0, 'dangling': 0}
+    started = time.perf_counter()
+
+    with session.get_bind().connect() as reader, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(refmap,)) as pool:
+        for chunk in iter_document_chunks(reader, resume_point, chunk_size):
+            links_to_insert = []
+            dangling_to_insert = []
+            per_worker = max(1, len(chunk) // (workers * 4))
+            for links, dangling in pool.map(process_document, chunk, chunksize=per_worker):
+                links_to_insert.extend(links)
+                dangling_to_insert.extend(dangling)
+
+            if links_to_insert:
+                session.execute(insert(document_links), links_to_insert)
+            if dangling_to_insert:
+                session.execute(insert(DanglingReference.__table__), dangling_to_insert)
+            session.add(LinkJobLog(
+                max_uniqid=chunk[-1][0],
+                docs_processed=len(chunk),
+                links_created=len(links_to_insert),
+                dangling_refs=len(dangling_to_insert)
+            ))
+            session.commit()
+
+            totals['docs'] += len(chunk)
+            totals['links'] += len(links_to_insert)
+            totals['dangling'] += len(dangling_to_insert)
+            elapsed = time.perf_counter() - started
+            logger.info("Committed chunk ending at %s: %d docs, %d links, %d dangling (%.0f docs/s)",
+                        chunk[-1][0], totals['docs'], totals['links'], totals['dangling'],
+                        totals['docs'] / elapsed if elapsed else 0)
+
+    if not totals['docs']:
+        logger.info("No new documents to process.")
+    else:
+        logger.info("Link generation complete.")
+    return totals
+
+# --- Runner ---
+
+if __name__ == '__main__':
+    from .database import db_session
+
+    parser = argparse.ArgumentParser(description='Generate document links for new documents.')
+    parser.add_argument('--chunk-size', type=int, default=500, help='Documents per committed chunk.')
+    parser.add_argument('--workers', type=int, default=None, help='Parser processes (defaults to the CPU count).')
+    parser.add_argument('--verbose', action='store_true', help='Log every document.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    generate_links(db_session, chunk_size=args.chunk_size, workers=args.workers)
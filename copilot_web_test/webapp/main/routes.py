@@ -4,7 +4,10 @@ from . import main_bp
 from ..database import db_session
 from ..models import Email, User, UserActivity, Comment
 from ..utils import track_activity, Pagination
-import re
+from ..references import get_referenced_emails, linked_body
+from ..instrumentation import query_budget
+from ..profiling import profiler
+from .. import metrics
 from sqlalchemy import or_
 from datetime import datetime
 
@@ -26,6 +29,7 @@ def search():
 @main_bp.route('/email/<string:email_id>')
 @login_required
 @track_activity('view_email_{email_id}')
+@query_budget(3)
 def view_email(email_id):
     email = db_session.get(Email, email_id)
     if not email:
@@ -33,38 +37,24 @@ def view_email(email_id):
         return redirect(url_for('main.index'))
 
     back_url = request.referrer or url_for('main.search')
-    email_body = email.body
-    potential_ids = re.findall(r'([a-zA-Z0-9]+-\d{2}-\d{4,})', email_body)
-    
-    referenced_emails = []
-    if potential_ids:
-        referenced_emails = Email.query.filter(Email.unique_email_id.in_(potential_ids)).all()
-        
-        for ref_email in referenced_emails:
-            unique_id = ref_email.unique_email_id
-            # Create a link that toggles the collapse element in the side panel
-            replacement_link = (
-                f'<a href="#collapse-{unique_id}" '
-                f'data-bs-toggle="collapse" '
-                f'aria-expanded="false" '
-                f'aria-controls="collapse-{unique_id}">'
-                f'{unique_id}</a>'
-            )
-            email_body = email_body.replace(unique_id, replacement_link)
 
-    # Fetch top-level comments for this email
-    comments = Comment.query.filter_by(email_id=email.unique_email_id, parent_id=None).order_by(Comment.timestamp.desc()).all()
+    # References come from the precomputed graph; the linked body is cached per email,
+    # and the body (deferred, possibly stored compressed) is only read on a cache miss.
+    referenced_emails = get_referenced_emails(email.unique_email_id)
+    email_body = linked_body(db_session, email.unique_email_id,
+                             {ref_email.unique_email_id for ref_email in referenced_emails})
 
+    # The comment thread is fetched by the page from api.email_comments
     return render_template('email_reader.html', 
                            email=email, 
                            email_body=email_body, 
                            back_url=back_url, 
-                           referenced_emails=referenced_emails,
-                           comments=comments)
+                           referenced_emails=referenced_emails)
 
 @main_bp.route('/activity')
 @login_required
 @track_activity('view_activity')
+@query_budget(1)
 def activity():
     if current_user.username != 'admin':
         flash('You do not have permission to access this page.', 'danger')
@@ -78,3 +68,15 @@ def activity():
                            users=users,
                            selected_user_id='',
                            per_page=25)
+
+@main_bp.route('/profiling')
+@login_required
+def profiling():
+    """Per-endpoint request profile and operational metrics of this worker."""
+    if current_user.username != 'admin':
+        return jsonify({'error': 'Permission denied'}), 403
+
+    return jsonify({
+        'endpoints': profiler.snapshot(),
+        'metrics': metrics.snapshot(),
+    })
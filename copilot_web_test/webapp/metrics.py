@@ -0,0 +1,54 @@
+"""
+Process-local operational metrics: counters, gauges and timings.
+
+Every uWSGI worker keeps its own numbers; ``snapshot()`` returns them as a
+plain dict for logging or an admin endpoint.
+"""
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def record_timing(name, seconds):
+    """Adds one observation (in seconds) to the named timing."""
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = _timings[name] = {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0}
+        timing['count'] += 1
+        timing['total'] += seconds
+        timing['last'] = seconds
+        if seconds > timing['max']:
+            timing['max'] = seconds
+
+
+def snapshot():
+    with _lock:
+        timings = {}
+        for name, timing in _timings.items():
+            timings[name] = dict(timing, avg=timing['total'] / timing['count'] if timing['count'] else 0.0)
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'timings': timings,
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
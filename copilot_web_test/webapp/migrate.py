@@ -0,0 +1,78 @@
+"""
+Schema management.
+
+The app no longer creates tables when it starts: a cold worker only
+imports code and builds its URL map, and the first database connection is
+made by the first request that needs one. Create or upgrade the schema
+once per deployment, before the workers start:
+
+    python -m webapp.migrate
+
+Upgrading creates missing tables, key sequences and indexes, adds the
+counter columns, sender_id and preview to an older emails table and drops
+the foreign key on email_references.target_id; it never drops or alters
+anything else. Filling new columns and tables is left to
+each module's own command (webapp.counters, webapp.senders, webapp.facets,
+webapp.bodies). ``--sql`` prints the CREATE statements for the configured
+database instead of running them, and ``--reset`` drops every table first.
+"""
+import time
+import argparse
+from sqlalchemy import Sequence
+from sqlalchemy.schema import CreateTable, CreateIndex
+from .database import Base, get_engine
+# Register every model on the metadata, and the partitioning DDL for user_activity
+from . import models, activity_retention, counters, senders, bodies, references
+
+
+def upgrade(engine):
+    """Brings an empty or older database up to the current schema."""
+    Base.metadata.create_all(bind=engine, checkfirst=True)
+    counters.add_counter_columns(engine)
+    senders.add_sender_column(engine)
+    bodies.add_preview_column(engine)
+    references.drop_target_foreign_key(engine)
+    activity_retention.ensure_schema(engine)
+    # create_all skips the key sequences and indexes of tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for column in table.columns:
+            if isinstance(column.default, Sequence):
+                column.default.create(engine, checkfirst=True)
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+def reset(engine):
+    """Drops every table and creates the schema from scratch."""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+
+def schema_sql(dialect):
+    """The CREATE TABLE and CREATE INDEX statements for the given dialect."""
+    statements = []
+    for table in Base.metadata.sorted_tables:
+        statements.append(str(CreateTable(table).compile(dialect=dialect)).strip())
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            statements.append(str(CreateIndex(index).compile(dialect=dialect)).strip())
+    return statements
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create or upgrade the database schema.')
+    parser.add_argument('--sql', action='store_true', help='Print the DDL instead of running it.')
+    parser.add_argument('--reset', action='store_true', help='Drop every table first (destroys all data).')
+    args = parser.parse_args()
+
+    engine = get_engine()
+    if args.sql:
+        for statement in schema_sql(engine.dialect):
+            print(statement + ';\n')
+    else:
+        started = time.perf_counter()
+        if args.reset:
+            print("Dropping and recreating all tables...")
+            reset(engine)
+        else:
+            upgrade(engine)
+        print(f"Schema is up to date ({time.perf_counter() - started:.1f}s).")
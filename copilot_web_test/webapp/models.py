@@ -1,10 +1,18 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Sequence
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, LargeBinary, Date, DateTime, ForeignKey, Sequence, Table, Index, func
+from sqlalchemy.orm import relationship, deferred
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import next_value
 from werkzeug.security import generate_password_hash, check_password_hash
 from .database import Base
 import datetime
 import uuid
 from flask_login import UserMixin
+from config import Config
+
+@compiles(next_value, 'sqlite')
+def _next_value_sqlite(element, compiler, **kw):
+    # SQLite has no sequences; an INTEGER PRIMARY KEY left NULL takes the next rowid
+    return 'NULL'
 
 class User(Base, UserMixin):
     __tablename__ = 'users'
@@ -23,6 +31,9 @@ class User(Base, UserMixin):
     def check_password(self, password):
         return check_password_hash(self.password, password)
 
+# The email types, as stored in emails.email_type
+EMAIL_TYPES = ['Work', 'Personal', 'Spam', 'Promotion']
+
 class Email(Base):
     __tablename__ = 'emails'
     unique_email_id = Column(String(255), primary_key=True)
@@ -30,10 +41,21 @@ class Email(Base):
     sender_name = Column(String(255))
     sender_email = Column(String(255))
     title = Column(String(255))
-    body = Column(Text)
+    # Only loaded on access, so list queries never carry it; with
+    # EMAIL_BODY_STORAGE = 'compressed' it is NULL and the body lives in
+    # email_bodies. Read it with webapp.bodies.load_body.
+    body = deferred(Column(Text))
+    # The start of the body, precomputed at ingest for list pages
+    preview = Column(String(255))
     email_type = Column(String(50), index=True)
     date_sent = Column(DateTime, index=True)
+    # The sender filters resolve to ids through the senders table; see webapp.senders
+    sender_id = Column(Integer, ForeignKey('senders.id'), index=True)
     references = Column(Text) # For storing hyperlinked references
+    # Denormalized so the has_comments / has_references filters and the
+    # "most discussed" sort can use an index; see webapp.counters
+    comment_count = Column(Integer, nullable=False, default=0, server_default='0', index=True)
+    reference_count = Column(Integer, nullable=False, default=0, server_default='0', index=True)
     comments = relationship('Comment', back_populates='email', lazy=True)
 
     user = relationship("User", back_populates="emails")
@@ -42,6 +64,40 @@ class Email(Base):
         {'extend_existing': True},
     )
 
+class EmailBody(Base):
+    """A compressed email body, kept off the emails table; see webapp.bodies."""
+    __tablename__ = 'email_bodies'
+    email_id = Column(String(255), ForeignKey('emails.unique_email_id'), primary_key=True)
+    codec = Column(String(10), nullable=False)
+    data = Column(LargeBinary, nullable=False)
+
+class Sender(Base):
+    """A distinct sender name and address, with the number of emails sent from it."""
+    __tablename__ = 'senders'
+    id_seq = Sequence('sender_id_seq', start=1, increment=1)
+    id = Column(Integer, id_seq, primary_key=True, server_default=id_seq.next_value())
+    name = Column(String(255))
+    email = Column(String(255))
+    email_count = Column(Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        Index('ix_senders_name_email', 'name', 'email'),
+    )
+
+class SenderTrigram(Base):
+    """One three-character substring of a sender's lowercased name or address."""
+    __tablename__ = 'sender_trigrams'
+    trigram = Column(String(3), primary_key=True)
+    sender_id = Column(Integer, ForeignKey('senders.id'), primary_key=True, index=True)
+
+class EmailFacetCount(Base):
+    """Emails per day, sender and type, kept up to date at ingest; see webapp.facets."""
+    __tablename__ = 'email_facet_counts'
+    day = Column(Date, primary_key=True)
+    sender_name = Column(String(255), primary_key=True)
+    email_type = Column(String(50), primary_key=True)
+    count = Column(Integer, nullable=False)
+
 class UserActivity(Base):
     __tablename__ = 'user_activity'
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
@@ -49,6 +105,33 @@ class UserActivity(Base):
     token = Column(String(36), nullable=False, index=True)
     activity = Column(String(200))
     details = Column(Text)  # To store JSON details about the activity
+    timestamp = Column(DateTime, index=True, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        # Serves the per-user activity grid and the per-user rollups
+        Index('ix_user_activity_user_timestamp', 'user_id', 'timestamp'),
+        # Range partitioned by day on Oracle when ACTIVITY_PARTITIONED is set;
+        # see webapp.activity_retention
+        {'info': {'interval_partition': 'timestamp'} if Config.ACTIVITY_PARTITIONED else {}},
+    )
+
+class ActivityRollup(Base):
+    """Daily activity counts per user and activity, kept after the raw rows are purged."""
+    __tablename__ = 'activity_rollups'
+    day = Column(Date, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True, index=True)
+    activity = Column(String(200), primary_key=True)
+    count = Column(Integer, nullable=False)
+
+class ActivityRollupLog(Base):
+    """One day of raw activity rolled up by the retention job."""
+    __tablename__ = 'activity_rollup_log'
+    id_seq = Sequence('activity_rollup_log_id_seq', start=1, increment=1)
+    id = Column(Integer, id_seq, primary_key=True, server_default=id_seq.next_value())
+    run_time = Column(DateTime, default=func.current_timestamp())
+    day = Column(Date, nullable=False)
+    rows_rolled_up = Column(Integer)
+    rollups_created = Column(Integer)
 
 class Comment(Base):
     __tablename__ = 'comments'
@@ -57,7 +140,7 @@ class Comment(Base):
     body = Column(Text, nullable=False)
     timestamp = Column(DateTime, index=True, default=datetime.datetime.utcnow)
     user_id = Column(Integer, ForeignKey('users.id'), index=True)
-    email_id = Column(String(255), ForeignKey('emails.unique_email_id'), index=True)
+    email_id = Column(String(255), ForeignKey('emails.unique_email_id'))  # Leads ix_comments_thread
     parent_id = Column(Integer, ForeignKey('comments.id'), index=True)
 
     user = relationship('User', back_populates='comments')
@@ -68,5 +151,67 @@ class Comment(Base):
         return f'<Comment {self.id}>'
 
     __table_args__ = (
+        # Top-level comments of an email (parent_id IS NULL, still indexed as
+        # email_id is set) and the replies to each one, both in time order
+        Index('ix_comments_thread', 'email_id', 'parent_id', 'timestamp'),
         {'extend_existing': True},
     )
+
+class EmailToken(Base):
+    """A posting in the full-text index: one token in one email."""
+    __tablename__ = 'email_tokens'
+    token = Column(String(64), primary_key=True)
+    email_id = Column(String(255), ForeignKey('emails.unique_email_id'), primary_key=True, index=True)
+    positions = Column(String(4000), nullable=False)  # Space-separated token offsets
+
+class EmailReference(Base):
+    """An edge of the reference graph: source_id refers to target_id."""
+    __tablename__ = 'email_references'
+    source_id = Column(String(255), ForeignKey('emails.unique_email_id'), primary_key=True)
+    # No foreign key: the target may arrive after its source; readers join emails
+    target_id = Column(String(255), primary_key=True, index=True)
+
+class ReferenceJobLog(Base):
+    """One committed chunk of the reference backfill job."""
+    __tablename__ = 'reference_job_log'
+    id_seq = Sequence('reference_job_log_id_seq', start=1, increment=1)
+    id = Column(Integer, id_seq, primary_key=True, server_default=id_seq.next_value())
+    run_time = Column(DateTime, default=func.current_timestamp())
+    max_email_id = Column(String(255))
+    emails_processed = Column(Integer)
+    links_created = Column(Integer)
+
+# --- Document link job ---
+
+class Document(Base):
+    __tablename__ = 'documents'
+    uniqid = Column(String(50), primary_key=True)
+    doctype = Column(String(20))
+    scno = Column(String(20))
+    docdate = Column(String(20))  # Use Date if stored as proper date
+    xml_text = Column(Text)
+
+document_links = Table(
+    'document_links', Base.metadata,
+    Column('source_uniqid', String(50), ForeignKey('documents.uniqid'), primary_key=True),
+    Column('target_uniqid', String(50), ForeignKey('documents.uniqid'), primary_key=True),
+    Column('ref_text', String(200))
+)
+
+class DanglingReference(Base):
+    __tablename__ = 'dangling_references'
+    id = Column(String(50), primary_key=True)
+    source_uniqid = Column(String(50))
+    ref_text = Column(String(200))
+    reason = Column(String(200))
+
+class LinkJobLog(Base):
+    """One committed chunk of the document link job."""
+    __tablename__ = 'link_job_log'
+    id_seq = Sequence('link_job_log_id_seq', start=1, increment=1)
+    id = Column(Integer, id_seq, primary_key=True, server_default=id_seq.next_value())
+    run_time = Column(DateTime, default=func.current_timestamp())
+    max_uniqid = Column(String(50))
+    docs_processed = Column(Integer)
+    links_created = Column(Integer)
+    dangling_refs = Column(Integer)
@@ -0,0 +1,113 @@
+"""
+Per-request profiling.
+
+For every request the profiler records, under the request's endpoint, the
+number of SQL statements and the time spent in them, the time spent
+rendering templates and the total latency. The numbers are kept per
+worker process and served to admins at ``/profiling``; with
+SERVER_TIMING_ENABLED the responses to the admin also carry them in a
+Server-Timing header, so they show up in the browser's network panel.
+"""
+import time
+import threading
+from contextlib import ExitStack
+from flask import g, request, request_started, request_finished, before_render_template, template_rendered
+from flask_login import current_user
+from .instrumentation import count_queries
+
+
+class Profiler:
+    def __init__(self):
+        self.server_timing = False
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def init_app(self, app):
+        if not app.config['PROFILING_ENABLED']:
+            return
+        self.server_timing = app.config['SERVER_TIMING_ENABLED']
+        request_started.connect(self._request_started, app)
+        request_finished.connect(self._request_finished, app)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.teardown_request(self._teardown)
+
+    def _request_started(self, sender, **extra):
+        g._profile_stack = ExitStack()
+        g._profile_queries = g._profile_stack.enter_context(count_queries())
+        g._profile_templates = []
+        g._profile_template_time = 0.0
+        g._profile_start = time.perf_counter()
+
+    def _before_render(self, sender, template, context, **extra):
+        if '_profile_templates' in g:
+            g._profile_templates.append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        if g.get('_profile_templates'):
+            elapsed = time.perf_counter() - g._profile_templates.pop()
+            # Only count the outermost render; nested renders are part of it
+            if not g._profile_templates:
+                g._profile_template_time += elapsed
+
+    def _request_finished(self, sender, response, **extra):
+        if '_profile_start' not in g:
+            return
+        total = time.perf_counter() - g._profile_start
+        counter = g._profile_queries
+        g._profile_stack.close()
+        self._record(request.endpoint or 'unmatched', counter.count, counter.duration,
+                     g._profile_template_time, total)
+
+        # Query counts and timings are for the admin only, as /profiling is
+        if self.server_timing and current_user.is_authenticated and current_user.username == 'admin':
+            response.headers['Server-Timing'] = (
+                f'sql;dur={counter.duration * 1000:.1f};desc="{counter.count} queries", '
+                f'tpl;dur={g._profile_template_time * 1000:.1f}, '
+                f'total;dur={total * 1000:.1f}'
+            )
+
+    def _teardown(self, exception=None):
+        # The request failed before it finished; stop counting its queries
+        stack = g.pop('_profile_stack', None)
+        if stack is not None:
+            stack.close()
+
+    def _record(self, endpoint, queries, sql_time, template_time, total):
+        with self._lock:
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                stats = self._stats[endpoint] = {
+                    'requests': 0, 'queries': 0, 'sql_time': 0.0,
+                    'template_time': 0.0, 'total_time': 0.0, 'max_time': 0.0,
+                }
+            stats['requests'] += 1
+            stats['queries'] += queries
+            stats['sql_time'] += sql_time
+            stats['template_time'] += template_time
+            stats['total_time'] += total
+            if total > stats['max_time']:
+                stats['max_time'] = total
+
+    def snapshot(self):
+        """Returns per-endpoint totals and per-request averages, slowest endpoints first."""
+        with self._lock:
+            endpoints = []
+            for endpoint, stats in self._stats.items():
+                requests = stats['requests']
+                endpoints.append(dict(
+                    stats,
+                    endpoint=endpoint,
+                    avg_queries=stats['queries'] / requests,
+                    avg_sql_time=stats['sql_time'] / requests,
+                    avg_template_time=stats['template_time'] / requests,
+                    avg_time=stats['total_time'] / requests,
+                ))
+        return sorted(endpoints, key=lambda stats: stats['total_time'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+profiler = Profiler()
@@ -0,0 +1,177 @@
+"""
+The email reference graph.
+
+References between emails are stored as edges in ``email_references`` when
+emails are ingested, so opening an email looks its references up by key
+instead of scanning the body. Every reference is stored, including those to
+emails that are not stored yet; reads join the edges to ``emails``, so a
+link shows up as soon as its target arrives. ``python -m webapp.references``
+backfills the edges for emails that were stored before the table existed;
+like the document link job it resumes after the last chunk it committed.
+Databases whose edges were written before references to missing emails were
+kept need ``--full`` once.
+"""
+import re
+import time
+import argparse
+from markupsafe import escape, Markup
+from sqlalchemy import select, insert, delete, inspect, text
+from .models import Email, EmailReference, ReferenceJobLog
+from .bodies import body_select, with_bodies, load_body
+from .cache import TTLCache
+from .result_cache import result_cache
+from config import Config
+
+REFERENCE_PATTERN = re.compile(r'[a-zA-Z0-9]+-\d{2}-\d{4,}')
+# Oracle rejects IN lists with more than 1000 expressions
+IN_CLAUSE_LIMIT = 1000
+
+linked_body_cache = TTLCache(maxsize=Config.LINKED_BODY_CACHE_SIZE, ttl=Config.LINKED_BODY_CACHE_TTL)
+
+
+def extract_reference_ids(references, body):
+    """Returns the ids an email refers to, from its references column and its body."""
+    found = set()
+    if references:
+        found.update(ref.strip() for ref in references.split(',') if ref.strip())
+    if body:
+        found.update(REFERENCE_PATTERN.findall(body))
+    return found
+
+
+def link_emails(session, emails, replace=False):
+    """
+    Records the reference edges of (email_id, references, body) tuples,
+    also those to emails that do not exist yet. The caller is responsible
+    for committing.
+    """
+    candidates = {}
+    for email_id, references, body in emails:
+        targets = extract_reference_ids(references, body)
+        targets.discard(email_id)
+        candidates[email_id] = targets
+
+    if replace:
+        source_ids = list(candidates)
+        for i in range(0, len(source_ids), IN_CLAUSE_LIMIT):
+            session.execute(delete(EmailReference).where(
+                EmailReference.source_id.in_(source_ids[i:i + IN_CLAUSE_LIMIT])))
+
+    rows = [
+        {'source_id': source_id, 'target_id': target_id}
+        for source_id, targets in candidates.items()
+        for target_id in sorted(targets)
+    ]
+    if rows:
+        session.execute(insert(EmailReference.__table__), rows)
+    return len(rows)
+
+
+def drop_target_foreign_key(engine):
+    """
+    Drops the foreign key from email_references.target_id to emails that
+    older databases have, as edges may now point at emails not stored yet.
+    SQLite does not enforce it and cannot drop it, so it is left there.
+    """
+    if engine.dialect.name == 'sqlite':
+        return
+    for foreign_key in inspect(engine).get_foreign_keys(EmailReference.__tablename__):
+        if [column.lower() for column in foreign_key['constrained_columns']] == ['target_id'] and foreign_key['name']:
+            with engine.begin() as connection:
+                connection.execute(text(
+                    f"ALTER TABLE {EmailReference.__tablename__} DROP CONSTRAINT {foreign_key['name']}"))
+
+
+def backfill_references(session, chunk_size=1000, full=False):
+    """
+    Links emails in id order, committing each chunk together with a
+    ReferenceJobLog row, so a rerun continues after the last committed chunk.
+    With ``full`` every email is relinked from the start.
+    """
+    last_id = None
+    if full:
+        session.execute(delete(EmailReference))
+        session.commit()
+    else:
+        last_id = session.execute(
+            select(ReferenceJobLog.max_email_id).order_by(ReferenceJobLog.id.desc()).limit(1)
+        ).scalar()
+
+    emails_done = 0
+    links_done = 0
+    while True:
+        stmt = body_select(Email.unique_email_id, Email.references).order_by(Email.unique_email_id)
+        if last_id is not None:
+            stmt = stmt.where(Email.unique_email_id > last_id)
+        chunk = with_bodies(session.execute(stmt.limit(chunk_size)).all())
+        if not chunk:
+            break
+
+        links = link_emails(session, chunk, replace=True)
+        last_id = chunk[-1][0]
+        session.add(ReferenceJobLog(max_email_id=last_id, emails_processed=len(chunk), links_created=links))
+        session.commit()
+
+        emails_done += len(chunk)
+        links_done += links
+
+    return emails_done, links_done
+
+
+def get_referenced_emails(email_id):
+    """Returns the emails that email_id refers to, via the edge table."""
+    return (
+        Email.query
+        .join(EmailReference, EmailReference.target_id == Email.unique_email_id)
+        .filter(EmailReference.source_id == email_id)
+        .order_by(Email.unique_email_id)
+        .all()
+    )
+
+
+def _reference_link(unique_id):
+    # Toggles the collapse element of the reference in the side panel
+    return (
+        f'<a href="#collapse-{unique_id}" '
+        f'data-bs-toggle="collapse" '
+        f'aria-expanded="false" '
+        f'aria-controls="collapse-{unique_id}">'
+        f'{unique_id}</a>'
+    )
+
+
+def linked_body(session, email_id, target_ids):
+    """
+    Returns the email body as HTML with every reference to one of
+    target_ids turned into a link, in a single regex pass. The result is
+    cached per email and result cache generation, so a cached email's body
+    is not read again.
+    """
+    cache_key = (result_cache.generation(), email_id, frozenset(target_ids))
+    html = linked_body_cache.get(cache_key)
+    if html is not None:
+        return html
+
+    escaped = str(escape(load_body(session, email_id) or ''))
+    if target_ids:
+        escaped = REFERENCE_PATTERN.sub(
+            lambda match: _reference_link(match.group(0)) if match.group(0) in target_ids else match.group(0),
+            escaped,
+        )
+    html = Markup(escaped)
+    linked_body_cache.set(cache_key, html)
+    return html
+
+
+if __name__ == '__main__':
+    from .database import db_session
+
+    parser = argparse.ArgumentParser(description='Backfill the email reference graph.')
+    parser.add_argument('--full', action='store_true', help='Relink every email instead of resuming.')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Emails linked per transaction.')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    emails, links = backfill_references(db_session, chunk_size=args.chunk_size, full=args.full)
+    elapsed = time.perf_counter() - started
+    print(f"Linked {emails} emails ({links} references) in {elapsed:.1f}s.")
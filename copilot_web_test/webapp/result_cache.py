@@ -0,0 +1,254 @@
+"""
+Cached search result sets.
+
+A search result set is stored whole, in display order, as light rows
+holding only the columns the result grid shows. Every page of a repeated
+query, forwards or backwards, is then sliced from the cache without a
+database round trip. Result sets larger than RESULT_CACHE_MAX_ROWS are
+not cached.
+
+Two stores are available. 'memory' is a per-worker LRU bounded by
+RESULT_CACHE_MAX_BYTES. 'file' keeps pickled entries in RESULT_CACHE_DIR,
+which all uWSGI workers on the host share; point it at /dev/shm to keep
+it in memory. Both are keyed by a generation number that is bumped
+whenever emails or comments are inserted, so stale result sets are never
+read again and age out of the store. The generation is only shared
+through 'file': with 'memory' an insert invalidates the results of its
+own process, and every other worker serves its cached results until
+RESULT_CACHE_TTL. Without RESULT_CACHE_BACKEND, workers of a uWSGI server
+with more than one process use 'file'.
+"""
+import os
+import time
+import pickle
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class MemoryStore:
+    """A per-worker LRU bounded by the pickled size of its entries."""
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.generation = 0
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return None
+            expires_at, size, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, size):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._data:
+                _, (_, evicted_size, _) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def get_generation(self):
+        return self.generation
+
+    def bump_generation(self):
+        with self._lock:
+            self.generation += 1
+            # Entries of older generations can never be read again
+            self._data.clear()
+            self._bytes = 0
+
+    def clear(self):
+        self.bump_generation()
+
+
+class FileStore:
+    """
+    Pickled entries in a directory shared by every worker on the host. The
+    generation lives in a file of its own so an insert in one worker (or
+    in a seeding script) invalidates the results of all of them.
+    """
+    def __init__(self, directory, max_bytes, ttl):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+        self._generation_path = os.path.join(directory, 'generation')
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.pkl')
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                return None
+            with open(path, 'rb') as f:
+                stored_key, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # Guard against digest collisions
+        return value if stored_key == key else None
+
+    def set(self, key, value, size):
+        self._write(self._path(key), pickle.dumps((key, value), protocol=pickle.HIGHEST_PROTOCOL))
+        self._prune()
+
+    def _prune(self):
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith('.pkl'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        # Oldest first
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def get_generation(self):
+        try:
+            with open(self._generation_path) as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def bump_generation(self):
+        self._write(self._generation_path, str(self.get_generation() + 1).encode())
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+        self.bump_generation()
+
+
+def default_backend():
+    """'file' in a uWSGI server with several worker processes, which must share invalidations; else 'memory'."""
+    try:
+        import uwsgi
+    except ImportError:
+        return 'memory'
+    return 'file' if uwsgi.numproc > 1 else 'memory'
+
+
+class ResultCache:
+    def __init__(self):
+        self.enabled = False
+        self.max_rows = 10000
+        self.backend = None
+        self.store = None
+
+    def init_app(self, app):
+        self.configure(app.config)
+
+    def configure(self, config):
+        """Sets the cache up from a config mapping (the Flask config, or Config.__dict__ in scripts)."""
+        self.enabled = config['RESULT_CACHE_ENABLED']
+        self.max_rows = config['RESULT_CACHE_MAX_ROWS']
+        self.backend = config['RESULT_CACHE_BACKEND'] or default_backend()
+        if self.backend == 'file':
+            self.store = FileStore(config['RESULT_CACHE_DIR'], config['RESULT_CACHE_MAX_BYTES'], config['RESULT_CACHE_TTL'])
+        else:
+            self.store = MemoryStore(config['RESULT_CACHE_MAX_BYTES'], config['RESULT_CACHE_TTL'])
+
+    def get(self, key, generation=None):
+        """Returns the cached rows for key in generation (by default the current one), or None."""
+        if not self.enabled:
+            return None
+        if generation is None:
+            generation = self.store.get_generation()
+        rows = self.store.get((generation, key))
+        metrics.incr('result_cache.hit' if rows is not None else 'result_cache.miss')
+        return rows
+
+    def set(self, key, rows, generation):
+        """
+        Stores rows for key under generation, which the caller read before
+        running the queries behind them. Rows loaded while an insert
+        bumped the generation are then filed under the old one and never
+        read.
+        """
+        if not self.enabled or len(rows) > self.max_rows:
+            return
+        size = len(pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL))
+        self.store.set((generation, key), rows, size)
+
+    def generation(self):
+        """A number that changes whenever emails or comments have been inserted."""
+        return self.store.get_generation() if self.store is not None else 0
+
+    def invalidate(self):
+        """
+        Forgets every cached result set; call after inserting emails or
+        comments. With the 'memory' store only this process's results are
+        forgotten.
+        """
+        if self.store is not None:
+            self.store.bump_generation()
+            metrics.incr('result_cache.invalidated')
+
+
+result_cache = ResultCache()
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_new_results(session, flush_context):
+    from .models import Email, Comment
+    if any(isinstance(obj, (Email, Comment)) for obj in session.new):
+        session.info['result_cache_stale'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('result_cache_stale', False):
+        result_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('result_cache_stale', None)
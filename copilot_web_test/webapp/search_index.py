@@ -0,0 +1,308 @@
+"""
+Inverted full-text index over email titles and bodies.
+
+Every row in ``email_tokens`` is a posting: a token, the email it occurs in
+and the positions where it occurs. Searches are answered from the posting
+lists of the query tokens instead of scanning ``emails.body``. A token that
+occurs too often in one email for its positions to fit the column keeps
+the leading ones and is marked as truncated; phrases that may lie past the
+cut are checked against the email itself.
+
+Run ``python -m webapp.search_index`` to index emails that are missing from
+the index, or ``python -m webapp.search_index --rebuild`` to start over.
+"""
+import re
+import time
+import argparse
+from sqlalchemy import select, insert, delete, func, or_, and_, false, bindparam, String, Integer
+from .models import Email, EmailToken
+from .bodies import body_select, with_bodies
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+MAX_TOKEN_LENGTH = 64
+MAX_POSITIONS_LENGTH = 4000
+# Ends a positions list that was cut to fit MAX_POSITIONS_LENGTH
+TRUNCATED = '+'
+# Oracle rejects IN lists with more than 1000 expressions
+IN_CLAUSE_LIMIT = 1000
+IN_LIST_BUCKETS = (8, 16, 32, 64, 128, 256, 512, IN_CLAUSE_LIMIT)
+
+
+def tokenize(text):
+    """Splits text into lowercase alphanumeric tokens."""
+    if not text:
+        return []
+    return [token[:MAX_TOKEN_LENGTH] for token in TOKEN_PATTERN.findall(text.lower())]
+
+
+def _encode_positions(positions):
+    encoded = ' '.join(str(position) for position in positions)
+    if len(encoded) > MAX_POSITIONS_LENGTH:
+        encoded = encoded[:MAX_POSITIONS_LENGTH - len(TRUNCATED) - 1].rsplit(' ', 1)[0] + ' ' + TRUNCATED
+    return encoded
+
+
+def _decode_positions(encoded):
+    """Returns (positions, truncated) for a stored positions list."""
+    values = encoded.split()
+    truncated = bool(values) and values[-1] == TRUNCATED
+    if truncated:
+        values.pop()
+    return {int(value) for value in values}, truncated
+
+
+def build_postings(email_id, title, body):
+    """Returns the posting rows for a single email."""
+    positions = {}
+    offset = 0
+    for text in (title, body):
+        tokens = tokenize(text)
+        for i, token in enumerate(tokens):
+            positions.setdefault(token, []).append(offset + i)
+        # Leave a gap so a phrase never spans the title and the body
+        offset += len(tokens) + 1
+
+    return [
+        {'token': token, 'email_id': email_id, 'positions': _encode_positions(token_positions)}
+        for token, token_positions in positions.items()
+    ]
+
+
+def index_emails(session, emails, replace=True):
+    """
+    Adds (email_id, title, body) tuples to the index. With ``replace`` any
+    postings those emails already have are dropped first; pass False for
+    emails that are known to be new. The caller is responsible for committing.
+    """
+    emails = list(emails)
+    if not emails:
+        return 0
+
+    if replace:
+        remove_emails(session, [email_id for email_id, _, _ in emails])
+
+    rows = []
+    for email_id, title, body in emails:
+        rows.extend(build_postings(email_id, title, body))
+    if rows:
+        session.execute(insert(EmailToken.__table__), rows)
+    return len(rows)
+
+
+def remove_emails(session, email_ids):
+    """Drops the postings of the given emails."""
+    email_ids = list(email_ids)
+    for i in range(0, len(email_ids), IN_CLAUSE_LIMIT):
+        session.execute(delete(EmailToken).where(EmailToken.email_id.in_(email_ids[i:i + IN_CLAUSE_LIMIT])))
+
+
+def build_index(session, rebuild=False, chunk_size=1000):
+    """
+    Indexes every email that has no postings yet, committing once per chunk.
+    With ``rebuild`` the whole index is dropped and recreated.
+    """
+    if rebuild:
+        session.execute(delete(EmailToken))
+        session.commit()
+
+    # Read the pending ids up front so the inserts below never race an open cursor
+    indexed = select(EmailToken.email_id).distinct()
+    pending = session.execute(
+        select(Email.unique_email_id)
+        .where(Email.unique_email_id.not_in(indexed))
+        .order_by(Email.unique_email_id)
+    ).scalars().all()
+
+    emails_done = 0
+    postings_done = 0
+    for i in range(0, len(pending), chunk_size):
+        chunk_ids = pending[i:i + chunk_size]
+        rows = with_bodies(session.execute(
+            body_select(Email.unique_email_id, Email.title).where(_in_ids(chunk_ids))
+        ).all())
+        postings_done += index_emails(session, rows, replace=False)
+        session.commit()
+        emails_done += len(rows)
+
+    return emails_done, postings_done
+
+
+def _in_ids(ids):
+    ids = list(ids)
+    if not ids:
+        return false()
+    return or_(*[
+        Email.unique_email_id.in_(ids[i:i + IN_CLAUSE_LIMIT])
+        for i in range(0, len(ids), IN_CLAUSE_LIMIT)
+    ])
+
+
+def _has_phrase(positions_by_token, tokens):
+    starts = positions_by_token[tokens[0]]
+    for offset, token in enumerate(tokens[1:], 1):
+        positions = positions_by_token[token]
+        starts = {start for start in starts if start + offset in positions}
+        if not starts:
+            return False
+    return bool(starts)
+
+
+def _text_has_phrase(tokens, texts):
+    size = len(tokens)
+    for text in texts:
+        text_tokens = tokenize(text)
+        if any(text_tokens[i:i + size] == tokens for i in range(len(text_tokens) - size + 1)):
+            return True
+    return False
+
+
+def _emails_with_phrase(session, email_ids, tokens):
+    """The ids among email_ids whose title or body contains the tokens consecutively, read from the emails."""
+    found = []
+    for i in range(0, len(email_ids), IN_CLAUSE_LIMIT):
+        rows = with_bodies(session.execute(
+            body_select(Email.unique_email_id, Email.title)
+            .where(Email.unique_email_id.in_(email_ids[i:i + IN_CLAUSE_LIMIT]))
+        ).all())
+        found.extend(email_id for email_id, title, body in rows if _text_has_phrase(tokens, (title, body)))
+    return found
+
+
+def phrase_email_ids(session, tokens, limit=None):
+    """
+    Returns the ids of emails in which the tokens occur consecutively, or
+    None if more than limit emails contain all of them; the postings of
+    that many emails are not worth reading. An email whose postings for
+    the phrase are truncated and do not show it is checked against its
+    title and body.
+    """
+    tokens = list(tokens)
+    wanted = set(tokens)
+    # Only emails that contain every token can contain the phrase
+    candidates = (
+        select(EmailToken.email_id)
+        .where(EmailToken.token.in_(wanted))
+        .group_by(EmailToken.email_id)
+        .having(func.count() == len(wanted))
+    )
+    if limit is not None:
+        candidates = candidates.limit(limit + 1)
+    candidate_ids = session.execute(candidates).scalars().all()
+    if limit is not None and len(candidate_ids) > limit:
+        return None
+
+    postings = {}
+    truncated = set()
+    for i in range(0, len(candidate_ids), IN_CLAUSE_LIMIT):
+        rows = session.execute(
+            select(EmailToken.email_id, EmailToken.token, EmailToken.positions)
+            .where(EmailToken.token.in_(wanted), EmailToken.email_id.in_(candidate_ids[i:i + IN_CLAUSE_LIMIT]))
+        )
+        for email_id, token, positions in rows:
+            decoded, cut = _decode_positions(positions)
+            postings.setdefault(email_id, {})[token] = decoded
+            if cut:
+                truncated.add(email_id)
+
+    found = []
+    unsure = []
+    for email_id, positions_by_token in postings.items():
+        if _has_phrase(positions_by_token, tokens):
+            found.append(email_id)
+        elif email_id in truncated:
+            unsure.append(email_id)
+    if unsure:
+        found.extend(_emails_with_phrase(session, unsure, tokens))
+    return found
+
+
+def pad_in_list(values):
+    """
+    Pads a list for an expanding IN parameter to the next bucket length by
+    repeating its last value, so the rendered SQL text, and the database's
+    cursor cache entry for it, only changes in a few steps.
+    """
+    values = list(values)
+    if not values:
+        return values
+    size = next((bucket for bucket in IN_LIST_BUCKETS if bucket >= len(values)), len(values))
+    return values + [values[-1]] * (size - len(values))
+
+
+def prefix_params(prefixes, name, params):
+    """Adds the token range of each prefix to params as {name}_lo{i} and {name}_hi{i}."""
+    for i, prefix in enumerate(prefixes):
+        # A range rather than LIKE so every backend can use the token index
+        params[f'{name}_lo{i}'] = prefix
+        params[f'{name}_hi{i}'] = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def token_frequencies(session, tokens):
+    """Returns {token: number of emails containing it} for the given tokens; absent tokens count 0."""
+    tokens = sorted(set(tokens))
+    frequencies = dict.fromkeys(tokens, 0)
+    for i in range(0, len(tokens), IN_CLAUSE_LIMIT):
+        rows = session.execute(
+            select(EmailToken.token, func.count())
+            .where(EmailToken.token.in_(tokens[i:i + IN_CLAUSE_LIMIT]))
+            .group_by(EmailToken.token)
+        )
+        frequencies.update(rows.all())
+    return frequencies
+
+
+def any_tokens_filter(name, has_tokens, prefix_count):
+    """Emails containing any of the tokens bound as {name}_tokens, or a token in one of the prefix ranges."""
+    conditions = []
+    if has_tokens:
+        conditions.append(EmailToken.token.in_(bindparam(f'{name}_tokens', expanding=True)))
+    for i in range(prefix_count):
+        conditions.append(and_(EmailToken.token >= bindparam(f'{name}_lo{i}', type_=String),
+                               EmailToken.token < bindparam(f'{name}_hi{i}', type_=String)))
+    return Email.unique_email_id.in_(select(EmailToken.email_id).where(or_(*conditions)))
+
+
+def all_tokens_filter(name):
+    """
+    Emails containing every token bound as {name}_tokens, whose number of
+    distinct tokens is bound as {name}_count; one probe of the index for
+    the whole conjunction.
+    """
+    return Email.unique_email_id.in_(
+        select(EmailToken.email_id)
+        .where(EmailToken.token.in_(bindparam(f'{name}_tokens', expanding=True)))
+        .group_by(EmailToken.email_id)
+        .having(func.count() == bindparam(f'{name}_count', type_=Integer))
+    )
+
+
+def ids_filter(name, chunk_count):
+    """Emails whose ids are bound as {name}_ids0, {name}_ids1, ..., one IN list per chunk."""
+    if not chunk_count:
+        return false()
+    return or_(*[
+        Email.unique_email_id.in_(bindparam(f'{name}_ids{i}', expanding=True))
+        for i in range(chunk_count)
+    ])
+
+
+def ids_params(ids, name, params):
+    """Adds the ids for ids_filter to params and returns the number of chunks."""
+    chunks = [ids[i:i + IN_CLAUSE_LIMIT] for i in range(0, len(ids), IN_CLAUSE_LIMIT)]
+    for i, chunk in enumerate(chunks):
+        params[f'{name}_ids{i}'] = pad_in_list(chunk)
+    return len(chunks)
+
+
+if __name__ == '__main__':
+    from .database import db_session
+
+    parser = argparse.ArgumentParser(description='Build the full-text search index.')
+    parser.add_argument('--rebuild', action='store_true', help='Drop the index and index every email again.')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Emails indexed per transaction.')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    emails, postings = build_index(db_session, rebuild=args.rebuild, chunk_size=args.chunk_size)
+    elapsed = time.perf_counter() - started
+    print(f"Indexed {emails} emails ({postings} postings) in {elapsed:.1f}s.")
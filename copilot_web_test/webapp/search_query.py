@@ -0,0 +1,520 @@
+"""
+The search query language.
+
+    market policy                 either word
+    "annual budget"               the exact phrase
+    manag*                        words starting with manag
+    market AND policy             both words
+    market OR NOT policy          boolean operators, upper case only
+    -spam                         short for NOT spam
+    (film OR data) AND -draft     grouping
+    from:alice                    sender name or address contains alice
+    type:Work                     email type is Work
+    title:budget                  title contains budget
+    id:Sender01-24-1000           email id; id:Sender01-24-* for a prefix
+    after:2024-01-01              sent on or after the date
+    before:2024-07-01             sent before the date
+
+Words and phrases are matched against the full-text index of titles and
+bodies (SEARCH_USE_INDEX), which holds whole words: ``market`` finds
+"market" and "Market," but not "marketing" or "supermarket"; ``market*``
+finds the words starting with market. Without the index they match any
+substring of the body, as plain searches did before it, so ``the`` then
+also finds "other".
+
+AND binds tighter than OR. Items written next to each other without an
+operator keep the meaning plain searches always had: the bare words are
+alternatives, and every other item (phrases, field qualifiers, negations,
+groups) must also match. So ``market policy "annual budget" -draft`` is
+(market OR policy) AND "annual budget" AND NOT draft. The parser is
+forgiving: stray parentheses and dangling operators are ignored rather
+than reported.
+
+parse_query turns a query into a normalized AST of hashable tuples and is
+memoized. plan_query reduces the AST to (shape, params) the way
+search_plan reduces the other filters: the shape describes the predicate
+without its values, so queries that differ only in their words share one
+cached statement. Planning looks up the document frequency of each word
+to put the most selective predicates first, to answer a conjunction of
+words with one probe of the index and to skip words that occur nowhere.
+A phrase is resolved to the ids of the emails holding it from the
+positions in the index, unless its words occur together in more than
+SEARCH_PHRASE_CANDIDATE_LIMIT emails; it is then matched with an ILIKE
+over the emails that hold every word.
+"""
+import re
+from datetime import datetime, time
+from sqlalchemy import select, or_, and_, false, func, bindparam, DateTime
+from .models import Email, EMAIL_TYPES
+from .cache import TTLCache
+from .result_cache import result_cache
+from . import search_index
+from config import Config
+
+OPERATORS = ('AND', 'OR', 'NOT')
+# Anything longer is cut off, so one request cannot build an unbounded statement
+MAX_QUERY_ITEMS = 64
+
+# Rough share of the emails a field qualifier matches, for ordering only
+FIELD_SELECTIVITY = {'id': 0.0001, 'from': 0.05, 'title': 0.05, 'type': 0.25, 'before': 0.5, 'after': 0.5}
+
+_LEXEME = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<lparen>\()
+  | (?P<rparen>\))
+  | (?P<field>(?P<name>from|type|title|id|before|after):(?:"(?P<quoted>[^"]*)"?|(?P<value>[^\s()"]+)))
+  | (?P<phrase>"(?P<text>[^"]*)"?)
+  | (?P<minus>-(?=[^\s-]))
+  | (?P<word>[^\s()"]+)
+''', re.VERBOSE | re.IGNORECASE)
+
+# type: is written in any case but compared with the stored spelling, so ix_emails_email_type serves it
+EMAIL_TYPE_NAMES = {name.lower(): name for name in EMAIL_TYPES}
+
+NOTHING = ('nothing',)
+EVERYTHING = ('everything',)
+
+parse_cache = TTLCache(maxsize=Config.SEARCH_PARSE_CACHE_SIZE, ttl=Config.STATEMENT_CACHE_TTL)
+
+# Document frequencies keyed by (result cache generation, token), so they
+# are looked up again once emails have been added
+frequency_cache = TTLCache(maxsize=Config.SEARCH_FREQUENCY_CACHE_SIZE, ttl=Config.STATEMENT_CACHE_TTL)
+
+# The ids of the emails containing a phrase, or None for a phrase whose
+# words occur together in more than SEARCH_PHRASE_CANDIDATE_LIMIT emails,
+# keyed by (result cache generation, phrase tokens): the positional check
+# runs once per phrase rather than on every page and facet request
+phrase_cache = TTLCache(maxsize=Config.SEARCH_PHRASE_CACHE_SIZE, ttl=Config.STATEMENT_CACHE_TTL)
+
+
+def _lex(query):
+    items = []
+    for match in _LEXEME.finditer(query):
+        kind = match.lastgroup
+        if kind == 'space':
+            continue
+        if kind == 'field':
+            value = match.group('quoted') if match.group('quoted') is not None else match.group('value')
+            items.append(('field', (match.group('name').lower(), value)))
+        elif kind == 'phrase':
+            items.append(('phrase', match.group('text')))
+        elif kind == 'minus':
+            items.append(('op', 'NOT'))
+        elif kind == 'word' and match.group() in OPERATORS:
+            items.append(('op', match.group()))
+        else:
+            items.append((kind, match.group()))
+        if len(items) >= MAX_QUERY_ITEMS:
+            break
+    return items
+
+
+def _text(text, prefix=False):
+    text = text.strip().lower()
+    if prefix:
+        text = text.rstrip('*')
+    return ('text', text, prefix) if text else None
+
+
+def _field(name, value):
+    value = value.strip()
+    if not value:
+        return None
+    if name in ('before', 'after'):
+        try:
+            value = datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            return None
+    elif name == 'type':
+        value = EMAIL_TYPE_NAMES.get(value.lower(), value)
+    elif name != 'id':
+        value = value.lower()
+    return ('field', name, value)
+
+
+def _combine(op, children):
+    flat = []
+    for child in children:
+        if child is None:
+            continue
+        if child[0] == op:
+            flat.extend(child[1])
+        else:
+            flat.append(child)
+    # Sorted so that equivalent queries share one AST, and one cache entry
+    unique = sorted(set(flat), key=repr)
+    if not unique:
+        return None
+    if len(unique) == 1:
+        return unique[0]
+    return (op, tuple(unique))
+
+
+def _negate(node):
+    if node is None:
+        return None
+    if node[0] == 'not':
+        return node[1]
+    return ('not', node)
+
+
+class _Parser:
+    def __init__(self, items):
+        self.items = items
+        self.pos = 0
+
+    def _peek(self):
+        return self.items[self.pos] if self.pos < len(self.items) else (None, None)
+
+    def sequence(self, in_group=False):
+        alternatives = []
+        required = []
+        while self.pos < len(self.items):
+            kind, value = self._peek()
+            if kind == 'rparen':
+                if in_group:
+                    break
+                self.pos += 1
+                continue
+            if kind == 'op' and value != 'NOT':
+                # An operator with nothing on its left
+                self.pos += 1
+                continue
+            node, bare = self.disjunction()
+            if node is not None:
+                (alternatives if bare else required).append(node)
+        return _combine('and', required + [_combine('or', alternatives)])
+
+    def disjunction(self):
+        node, bare = self.conjunction()
+        while self._peek() == ('op', 'OR'):
+            self.pos += 1
+            right, _ = self.conjunction()
+            node = _combine('or', [node, right])
+            bare = False
+        return node, bare
+
+    def conjunction(self):
+        node, bare = self.unary()
+        while self._peek() == ('op', 'AND'):
+            self.pos += 1
+            right, _ = self.unary()
+            node = _combine('and', [node, right])
+            bare = False
+        return node, bare
+
+    def unary(self):
+        if self._peek() == ('op', 'NOT'):
+            self.pos += 1
+            node, _ = self.unary()
+            return _negate(node), False
+        return self.atom()
+
+    def atom(self):
+        kind, value = self._peek()
+        if kind in (None, 'rparen', 'op'):
+            return None, False
+        self.pos += 1
+        if kind == 'lparen':
+            node = self.sequence(in_group=True)
+            if self._peek()[0] == 'rparen':
+                self.pos += 1
+            return node, False
+        if kind == 'phrase':
+            return _text(value), False
+        if kind == 'field':
+            return _field(*value), False
+        return _text(value, prefix=value.endswith('*')), True
+
+
+def parse_query(query):
+    """
+    Parses a search query into its AST, or None if it has no conditions.
+    Nodes are ('text', text, is_prefix), ('field', name, value),
+    ('not', node), ('and', nodes) and ('or', nodes).
+    """
+    query = query or ''
+    node = parse_cache.get(query, EVERYTHING)
+    if node is EVERYTHING:
+        node = _Parser(_lex(query)).sequence()
+        parse_cache.set(query, node)
+    return node
+
+
+def _text_tokens(node):
+    """The single token of a plain text node, or None if it is a phrase or has no searchable characters."""
+    tokens = search_index.tokenize(node[1])
+    return tokens[0] if len(tokens) == 1 else None
+
+
+class _Planner:
+    """Plans one AST; each plan method returns (shape, estimated share of emails matched) or None."""
+    def __init__(self, session, use_index, estimate):
+        self.session = session
+        self.use_index = use_index
+        self.estimate = estimate and use_index
+        self.params = {}
+        self.frequencies = {}
+        self.total = 1
+        self._names = 0
+
+    def _name(self):
+        name = f'q{self._names}'
+        self._names += 1
+        return name
+
+    def load_frequencies(self, node):
+        tokens = set()
+        self._collect_tokens(node, tokens)
+        if not tokens:
+            return
+        generation = result_cache.generation()
+        missing = []
+        for token in tokens:
+            frequency = frequency_cache.get((generation, token))
+            if frequency is None:
+                missing.append(token)
+            else:
+                self.frequencies[token] = frequency
+        total = frequency_cache.get((generation, None))
+        if missing:
+            for token, frequency in search_index.token_frequencies(self.session, missing).items():
+                frequency_cache.set((generation, token), frequency)
+                self.frequencies[token] = frequency
+        if total is None:
+            total = self.session.execute(select(func.count(Email.unique_email_id))).scalar()
+            frequency_cache.set((generation, None), total)
+        self.total = max(total, 1)
+
+    def _collect_tokens(self, node, tokens):
+        if node[0] == 'text':
+            token = _text_tokens(node)
+            if token is not None and not node[2]:
+                tokens.add(token)
+        elif node[0] == 'not':
+            self._collect_tokens(node[1], tokens)
+        elif node[0] in ('and', 'or'):
+            for child in node[1]:
+                self._collect_tokens(child, tokens)
+
+    def _share(self, token):
+        if not self.estimate:
+            return 1.0
+        return self.frequencies.get(token, 0) / self.total
+
+    def plan(self, node):
+        kind = node[0]
+        if kind == 'text':
+            return self._text(node)
+        if kind == 'field':
+            return self._field(node)
+        if kind == 'not':
+            planned = self.plan(node[1])
+            if planned is None:
+                return None
+            shape, share = planned
+            if shape is NOTHING:
+                return EVERYTHING, 1.0
+            if shape is EVERYTHING:
+                return NOTHING, 0.0
+            return ('not', shape), 1.0 - share
+        if kind == 'and':
+            return self._conjunction(node[1])
+        return self._disjunction(node[1])
+
+    def _any_tokens(self, tokens, prefixes):
+        if self.estimate:
+            tokens = [token for token in tokens if self.frequencies.get(token, 0)]
+            if not tokens and not prefixes:
+                return NOTHING, 0.0
+        name = self._name()
+        if tokens:
+            self.params[f'{name}_tokens'] = search_index.pad_in_list(sorted(set(tokens)))
+        search_index.prefix_params(prefixes, name, self.params)
+        # A prefix can match any number of words, so it is assumed to match everything
+        share = 1.0 if prefixes else min(1.0, sum(self._share(token) for token in tokens))
+        return ('any', name, bool(tokens), len(prefixes)), share
+
+    def _all_tokens(self, tokens):
+        tokens = sorted(set(tokens))
+        if self.estimate and not all(self.frequencies.get(token, 0) for token in tokens):
+            return NOTHING, 0.0
+        name = self._name()
+        self.params[f'{name}_tokens'] = search_index.pad_in_list(tokens)
+        self.params[f'{name}_count'] = len(tokens)
+        return ('all', name), min(self._share(token) for token in tokens)
+
+    def _text(self, node):
+        _, text, prefix = node
+        if not self.use_index:
+            name = self._name()
+            self.params[name] = f'%{text}%'
+            # Body scans go last in a conjunction
+            return ('like', name), 1.0
+
+        tokens = search_index.tokenize(text)
+        if not tokens:
+            return None
+        if len(tokens) == 1:
+            return self._any_tokens([] if prefix else tokens, tokens if prefix else [])
+        ids = self._phrase_ids(tuple(tokens))
+        if ids is None:
+            return self._common_phrase(tokens)
+        if not ids:
+            return NOTHING, 0.0
+        name = self._name()
+        return ('ids', name, search_index.ids_params(ids, name, self.params)), len(ids) / self.total
+
+    def _phrase_ids(self, tokens):
+        # Resolved to email ids up front, and reused until emails or comments are added
+        key = (result_cache.generation(), tokens)
+        ids = phrase_cache.get(key, False)
+        if ids is False:
+            ids = search_index.phrase_email_ids(self.session, tokens, Config.SEARCH_PHRASE_CANDIDATE_LIMIT)
+            phrase_cache.set(key, ids)
+        return ids
+
+    def _common_phrase(self, tokens):
+        # Too many emails to bind by id: the emails holding every word, whose
+        # title or body holds the phrase. A compressed body cannot be scanned,
+        # so every word is all such an email is checked for.
+        all_name = self._name()
+        self.params[f'{all_name}_tokens'] = search_index.pad_in_list(sorted(set(tokens)))
+        self.params[f'{all_name}_count'] = len(set(tokens))
+        name = self._name()
+        self.params[name] = '%' + ' '.join(tokens) + '%'
+        # More than SEARCH_PHRASE_CANDIDATE_LIMIT emails hold every word
+        return ('phrase', all_name, name), min(1.0, Config.SEARCH_PHRASE_CANDIDATE_LIMIT / self.total)
+
+    def _field(self, node):
+        _, field, value = node
+        name = self._name()
+        is_prefix = False
+        if field in ('before', 'after'):
+            self.params[name] = datetime.combine(value, time.min)
+        elif field == 'id':
+            is_prefix = value.endswith('*')
+            self.params[name] = value[:-1] + '%' if is_prefix else value
+        elif field == 'type':
+            self.params[name] = value
+        else:
+            self.params[name] = f'%{value}%'
+        return ('field', field, name, is_prefix), FIELD_SELECTIVITY[field]
+
+    def _split_tokens(self, children, with_prefixes):
+        """Separates the plain single-token words, which one index probe can answer together."""
+        tokens = []
+        prefixes = []
+        rest = []
+        for child in children:
+            token = _text_tokens(child) if self.use_index and child[0] == 'text' else None
+            if token is not None and not child[2]:
+                tokens.append(token)
+            elif token is not None and with_prefixes:
+                prefixes.append(token)
+            else:
+                rest.append(child)
+        return tokens, prefixes, rest
+
+    def _conjunction(self, children):
+        tokens, _, rest = self._split_tokens(children, with_prefixes=False)
+        if len(tokens) > 1:
+            parts = [self._all_tokens(tokens)]
+        else:
+            parts, rest = [], children
+        parts.extend(self.plan(child) for child in rest)
+
+        parts = [part for part in parts if part is not None and part[0] is not EVERYTHING]
+        if any(shape is NOTHING for shape, _ in parts):
+            return NOTHING, 0.0
+        if not parts:
+            return EVERYTHING, 1.0
+        # Most selective first
+        parts.sort(key=lambda part: part[1])
+        if len(parts) == 1:
+            return parts[0]
+        return ('and', tuple(shape for shape, _ in parts)), parts[0][1]
+
+    def _disjunction(self, children):
+        tokens, prefixes, rest = self._split_tokens(children, with_prefixes=True)
+        parts = []
+        if tokens or prefixes:
+            parts.append(self._any_tokens(tokens, prefixes))
+        parts.extend(self.plan(child) for child in rest)
+
+        parts = [part for part in parts if part is not None and part[0] is not NOTHING]
+        if any(shape is EVERYTHING for shape, _ in parts):
+            return EVERYTHING, 1.0
+        if not parts:
+            return NOTHING, 0.0
+        # Most likely to match first
+        parts.sort(key=lambda part: -part[1])
+        if len(parts) == 1:
+            return parts[0]
+        return ('or', tuple(shape for shape, _ in parts)), min(1.0, sum(share for _, share in parts))
+
+
+def plan_query(session, node, use_index=True, estimate=True):
+    """
+    Reduces an AST from parse_query to (shape, params). The shape is None
+    when the query places no condition on the emails. With estimate, the
+    document frequencies of the words decide the order of the predicates
+    and words that occur nowhere are answered without a query.
+    """
+    if node is None:
+        return None, {}
+    planner = _Planner(session, use_index, estimate)
+    if planner.estimate:
+        planner.load_frequencies(node)
+    planned = planner.plan(node)
+    if planned is None or planned[0] is EVERYTHING:
+        return None, {}
+    return planned[0], planner.params
+
+
+def _field_filter(field, name, is_prefix):
+    if field == 'from':
+        value = bindparam(name, type_=Email.sender_name.type)
+        return or_(Email.sender_name.ilike(value), Email.sender_email.ilike(value))
+    if field == 'type':
+        return Email.email_type == bindparam(name, type_=Email.email_type.type)
+    if field == 'title':
+        return Email.title.ilike(bindparam(name, type_=Email.title.type))
+    if field == 'id':
+        value = bindparam(name, type_=Email.unique_email_id.type)
+        return Email.unique_email_id.like(value) if is_prefix else Email.unique_email_id == value
+    if field == 'before':
+        return Email.date_sent < bindparam(name, type_=DateTime)
+    return Email.date_sent >= bindparam(name, type_=DateTime)
+
+
+def _shape_filter(shape):
+    kind = shape[0]
+    if kind == 'nothing':
+        return false()
+    if kind == 'any':
+        return search_index.any_tokens_filter(*shape[1:])
+    if kind == 'all':
+        return search_index.all_tokens_filter(shape[1])
+    if kind == 'ids':
+        return search_index.ids_filter(*shape[1:])
+    if kind == 'like':
+        return Email.body.ilike(bindparam(shape[1], type_=Email.body.type))
+    if kind == 'phrase':
+        value = bindparam(shape[2], type_=Email.body.type)
+        return and_(search_index.all_tokens_filter(shape[1]),
+                    or_(Email.title.ilike(value), Email.body.ilike(value), Email.body.is_(None)))
+    if kind == 'field':
+        return _field_filter(*shape[1:])
+    if kind == 'not':
+        return ~_shape_filter(shape[1])
+    if kind == 'and':
+        return and_(*[_shape_filter(child) for child in shape[1]])
+    return or_(*[_shape_filter(child) for child in shape[1]])
+
+
+def query_filters(shape):
+    """Returns the predicates on ``Email`` for a shape from plan_query, with named bind parameters."""
+    if shape is None:
+        return []
+    return [_shape_filter(shape)]
@@ -0,0 +1,228 @@
+"""
+The sender dimension.
+
+Emails come from a small number of distinct senders, so ``senders`` holds
+one row per (name, address) with its email count, and ``emails.sender_id``
+points at it. ``sender_trigrams`` indexes every three-character substring
+of each sender's lowercased name and address. A sender filter such as
+"ohn sm" is resolved against this small table first, and the emails are
+then filtered with an indexed ``sender_id IN (...)`` instead of a
+leading-wildcard ILIKE over every email. The same lookup answers
+/api/senders/suggest.
+
+Email writers call assign_senders on their rows before inserting them, as
+seed.py does. To add the column to an existing database and link the
+emails already there:
+
+    python -m webapp.senders --backfill
+"""
+import time
+import argparse
+from collections import Counter
+from sqlalchemy import select, update, insert, func, bindparam, inspect, text
+from .models import Email, Sender, SenderTrigram
+from .cache import TTLCache
+from .result_cache import result_cache
+from config import Config
+
+# Oracle rejects IN lists with more than 1000 expressions
+IN_CLAUSE_LIMIT = 1000
+
+# Matching sender ids per filter text and suggestions per prefix, keyed by
+# the result cache generation so new senders show up after an ingest
+sender_cache = TTLCache(maxsize=Config.SENDER_CACHE_SIZE, ttl=Config.SENDER_CACHE_TTL)
+
+
+def trigrams(value):
+    """The distinct three-character substrings of a lowercased value."""
+    value = (value or '').lower()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def _candidates(session, value, criteria):
+    """
+    Senders that may contain value: those holding all of its trigrams, or
+    for values under three characters those meeting criteria(pattern), a
+    scan of the (small) senders table.
+    """
+    stmt = select(Sender.id, Sender.name, Sender.email, Sender.email_count)
+    grams = sorted(trigrams(value))
+    if grams:
+        matching = (
+            select(SenderTrigram.sender_id)
+            .where(SenderTrigram.trigram.in_(grams))
+            .group_by(SenderTrigram.sender_id)
+            .having(func.count() == len(grams))
+        )
+        stmt = stmt.where(Sender.id.in_(matching))
+    else:
+        pattern = f'%{value.lower()}%'
+        stmt = stmt.where(*criteria(pattern))
+    return session.execute(stmt).all()
+
+
+def matching_sender_ids(session, value):
+    """
+    The ids of the senders whose name contains value, ignoring case, as the
+    legacy ILIKE filter matched them. Sorted, and cached per generation.
+    """
+    key = (result_cache.generation(), 'ids', value.lower())
+    ids = sender_cache.get(key)
+    if ids is None:
+        needle = value.lower()
+        rows = _candidates(session, value, lambda pattern: [func.lower(Sender.name).like(pattern)])
+        # Trigrams narrow the candidates; the substring itself is checked here
+        ids = sorted(row.id for row in rows if needle in (row.name or '').lower())
+        sender_cache.set(key, ids)
+    return ids
+
+
+def suggest_senders(session, value, limit):
+    """
+    Up to limit senders whose name or address contains value: names that
+    start with it first, then by the number of emails sent.
+    """
+    key = (result_cache.generation(), 'suggest', value.lower(), limit)
+    suggestions = sender_cache.get(key)
+    if suggestions is None:
+        needle = value.lower()
+        rows = _candidates(session, value, lambda pattern: [
+            func.lower(Sender.name).like(pattern) | func.lower(Sender.email).like(pattern)
+        ])
+        rows = [row for row in rows if needle in (row.name or '').lower() or needle in (row.email or '').lower()]
+        rows.sort(key=lambda row: (not (row.name or '').lower().startswith(needle), -row.email_count, row.name or ''))
+        suggestions = [
+            {'id': row.id, 'name': row.name, 'email': row.email, 'email_count': row.email_count}
+            for row in rows[:limit]
+        ]
+        sender_cache.set(key, suggestions)
+    return suggestions
+
+
+def _sender_key(name, email):
+    # Oracle stores '' as NULL, so both count as no value
+    return name or None, email or None
+
+
+def _load_senders(session, keys):
+    """{(name, email): id} of the existing senders with the names in keys."""
+    names = sorted({name for name, _ in keys if name})
+    criteria = [Sender.name.in_(names[i:i + IN_CLAUSE_LIMIT]) for i in range(0, len(names), IN_CLAUSE_LIMIT)]
+    if any(name is None for name, _ in keys):
+        criteria.append(Sender.name.is_(None))
+    ids = {}
+    for criterion in criteria:
+        rows = session.execute(select(Sender.id, Sender.name, Sender.email).where(criterion))
+        ids.update({_sender_key(row.name, row.email): row.id for row in rows})
+    return ids
+
+
+def _create_senders(session, keys):
+    """Inserts new senders with their trigrams and returns {(name, email): id}."""
+    senders = [Sender(name=name, email=email, email_count=0) for name, email in keys]
+    session.add_all(senders)
+    session.flush()
+    grams = [
+        {'trigram': gram, 'sender_id': sender.id}
+        for sender in senders
+        for gram in trigrams(sender.name) | trigrams(sender.email)
+    ]
+    if grams:
+        session.execute(insert(SenderTrigram.__table__), grams)
+    return {(sender.name, sender.email): sender.id for sender in senders}
+
+
+def _add_email_counts(session, counts):
+    if not counts:
+        return
+    table = Sender.__table__
+    session.execute(
+        update(table)
+        .where(table.c.id == bindparam('sender'))
+        .values(email_count=table.c.email_count + bindparam('added')),
+        [{'sender': sender_id, 'added': added} for sender_id, added in counts.items()]
+    )
+
+
+def assign_senders(session, emails):
+    """
+    Sets sender_id on email rows (dicts with sender_name and sender_email)
+    that are about to be inserted, creating any new senders, and counts
+    the emails in the current transaction.
+    """
+    keys = Counter(_sender_key(row.get('sender_name'), row.get('sender_email')) for row in emails)
+    if not keys:
+        return
+    ids = _load_senders(session, keys)
+    missing = [key for key in keys if key not in ids]
+    if missing:
+        ids.update(_create_senders(session, missing))
+
+    for row in emails:
+        row['sender_id'] = ids[_sender_key(row.get('sender_name'), row.get('sender_email'))]
+    _add_email_counts(session, {ids[key]: count for key, count in keys.items()})
+
+
+def add_sender_column(engine):
+    """Adds emails.sender_id and its index to an existing emails table."""
+    existing = {column['name'].lower() for column in inspect(engine).get_columns('emails')}
+    if 'sender_id' not in existing:
+        with engine.begin() as connection:
+            connection.execute(text('ALTER TABLE emails ADD sender_id INTEGER REFERENCES senders (id)'))
+    for index in Email.__table__.indexes:
+        if 'sender_id' in {column.name for column in index.columns}:
+            index.create(engine, checkfirst=True)
+
+
+def backfill_senders(session, chunk_size=1000):
+    """
+    Links every email without a sender_id to its sender, creating the
+    senders as they are met, in unique_email_id order and committing per
+    chunk, so a stopped run resumes where it left off. Returns the number
+    of emails linked.
+    """
+    table = Email.__table__
+    link = update(table).where(table.c.unique_email_id == bindparam('email_id')).values(sender_id=bindparam('sender'))
+
+    linked = 0
+    last_id = None
+    while True:
+        stmt = (select(Email.unique_email_id, Email.sender_name, Email.sender_email)
+                .where(Email.sender_id.is_(None)).order_by(Email.unique_email_id).limit(chunk_size))
+        if last_id is not None:
+            stmt = stmt.where(Email.unique_email_id > last_id)
+        chunk = session.execute(stmt).all()
+        if not chunk:
+            break
+
+        rows = [{'sender_name': row.sender_name, 'sender_email': row.sender_email} for row in chunk]
+        assign_senders(session, rows)
+        session.execute(link, [
+            {'email_id': email.unique_email_id, 'sender': row['sender_id']} for email, row in zip(chunk, rows)
+        ])
+        session.commit()
+
+        linked += len(chunk)
+        last_id = chunk[-1].unique_email_id
+    result_cache.invalidate()
+    return linked
+
+
+if __name__ == '__main__':
+    from .database import db_session, get_engine
+
+    parser = argparse.ArgumentParser(description='Maintain the sender dimension.')
+    parser.add_argument('--backfill', action='store_true',
+                        help='Add emails.sender_id if needed and link every unlinked email to its sender.')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Emails linked per transaction.')
+    args = parser.parse_args()
+    if not args.backfill:
+        parser.error('nothing to do; pass --backfill')
+
+    Sender.__table__.create(get_engine(), checkfirst=True)
+    SenderTrigram.__table__.create(get_engine(), checkfirst=True)
+    add_sender_column(get_engine())
+
+    started = time.perf_counter()
+    linked = backfill_senders(db_session, chunk_size=args.chunk_size)
+    print(f"Linked {linked} emails to their senders in {time.perf_counter() - started:.1f}s.")
@@ -1,26 +1,177 @@
-from sqlalchemy import desc, or_, func
-from .models import Email, UserActivity, Comment
-from .utils import parse_search_query, Pagination
-from datetime import datetime, date, timedelta
+from collections import Counter
+from sqlalchemy import select, desc, or_, and_, func, bindparam, literal_column, inspect, false, Integer, Date, DateTime
+from sqlalchemy.orm import joinedload, aliased
+from .models import Email, EmailFacetCount, User, UserActivity, Comment, ActivityRollup
+from .utils import Pagination, encode_cursor, decode_cursor
+from .database import db_session
+from .cache import TTLCache
+from .result_cache import result_cache
+from . import search_query, search_index, facets, senders
+from .snippets import page_snippets
+from .activity_retention import rolled_up_through, next_day_with_activity, range_counts
+from datetime import datetime, date, time, timedelta
+from config import Config
 
-def search_emails_service(query, page, per_page, sort_by, sort_order, sender, email_type, start_date, end_date, date_filter, has_references=False, has_comments=False):
-    """Handles the business logic for searching emails."""
-    search_terms, exact_phrases, exclusion_terms = parse_search_query(query)
+# Totals keyed by the normalized filter set, so paging through one result
+# set counts it once rather than on every page
+count_cache = TTLCache(maxsize=Config.COUNT_CACHE_SIZE, ttl=Config.COUNT_CACHE_TTL)
 
-    db_query = Email.query
+# Statements keyed by the shape of their filters (which filters are present,
+# the sort and the pagination mode). Every value is a named bind parameter,
+# so a shape is built once per worker and always renders the same SQL.
+statement_cache = TTLCache(maxsize=Config.STATEMENT_CACHE_SIZE, ttl=Config.STATEMENT_CACHE_TTL)
 
-    if sender:
-        db_query = db_query.filter(Email.sender_name.ilike(f'%{sender}%'))
-    if email_type:
-        db_query = db_query.filter(Email.email_type == email_type)
+# Columns of the CSV/NDJSON exports, in order
+SEARCH_EXPORT_COLUMNS = ('unique_email_id', 'title', 'sender_name', 'sender_email', 'email_type',
+                         'date_sent', 'references', 'comment_count', 'reference_count')
+ACTIVITY_EXPORT_COLUMNS = ('id', 'user_id', 'username', 'timestamp', 'activity', 'details')
 
-    if has_references:
-        db_query = db_query.filter(Email.references.isnot(None)).filter(func.length(Email.references) > 0)
+EMAIL_SORT_COLUMNS = {attr.key: attr.class_attribute for attr in inspect(Email).column_attrs}
+ACTIVITY_SORT_COLUMNS = {attr.key: attr.class_attribute for attr in inspect(UserActivity).column_attrs}
 
-    if has_comments:
-        db_query = db_query.filter(Email.comments.any())
+def _nullable(column):
+    return getattr(column.expression, 'nullable', True)
+
+def _sort_order(sort_column, key_column, descending):
+    """
+    The ORDER BY of a page: the sort column, then the key. NULLs sort as
+    the largest value, Oracle's default, so they come last ascending and
+    first descending on every database.
+    """
+    if descending:
+        sort = desc(sort_column).nulls_first() if _nullable(sort_column) else desc(sort_column)
+        return sort, desc(key_column)
+    sort = sort_column.asc().nulls_last() if _nullable(sort_column) else sort_column.asc()
+    return sort, key_column
+
+def _page_statements(base, filters, sort_column, key_column, descending):
+    """
+    Builds the statements _paginate runs: 'count', and the page fetched by
+    'offset' (LIMIT/OFFSET) or 'seek' (after the row a cursor encodes).
+    A nullable sort column also gets 'seek_null', for a cursor on a row
+    whose sort value is NULL. Limits and offsets are bind parameters rather
+    than literals, so paging does not produce a new SQL text per page.
+    """
+    sort_value = bindparam('seek_sort', type_=sort_column.type)
+    key_value = bindparam('seek_key', type_=key_column.type)
+    if descending:
+        seek = or_(sort_column < sort_value, and_(sort_column == sort_value, key_column < key_value))
+        # The NULLs came first; every other row is still ahead
+        seek_null = or_(and_(sort_column.is_(None), key_column < key_value), sort_column.isnot(None))
+    else:
+        seek = or_(sort_column > sort_value, and_(sort_column == sort_value, key_column > key_value))
+        seek_null = and_(sort_column.is_(None), key_column > key_value)
+        if _nullable(sort_column):
+            # The NULLs come last
+            seek = or_(seek, sort_column.is_(None))
+
+    page = base.where(*filters).order_by(*_sort_order(sort_column, key_column, descending))
+    limit = bindparam('limit', type_=Integer)
+    statements = {
+        'count': select(func.count(key_column)).where(*filters),
+        'offset': page.limit(limit).offset(bindparam('offset', type_=Integer)),
+        'seek': page.where(seek).limit(limit),
+    }
+    if _nullable(sort_column):
+        statements['seek_null'] = page.where(seek_null).limit(limit)
+    return statements
+
+def _count(session, statements, params, count_key, count_mode):
+    if count_mode == 'none':
+        return None
+    if count_mode != 'exact':
+        total = count_cache.get(count_key)
+        if total is not None:
+            return total
+    total = session.execute(statements['count'], params).scalar()
+    count_cache.set(count_key, total)
+    return total
+
+def _seek_params(sort_column, cursor):
+    sort_value, key_value = cursor
+    if sort_value is None:
+        return {'seek_sort': None, 'seek_key': key_value}
+    if isinstance(sort_column.type, DateTime):
+        try:
+            sort_value = datetime.fromisoformat(sort_value)
+        except (TypeError, ValueError):
+            return None
+    return {'seek_sort': sort_value, 'seek_key': key_value}
+
+def _paginate(session, statements, params, sort_column, key_column, page, per_page, cursor, count_key, count_mode):
+    """
+    Fetches one page in (sort column, primary key) order. With a cursor the
+    page starts right after the row it encodes (keyset pagination),
+    otherwise it falls back to LIMIT/OFFSET. One extra row is fetched so
+    has_next is known without relying on the total.
+    """
+    total = _count(session, statements, params, count_key, count_mode)
+
+    seek = None
+    if cursor:
+        decoded = decode_cursor(cursor)
+        if decoded is not None:
+            seek = _seek_params(sort_column, decoded)
+    seek_statement = None
+    if seek is not None:
+        seek_statement = statements.get('seek' if seek['seek_sort'] is not None else 'seek_null')
+
+    if seek_statement is not None:
+        rows = session.execute(seek_statement, dict(params, limit=per_page + 1, **seek)).scalars().all()
+    else:
+        rows = session.execute(statements['offset'],
+                               dict(params, limit=per_page + 1, offset=(page - 1) * per_page)).scalars().all()
+
+    items = rows[:per_page]
+    has_more = len(rows) > per_page
+    next_cursor = None
+    if has_more:
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), getattr(last, key_column.key))
+
+    return Pagination(page=page, per_page=per_page, total=total, items=items,
+                      next_cursor=next_cursor, has_more=has_more)
+
+def _page_from_rows(rows, page, per_page, cursor):
+    """Slices one page out of a cached result set, the way _paginate would fetch it."""
+    start = (page - 1) * per_page
+    if cursor:
+        decoded = decode_cursor(cursor)
+        if decoded is not None:
+            for position, row in enumerate(rows):
+                if row.unique_email_id == decoded[1]:
+                    start = position + 1
+                    break
 
-    # Date filtering logic
+    items = rows[start:start + per_page]
+    has_more = start + per_page < len(rows)
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor(items[-1].sort_value, items[-1].unique_email_id)
+
+    return Pagination(page=page, per_page=per_page, total=len(rows), items=items,
+                      next_cursor=next_cursor, has_more=has_more)
+
+def _cached_result_rows(session, statements, params, count_key, result_key):
+    """
+    Returns the whole result set as light rows, from the result cache or
+    freshly loaded into it, or None if it is too large to cache.
+    """
+    generation = result_cache.generation()
+    rows = result_cache.get(result_key, generation)
+    if rows is not None:
+        return rows
+
+    # The total decides whether loading the whole result set is worth it
+    if _count(session, statements, params, count_key, 'cached') > result_cache.max_rows:
+        return None
+
+    rows = session.execute(statements['rows'], params).all()
+    result_cache.set(result_key, rows, generation)
+    return rows
+
+def _date_range(date_filter, start_date, end_date):
+    """Returns the (start, end) dates of the date filter, either of which may be None."""
     start_date_obj = None
     end_date_obj = None
 
@@ -52,51 +203,454 @@ def search_emails_service(query, page, per_page, sort_by, sort_order, sender, em
             except ValueError:
                 pass  # Ignore invalid date format
 
+    return start_date_obj, end_date_obj
+
+def _search_filters(filter_shape):
+    """The WHERE conditions of a search, from the filter part of its shape."""
+    (has_sender, has_email_type, has_references, has_comments, has_start, has_end,
+     use_index, text_shape) = filter_shape
+
+    filters = []
+    if has_sender == 'ids':
+        filters.append(Email.sender_id.in_(bindparam('sender_ids', expanding=True)))
+    elif has_sender == 'none':
+        filters.append(false())
+    elif has_sender:
+        filters.append(Email.sender_name.ilike(bindparam('sender', type_=Email.sender_name.type)))
+    if has_email_type:
+        filters.append(Email.email_type == bindparam('email_type', type_=Email.email_type.type))
+    if has_references:
+        filters.append(Email.reference_count > 0)
+    if has_comments:
+        filters.append(Email.comment_count > 0)
+    if has_start:
+        filters.append(Email.date_sent >= bindparam('start_date', type_=DateTime))
+    if has_end:
+        filters.append(Email.date_sent < bindparam('end_date', type_=DateTime))
+
+    filters.extend(search_query.query_filters(text_shape))
+    return filters
+
+def build_search_statements(shape):
+    """Builds the statements for one search shape; see search_statements."""
+    filters = _search_filters(shape[:-2])
+    sort_key, descending = shape[-2:]
+
+    sort_column = EMAIL_SORT_COLUMNS[sort_key]
+    statements = _page_statements(select(Email), filters, sort_column, Email.unique_email_id, descending)
+    order = _sort_order(sort_column, Email.unique_email_id, descending)
+    statements['rows'] = (
+        select(Email.unique_email_id, Email.title, Email.sender_name, Email.date_sent,
+               Email.comment_count, sort_column.label('sort_value'))
+        .where(*filters)
+        .order_by(*order)
+    )
+    statements['export'] = (
+        select(*[getattr(Email, name) for name in SEARCH_EXPORT_COLUMNS])
+        .where(*filters)
+        .order_by(*order)
+    )
+    return statements
+
+def search_statements(shape):
+    """Returns the statements for a search shape, built on first use."""
+    statements = statement_cache.get(shape)
+    if statements is None:
+        statements = build_search_statements(shape)
+        statement_cache.set(shape, statements)
+    return statements
+
+def _sender_mode(session, sender, params):
+    """
+    How a search filters on sender, adding its params: 'ids' for the ids of
+    the senders whose name contains it, from the sender dimension, 'none'
+    when no sender does, 'like' for the ILIKE over every email when it holds
+    LIKE wildcards or matches too many senders for one IN list, and False
+    without a sender.
+    """
+    if not sender:
+        return False
+    params['sender'] = f'%{sender}%'
+    if '%' in sender or '_' in sender:
+        return 'like'
+    ids = senders.matching_sender_ids(session, sender)
+    if not ids:
+        return 'none'
+    if len(ids) > senders.IN_CLAUSE_LIMIT:
+        return 'like'
+    params['sender_ids'] = search_index.pad_in_list(ids)
+    return 'ids'
+
+def search_plan(query, sort_by, sort_order, sender, email_type, start_date, end_date, date_filter,
+                has_references=False, has_comments=False, use_index=True, session=None, estimate=True):
+    """
+    Reduces a search to (shape, params, count_key): the shape selects the
+    cached statements, params holds every value bound into them and
+    count_key identifies the result set for the count and result caches.
+    The query text is parsed and planned by webapp.search_query; estimate
+    is passed on to plan_query.
+    """
+    query_node = search_query.parse_query(query)
+    start_date_obj, end_date_obj = _date_range(date_filter, start_date, end_date)
+    # Bound and keyed alike; both sender filters ignore case
+    sender = (sender or '').strip()
+
+    params = {}
+    sender_mode = _sender_mode(session or db_session, sender, params)
+    if email_type:
+        params['email_type'] = email_type
     if start_date_obj:
-        db_query = db_query.filter(Email.date_sent >= start_date_obj)
+        params['start_date'] = datetime.combine(start_date_obj, time.min)
     if end_date_obj:
-        db_query = db_query.filter(Email.date_sent < end_date_obj)
+        params['end_date'] = datetime.combine(end_date_obj, time.min)
 
+    text_shape, text_params = search_query.plan_query(session or db_session, query_node, use_index, estimate)
+    params.update(text_params)
 
-    if search_terms:
-        search_filters = [Email.body.ilike(f'%{term}%') for term in search_terms]
-        db_query = db_query.filter(or_(*search_filters))
+    sort_key = sort_by if sort_by in EMAIL_SORT_COLUMNS else 'unique_email_id'
+    shape = (
+        sender_mode, bool(email_type), bool(has_references), bool(has_comments),
+        start_date_obj is not None, end_date_obj is not None,
+        bool(use_index), text_shape, sort_key, sort_order == 'desc',
+    )
 
-    for phrase in exact_phrases:
-        db_query = db_query.filter(Email.body.ilike(f'%{phrase}%'))
+    count_key = (
+        'search', query_node,
+        sender.lower(), email_type, start_date_obj, end_date_obj,
+        bool(has_references), bool(has_comments), use_index,
+    )
+    return shape, params, count_key
 
-    for term in exclusion_terms:
-        db_query = db_query.filter(~Email.body.ilike(f'%{term}%'))
+def search_emails_service(query, page, per_page, sort_by, sort_order, sender, email_type, start_date, end_date, date_filter, has_references=False, has_comments=False, use_index=True,
+                          cursor=None, count_mode='cached', session=None, snippets=False):
+    """
+    Handles the business logic for searching emails.
+    With use_index the search terms are answered from the full-text index,
+    otherwise they fall back to substring scans of the email body.
+    count_mode is 'cached' (reuse a recent total for the same filters, and
+    page from the result cache), 'exact' or 'none'. With snippets the page
+    also carries a highlighted excerpt per email (see webapp.snippets).
+    session defaults to db_session; the async API passes its own.
+    """
+    session = session or db_session
+    shape, params, count_key = search_plan(query, sort_by, sort_order, sender, email_type, start_date, end_date,
+                                           date_filter, has_references, has_comments, use_index, session)
+    statements = search_statements(shape)
+    sort_key, descending = shape[-2], shape[-1]
 
-    if sort_by and hasattr(Email, sort_by):
-        column = getattr(Email, sort_by)
-        if sort_order == 'desc':
-            db_query = db_query.order_by(desc(column))
-        else:
-            db_query = db_query.order_by(column)
+    # Repeated queries are paged from the result cache; an exact count, or
+    # no count at all, asks for the database
+    pagination = None
+    if result_cache.enabled and count_mode == 'cached':
+        rows = _cached_result_rows(session, statements, params, count_key, count_key + (sort_key, descending))
+        if rows is not None:
+            pagination = _page_from_rows(rows, page, per_page, cursor)
+    if pagination is None:
+        pagination = _paginate(session, statements, params, EMAIL_SORT_COLUMNS[sort_key], Email.unique_email_id,
+                               page, per_page, cursor, count_key, count_mode)
+
+    if snippets:
+        pagination.snippets = page_snippets(session, search_query.parse_query(query),
+                                            [item.unique_email_id for item in pagination.items])
+    return pagination
+
+def build_facet_statement(filter_shape, from_emails=False):
+    """
+    The grouped pass behind get_search_facets: email counts per sender,
+    type and month. Searches without query text or counter filters read
+    the per-day counts in email_facet_counts instead of the emails, unless
+    from_emails is set.
+    """
+    (has_sender, has_email_type, has_references, has_comments, has_start, has_end,
+     use_index, text_shape) = filter_shape
+
+    if from_emails or has_references or has_comments or text_shape is not None:
+        month = facets.month_start(Email.date_sent)
+        return (
+            select(Email.sender_name, Email.email_type, month, func.count())
+            .where(*_search_filters(filter_shape))
+            .group_by(Email.sender_name, Email.email_type, month)
+        )
+
+    # The date filters always fall on midnight, so whole days answer them
+    filters = []
+    if has_sender:
+        filters.append(EmailFacetCount.sender_name.ilike(bindparam('sender', type_=EmailFacetCount.sender_name.type)))
+    if has_email_type:
+        filters.append(EmailFacetCount.email_type == bindparam('email_type', type_=EmailFacetCount.email_type.type))
+    if has_start:
+        filters.append(EmailFacetCount.day >= bindparam('start_date', type_=Date))
+    if has_end:
+        filters.append(EmailFacetCount.day < bindparam('end_date', type_=Date))
+    month = facets.month_start(EmailFacetCount.day)
+    return (
+        select(EmailFacetCount.sender_name, EmailFacetCount.email_type, month, func.sum(EmailFacetCount.count))
+        .where(*filters)
+        .group_by(EmailFacetCount.sender_name, EmailFacetCount.email_type, month)
+    )
+
+def facet_statement(filter_shape):
+    """Returns the facet statement for a search's filter shape, built on first use."""
+    stmt = statement_cache.get(('facets',) + filter_shape)
+    if stmt is None:
+        stmt = build_facet_statement(filter_shape)
+        statement_cache.set(('facets',) + filter_shape, stmt)
+    return stmt
+
+def _facet_values(counts, limit=None):
+    ordered = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return [{'value': value, 'count': count} for value, count in ordered[:limit]]
+
+def get_search_facets(query, sender, email_type, start_date, end_date, date_filter, has_references=False,
+                      has_comments=False, use_index=True, limit=None, session=None):
+    """
+    Counts the emails matching a search per sender, per email type and per
+    month, all from one grouped query. The counts are kept in the result
+    cache next to the search's own results. Senders and types are listed
+    by count, at most `limit` of each; months in order.
+    """
+    session = session or db_session
+    shape, params, count_key = search_plan(query, 'date_sent', 'desc', sender, email_type, start_date, end_date,
+                                           date_filter, has_references, has_comments, use_index, session)
+    key = ('facets', limit) + count_key
+    generation = result_cache.generation()
+    summary = result_cache.get(key, generation)
+    if summary is not None:
+        return summary
+
+    senders, email_types, months = Counter(), Counter(), Counter()
+    for sender_name, type_name, month, count in session.execute(facet_statement(shape[:-2]), params):
+        senders[sender_name or facets.NO_VALUE] += count
+        email_types[type_name or facets.NO_VALUE] += count
+        if month is not None:
+            months[month.strftime('%Y-%m')] += count
+
+    summary = {
+        'total': sum(senders.values()),
+        'senders': _facet_values(senders, limit),
+        'email_types': _facet_values(email_types, limit),
+        'months': [{'value': month, 'count': count} for month, count in sorted(months.items())],
+    }
+    result_cache.set(key, summary, generation)
+    return summary
+
+def activity_plan(sort_by, sort_order, user_id_filter):
+    """Reduces an activity log request to (shape, params, count_key); see search_plan."""
+    if sort_by in ACTIVITY_SORT_COLUMNS:
+        sort_key = sort_by
+        descending = sort_order == 'desc'
+    else:
+        sort_key = 'timestamp'
+        descending = True
+
+    shape = ('activity', bool(user_id_filter), sort_key, descending)
+    params = {'user_id': user_id_filter} if user_id_filter else {}
+    count_key = ('activity', str(user_id_filter or ''))
+    return shape, params, count_key
+
+def build_activity_statements(shape):
+    _, has_user, sort_key, descending = shape
+    filters = [UserActivity.user_id == bindparam('user_id', type_=Integer)] if has_user else []
+    sort_column = ACTIVITY_SORT_COLUMNS[sort_key]
+
+    # The grid shows the username of every row; join it in rather than lazy-loading per row
+    base = select(UserActivity).options(joinedload(UserActivity.user))
+    statements = _page_statements(base, filters, sort_column, UserActivity.id, descending)
+    order = _sort_order(sort_column, UserActivity.id, descending)
+    columns = [User.username if name == 'username' else getattr(UserActivity, name) for name in ACTIVITY_EXPORT_COLUMNS]
+    statements['export'] = (
+        select(*columns)
+        .outerjoin(User, UserActivity.user_id == User.id)
+        .where(*filters)
+        .order_by(*order)
+    )
+    return statements
 
-    total = db_query.count()
-    items = db_query.limit(per_page).offset((page - 1) * per_page).all()
-    
-    return Pagination(page=page, per_page=per_page, total=total, items=items)
+def activity_statements(shape):
+    """Returns the statements for an activity shape, built on first use."""
+    statements = statement_cache.get(shape)
+    if statements is None:
+        statements = build_activity_statements(shape)
+        statement_cache.set(shape, statements)
+    return statements
 
-def get_activity_logs_service(page, per_page, sort_by, sort_order, user_id_filter):
+def get_activity_logs_service(page, per_page, sort_by, sort_order, user_id_filter, cursor=None, count_mode='cached',
+                              session=None):
     """Handles the business logic for fetching user activity logs."""
-    db_query = UserActivity.query
+    shape, params, count_key = activity_plan(sort_by, sort_order, user_id_filter)
+    return _paginate(session or db_session, activity_statements(shape), params, ACTIVITY_SORT_COLUMNS[shape[2]],
+                     UserActivity.id, page, per_page, cursor, count_key, count_mode)
 
-    if user_id_filter:
-        db_query = db_query.filter(UserActivity.user_id == user_id_filter)
 
-    if sort_by and hasattr(UserActivity, sort_by):
-        column = getattr(UserActivity, sort_by)
-        if sort_order == 'desc':
-            db_query = db_query.order_by(desc(column))
-        else:
-            db_query = db_query.order_by(column)
+def get_activity_summary(start_date, end_date, user_id=None, session=None):
+    """
+    Activity counts per day and activity for [start_date, end_date]. Days
+    the retention job has rolled up are read from activity_rollups; the
+    days after it are counted from the raw log in one grouped query,
+    starting at the first day that has raw activity. At most four queries,
+    whatever the range.
+    """
+    session = session or db_session
+    last = rolled_up_through(session)
+    counts = {}
+
+    if last is not None and start_date <= last:
+        stmt = (
+            select(ActivityRollup.day, ActivityRollup.activity, func.sum(ActivityRollup.count))
+            .where(ActivityRollup.day >= start_date, ActivityRollup.day <= min(end_date, last))
+            .group_by(ActivityRollup.day, ActivityRollup.activity)
+        )
+        if user_id is not None:
+            stmt = stmt.where(ActivityRollup.user_id == user_id)
+        for day, activity, count in session.execute(stmt):
+            counts[(day, activity)] = int(count)
+
+    start = max(start_date, last + timedelta(days=1)) if last is not None else start_date
+    if start <= end_date:
+        start = next_day_with_activity(session, start, end_date + timedelta(days=1))
+    if start is not None and start <= end_date:
+        for day, activity, count in range_counts(session, start, end_date, user_id):
+            counts[(day, activity)] = counts.get((day, activity), 0) + count
+
+    return {
+        'rolled_up_through': last.isoformat() if last is not None else None,
+        'rows': [
+            {'day': day.isoformat(), 'activity': activity, 'count': count}
+            for (day, activity), count in sorted(counts.items())
+        ],
+    }
+
+
+# Depth counters of the recursive comment queries, inlined rather than bound
+# so both branches of the UNION ALL have a plain NUMBER column
+ZERO = literal_column('0', Integer)
+ONE = literal_column('1', Integer)
+
+def build_comment_statement(shape):
+    """
+    The statement for one comment query shape: ('thread', seek) fetches a page
+    of top-level comments (after a cursor when seek is set) together with
+    every reply beneath them, each row also carrying the email's highest
+    comment id as latest_id; ('since', by) fetches the comments posted
+    after a comment id or a timestamp. Either walks the thread with a
+    recursive query along ix_comments_thread, so it is a single round
+    trip that returns every row with its depth.
+    """
+    kind, option = shape
+    email_id = bindparam('email_id', type_=Comment.email_id.type)
+
+    if kind == 'thread':
+        roots = select(Comment.id).where(Comment.email_id == email_id, Comment.parent_id.is_(None))
+        if option:
+            seek_ts = bindparam('seek_sort', type_=Comment.timestamp.type)
+            seek_id = bindparam('seek_key', type_=Integer)
+            roots = roots.where(or_(Comment.timestamp < seek_ts,
+                                    and_(Comment.timestamp == seek_ts, Comment.id < seek_id)))
+        roots = (roots.order_by(desc(Comment.timestamp), desc(Comment.id))
+                 .limit(bindparam('limit', type_=Integer)).subquery('roots'))
+
+        thread = select(roots.c.id, ZERO.label('depth')).cte('thread', recursive=True)
+        reply = aliased(Comment)
+        thread = thread.union_all(
+            select(reply.id, thread.c.depth + ONE).where(reply.email_id == email_id, reply.parent_id == thread.c.id)
+        )
     else:
-        db_query = db_query.order_by(desc(UserActivity.timestamp))
+        # Walk up from each new comment; the row that reaches the top holds its depth
+        since = (Comment.id > bindparam('since', type_=Integer) if option == 'id'
+                 else Comment.timestamp > bindparam('since', type_=Comment.timestamp.type))
+        thread = (
+            select(Comment.id, Comment.parent_id.label('ancestor_id'), ZERO.label('depth'))
+            .where(Comment.email_id == email_id, since)
+            .cte('lineage', recursive=True)
+        )
+        ancestor = aliased(Comment)
+        thread = thread.union_all(
+            select(thread.c.id, ancestor.parent_id, thread.c.depth + ONE).where(ancestor.id == thread.c.ancestor_id)
+        )
+
+    columns = [Comment.id, Comment.parent_id, Comment.timestamp, Comment.body, User.username, thread.c.depth]
+    if kind == 'thread':
+        # Replies to comments on later pages can be newer than anything on this one
+        latest = aliased(Comment)
+        columns.append(select(func.max(latest.id)).where(latest.email_id == email_id)
+                       .scalar_subquery().label('latest_id'))
+    stmt = (
+        select(*columns)
+        .join(thread, thread.c.id == Comment.id)
+        .outerjoin(User, User.id == Comment.user_id)
+    )
+    if kind == 'since':
+        stmt = stmt.where(thread.c.ancestor_id.is_(None)).order_by(Comment.id).limit(bindparam('limit', type_=Integer))
+    return stmt
+
+def comment_statement(shape):
+    """Returns the statement for a comment shape, built on first use."""
+    stmt = statement_cache.get(('comments',) + shape)
+    if stmt is None:
+        stmt = build_comment_statement(shape)
+        statement_cache.set(('comments',) + shape, stmt)
+    return stmt
+
+def _thread_order(rows):
+    """
+    Orders a thread depth first, as it is displayed: top-level comments
+    newest first and the replies under each comment oldest first.
+    """
+    children = {}
+    for row in rows:
+        children.setdefault(row.parent_id, []).append(row)
+    for parent_id, replies in children.items():
+        replies.sort(key=lambda row: (row.timestamp, row.id), reverse=parent_id is None)
+
+    ordered = []
+    stack = list(reversed(children.get(None, [])))
+    while stack:
+        row = stack.pop()
+        ordered.append(row)
+        stack.extend(reversed(children.get(row.id, [])))
+    return ordered
+
+def get_comment_page(email_id, per_page, cursor=None, session=None):
+    """
+    One page of an email's comment thread: per_page top-level comments,
+    newest first, each followed by all of its replies. Returns (rows,
+    next_cursor, latest_id), latest_id being the highest comment id on the
+    email, loaded or not; every row has id, parent_id, depth, timestamp,
+    body and username.
+    """
+    session = session or db_session
+    params = {'email_id': email_id, 'limit': per_page + 1}
+    if cursor:
+        decoded = decode_cursor(cursor)
+        seek = _seek_params(Comment.timestamp, decoded) if decoded else None
+        if seek is None or seek['seek_sort'] is None:
+            cursor = None
+        else:
+            params.update(seek)
+
+    rows = session.execute(comment_statement(('thread', bool(cursor))), params).all()
+    latest_id = rows[0].latest_id if rows else None
+    thread = _thread_order(rows)
+    top_level = [row for row in thread if row.parent_id is None]
+    if len(top_level) <= per_page:
+        return thread, None, latest_id
 
-    total = db_query.count()
-    items = db_query.limit(per_page).offset((page - 1) * per_page).all()
+    # The extra top-level comment only shows there is a next page
+    extra = top_level[per_page]
+    last = top_level[per_page - 1]
+    return thread[:thread.index(extra)], encode_cursor(last.timestamp, last.id), latest_id
 
-    return Pagination(page=page, per_page=per_page, total=total, items=items)
+def get_new_comments(email_id, since, limit, session=None):
+    """
+    The comments on an email posted after `since`, a comment id or an ISO
+    timestamp, oldest first with their depth; None if since is neither.
+    """
+    session = session or db_session
+    try:
+        shape, since = ('since', 'id'), int(since)
+    except ValueError:
+        try:
+            shape, since = ('since', 'timestamp'), datetime.fromisoformat(since)
+        except ValueError:
+            return None
+    return session.execute(comment_statement(shape), {'email_id': email_id, 'since': since, 'limit': limit}).all()
@@ -0,0 +1,160 @@
+"""
+Highlighted search snippets.
+
+Each search result gets a short excerpt of its body around the first
+match, with every word, prefix and phrase of the query highlighted. The
+positive text terms of the parsed query are compiled into one regex per
+query (memoized with the AST), which finds the first match and the
+highlights in a single pass over at most SEARCH_SNIPPET_SCAN_CHARS of a
+body. A page stops making snippets once it has spent
+SEARCH_SNIPPET_BUDGET_MS on them; the remaining results are shown without
+one. Snippets are cached per query and email.
+"""
+import re
+import time
+from markupsafe import Markup, escape
+from sqlalchemy import bindparam
+from .models import Email
+from .cache import TTLCache
+from .result_cache import result_cache
+from .bodies import body_select, body_text
+from .search_index import tokenize, pad_in_list, IN_CLAUSE_LIMIT
+from . import metrics
+from config import Config
+
+# How far an excerpt may be stretched to end on a word boundary
+WORD_SLACK = 20
+
+_WORD = '[a-z0-9]'
+_WHITESPACE = re.compile(r'\s+')
+
+matcher_cache = TTLCache(maxsize=Config.SEARCH_PARSE_CACHE_SIZE, ttl=Config.STATEMENT_CACHE_TTL)
+# Snippets keyed by (result cache generation, query AST, email id)
+snippet_cache = TTLCache(maxsize=Config.SEARCH_SNIPPET_CACHE_SIZE, ttl=Config.SEARCH_SNIPPET_CACHE_TTL)
+
+
+def _terms(node, terms):
+    """Collects the text nodes that a match must (or may) contain, skipping negated ones."""
+    kind = node[0]
+    if kind == 'text':
+        terms.add(node)
+    elif kind in ('and', 'or'):
+        for child in node[1]:
+            _terms(child, terms)
+
+
+def _term_pattern(text, prefix):
+    # Tokens as the index sees them: a phrase matches whatever separates its words
+    tokens = tokenize(text)
+    if not tokens:
+        return None
+    pattern = f'(?<!{_WORD})' + '[^a-z0-9]+'.join(re.escape(token) for token in tokens)
+    return pattern + (f'{_WORD}*' if prefix else f'(?!{_WORD})')
+
+
+def query_matcher(node):
+    """One compiled pattern matching every positive text term of a parsed query, or None if it has none."""
+    if node is None:
+        return None
+    matcher = matcher_cache.get(node, False)
+    if matcher is False:
+        terms = set()
+        _terms(node, terms)
+        # Longest first, so a phrase wins over its own first word
+        patterns = sorted(filter(None, (_term_pattern(text, prefix) for _, text, prefix in terms)),
+                          key=lambda pattern: (-len(pattern), pattern))
+        matcher = re.compile('|'.join(patterns), re.IGNORECASE) if patterns else None
+        matcher_cache.set(node, matcher)
+    return matcher
+
+
+def make_snippet(matcher, body, length=None, scan_chars=None):
+    """
+    The excerpt of body around the first match of matcher, as HTML with
+    the matches in <mark>; the start of the body if nothing matches within
+    the first scan_chars characters.
+    """
+    if not body:
+        return None
+    length = length or Config.SEARCH_SNIPPET_LENGTH
+    window = body[:scan_chars or Config.SEARCH_SNIPPET_SCAN_CHARS]
+    matches = matcher.finditer(window)
+
+    marks = []
+    first = next(matches, None)
+    start = 0
+    if first is not None:
+        marks.append(first)
+        start = max(0, first.start() - length // 4)
+        if start:
+            space = window.rfind(' ', max(0, start - WORD_SLACK), start)
+            start = space + 1 if space >= 0 else start
+    end = start + length
+    for match in matches:
+        if match.start() >= end:
+            break
+        marks.append(match)
+    end = max(end, marks[-1].end()) if marks else end
+    if end < len(window):
+        space = window.find(' ', end, end + WORD_SLACK)
+        end = space if space >= 0 else end
+
+    parts = ['...' if start else '']
+    position = start
+    for match in marks:
+        parts.append(escape(_WHITESPACE.sub(' ', window[position:match.start()])))
+        parts.append(Markup('<mark>%s</mark>') % _WHITESPACE.sub(' ', match.group()))
+        position = match.end()
+    parts.append(escape(_WHITESPACE.sub(' ', window[position:end])))
+    parts.append('...' if end < len(body) else '')
+    return Markup(''.join(parts).strip())
+
+
+def page_snippets(session, node, email_ids):
+    """
+    {email id: snippet} for one page of results of the parsed query node.
+    Bodies are read in one query, for the emails without a cached
+    snippet; no snippet is made once the page has used
+    SEARCH_SNIPPET_BUDGET_MS.
+    """
+    matcher = query_matcher(node)
+    if matcher is None or not email_ids:
+        return {}
+
+    generation = result_cache.generation()
+    snippets = {}
+    missing = []
+    for email_id in email_ids[:IN_CLAUSE_LIMIT]:
+        snippet = snippet_cache.get((generation, node, email_id))
+        if snippet is None:
+            missing.append(email_id)
+        else:
+            snippets[email_id] = snippet
+    if not missing:
+        return snippets
+
+    started = time.perf_counter()
+    rows = session.execute(
+        body_select(Email.unique_email_id).where(Email.unique_email_id.in_(bindparam('snippet_ids', expanding=True))),
+        {'snippet_ids': pad_in_list(missing)}
+    ).all()
+    # Page order, so a spent budget leaves the bottom of the page without snippets
+    position = {email_id: i for i, email_id in enumerate(missing)}
+    rows.sort(key=lambda row: position[row.unique_email_id])
+
+    budget = Config.SEARCH_SNIPPET_BUDGET_MS / 1000
+    building = time.perf_counter()
+    skipped = 0
+    for email_id, body, codec, data in rows:
+        if time.perf_counter() - building > budget:
+            skipped += 1
+            continue
+        snippet = make_snippet(matcher, body_text(body, codec, data))
+        if snippet is not None:
+            snippets[email_id] = snippet
+            snippet_cache.set((generation, node, email_id), snippet)
+
+    if skipped:
+        metrics.incr('search.snippets.skipped', skipped)
+    metrics.record_timing('search.snippets', time.perf_counter() - started)
+    return snippets
@@ -1,21 +1,37 @@
 import math
 from functools import wraps
 import json
-from flask import request, session
+import base64
+import datetime
+from flask import request, session, current_app
 from flask_login import current_user
 from .models import UserActivity
+from .activity_writer import activity_writer
 from . import db_session
 
 class Pagination:
-    def __init__(self, page, per_page, total, items):
+    """
+    A page of results. ``total`` may be an exact count, a cached estimate or
+    None when counting was skipped; ``has_more`` (if known) overrides the
+    page arithmetic for has_next, and ``next_cursor`` lets the client seek
+    straight to the following page. ``snippets`` maps item ids to
+    highlighted excerpts, for searches that make them.
+    """
+    def __init__(self, page, per_page, total, items, next_cursor=None, has_more=None):
         self.page = page
         self.per_page = per_page
         self.total = total
         self.items = items
+        self.next_cursor = next_cursor
+        self.has_more = has_more
+        self.snippets = {}
 
     @property
     def pages(self):
-        return math.ceil(self.total / self.per_page)
+        if self.total is None:
+            return self.page + 1 if self.has_more else self.page
+        # A stale cached total must not hide the page we are on
+        return max(math.ceil(self.total / self.per_page), self.page + 1 if self.has_more else self.page)
 
     @property
     def has_prev(self):
@@ -27,6 +43,8 @@ class Pagination:
 
     @property
     def has_next(self):
+        if self.has_more is not None:
+            return self.has_more
         return self.page < self.pages
 
     @property
@@ -45,6 +63,21 @@ class Pagination:
                 yield num
                 last = num
 
+def encode_cursor(sort_value, key_value):
+    """Encodes the position after a row as an opaque keyset cursor."""
+    if hasattr(sort_value, 'isoformat'):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, key_value], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    """Returns (sort_value, key_value) from a cursor, or None if it is invalid."""
+    try:
+        sort_value, key_value = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    return sort_value, key_value
+
 def log_activity(activity_type, details=None):
     """Logs a user activity to the database."""
     if not current_user.is_authenticated or 'user_token' not in session:
@@ -60,11 +93,22 @@ def log_activity(activity_type, details=None):
     if request.referrer:
         details['referrer'] = request.referrer
 
+    if current_app.config['ACTIVITY_LOG_ASYNC']:
+        # Serialized and inserted in batches by the background writer
+        activity_writer.submit({
+            'user_id': current_user.id,
+            'token': session['user_token'],
+            'activity': activity_type,
+            'details': details,
+            'timestamp': datetime.datetime.utcnow(),
+        })
+        return
+
     activity = UserActivity(
         user_id=current_user.id,
         token=session['user_token'],
         activity=activity_type,
-        details=json.dumps(details, indent=2)
+        details=json.dumps(details, separators=(',', ':'))
     )
     db_session.add(activity)
     db_session.commit()
@@ -85,24 +129,3 @@ def track_activity(activity_template):
             return response
         return decorated_function
     return decorator
-
-
-def parse_search_query(query):
-    """
-    Parses a search query into three lists:
-    - search_terms: for general matching
-    - exact_phrases: for exact phrase matching (in quotes)
-    - exclusion_terms: for words to exclude (prefixed with -)
-    """
-    import re
-    # Find all quoted phrases
-    exact_phrases = re.findall(r'\"(.+?)\"', query)
-    # Remove the quoted phrases from the query to not process them again
-    query = re.sub(r'\"(.+?)\"', '', query)
-
-    terms = query.split()
-    
-    exclusion_terms = [term[1:] for term in terms if term.startswith('-') and len(term) > 1]
-    search_terms = [term for term in terms if not term.startswith('-')]
-    
-    return search_terms, exact_phrases, exclusion_terms